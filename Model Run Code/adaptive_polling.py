@@ -0,0 +1,84 @@
+"""
+Adaptive Sensor Polling for PharmaCopilot
+Chooses the delay before the next sensor poll from the outcome of the last one: shorter while readings
+keep changing, back towards the base interval when they stop or the source has nothing new, and
+exponential backoff with jitter while the upstream API is failing
+"""
+
+import random
+import time
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+# Poll outcomes
+UPDATED = 'updated'        # new source timestamp with changed values
+UNCHANGED = 'unchanged'    # new source timestamp, same values as the previous reading
+DUPLICATE = 'duplicate'    # source timestamp already seen, reading skipped
+FAILED = 'failed'          # upstream error or unusable response
+OUTCOMES = (UPDATED, UNCHANGED, DUPLICATE, FAILED)
+
+class AdaptivePollInterval:
+    """Next-poll delay and poll statistics.
+
+    A changed reading shortens the delay by `speedup` (not below `minimum`), so new rows are picked
+    up soon after the source writes them; unchanged and duplicate readings stretch it by `relax`
+    back to `base`. After n consecutive failures the delay is base * backoff^n, capped at `maximum`,
+    with +-`jitter` so several pollers don't retry in lockstep.
+    """
+
+    def __init__(self, base: float = 10.0, minimum: float = 2.5, maximum: float = 300.0, speedup: float = 0.5,
+                 relax: float = 1.5, backoff: float = 2.0, jitter: float = 0.1, seed: Optional[int] = None):
+        self.base = base
+        self.minimum = min(minimum, base)
+        self.maximum = max(maximum, base)
+        self.speedup = speedup
+        self.relax = relax
+        self.backoff = backoff
+        self.jitter = jitter
+        self._random = random.Random(seed)
+        self.interval = base
+        self.consecutive_failures = 0
+        self.counts = {outcome: 0 for outcome in OUTCOMES}
+        self.polls = 0
+        self.last_poll: Optional[float] = None
+        self.last_success: Optional[float] = None
+        self.last_outcome: Optional[str] = None
+
+    def next_delay(self, outcome: str) -> float:
+        """Record a poll outcome, returns the seconds until the next poll"""
+        self.polls += 1
+        self.counts[outcome] += 1
+        self.last_outcome = outcome
+        self.last_poll = time.time()
+
+        if outcome == FAILED:
+            self.consecutive_failures += 1
+            delay = min(self.maximum, self.base * self.backoff ** self.consecutive_failures)
+            return delay * (1.0 + self._random.uniform(-self.jitter, self.jitter))
+
+        self.consecutive_failures = 0
+        self.last_success = self.last_poll
+        if outcome == UPDATED:
+            self.interval = max(self.minimum, self.interval * self.speedup)
+        else:
+            self.interval = min(self.base, self.interval * self.relax)
+        return self.interval
+
+    def get_stats(self) -> Dict[str, Any]:
+        def iso(ts: Optional[float]) -> Optional[str]:
+            return datetime.fromtimestamp(ts).isoformat() if ts else None
+
+        return {
+            "base_interval_s": self.base,
+            "min_interval_s": self.minimum,
+            "max_backoff_s": self.maximum,
+            "current_interval_s": round(self.interval, 3),
+            "backing_off": self.consecutive_failures > 0,
+            "consecutive_failures": self.consecutive_failures,
+            "polls": self.polls,
+            **{outcome: count for outcome, count in self.counts.items()},
+            "skip_rate": round(self.counts[DUPLICATE] / self.polls, 4) if self.polls else 0.0,
+            "last_outcome": self.last_outcome,
+            "last_poll": iso(self.last_poll),
+            "last_success": iso(self.last_success)
+        }
@@ -0,0 +1,250 @@
+"""
+Streaming Anomaly Detection for PharmaCopilot
+Per-sensor EWMA control limits, two-sided CUSUM and Page-Hinkley drift tests, updated once per
+sample with constant memory (one NumPy vector per statistic, all sensors at once)
+
+Usage:
+    python anomaly_detection.py --benchmark --samples 200000
+"""
+
+import argparse
+import time
+from collections import deque
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+DETECTORS = ('ewma', 'cusum', 'page_hinkley')
+
+class StreamingSensorMonitor:
+    """Shift and drift detectors for every sensor.
+
+    The first `warmup` samples estimate each sensor's in-control mean and standard deviation
+    (Welford); afterwards every sample is standardised against that baseline and fed to:
+      - EWMA chart: alarm when |EWMA| exceeds L * sqrt(lambda / (2 - lambda)) sigma
+      - CUSUM: one-sided sums with allowance k, alarm above h (in sigma)
+      - Page-Hinkley: cumulative deviation from the running mean minus delta, alarm above threshold
+    CUSUM and Page-Hinkley restart their statistics after each signal and keep the alarm latched until
+    `acknowledge()`, so a persisting shift is one event; the EWMA alarm follows the chart. `reset()` re-learns the baseline (e.g. on a new batch).
+    """
+
+    def __init__(self, sensors: Sequence[str], warmup: int = 60, ewma_lambda: float = 0.2, ewma_width: float = 3.5,
+                 cusum_k: float = 0.5, cusum_h: float = 8.0, ph_delta: float = 0.25, ph_threshold: float = 15.0,
+                 max_events: int = 100):
+        self.sensors = list(sensors)
+        self.warmup = max(2, warmup)
+        self.ewma_lambda = ewma_lambda
+        self.ewma_limit = ewma_width * np.sqrt(ewma_lambda / (2 - ewma_lambda))
+        self.cusum_k = cusum_k
+        self.cusum_h = cusum_h
+        self.ph_delta = ph_delta
+        self.ph_threshold = ph_threshold
+        self.events = deque(maxlen=max_events)
+        self.event_count = 0
+        self.reset()
+
+    def reset(self, reason: Optional[str] = None):
+        """Forget the baseline and all detector state"""
+        n = len(self.sensors)
+        self.samples = 0
+        self.skipped = 0
+        self._last = np.zeros(n)
+        # Welford accumulators for the baseline
+        self._count = 0
+        self._mean = np.zeros(n)
+        self._m2 = np.zeros(n)
+        self.baseline_mean = None
+        self.baseline_std = None
+        # Detector statistics (standardised units)
+        self.ewma = np.zeros(n)
+        self.cusum_pos = np.zeros(n)
+        self.cusum_neg = np.zeros(n)
+        self._ph_count = 0
+        self._ph_mean = np.zeros(n)
+        self.ph_pos = np.zeros(n)
+        self.ph_pos_min = np.zeros(n)
+        self.ph_neg = np.zeros(n)
+        self.ph_neg_max = np.zeros(n)
+        self.alarms = {name: np.zeros(n, dtype=bool) for name in DETECTORS}
+        # Limit crossings (EWMA) and signals (cumulative tests, also while latched)
+        self.signal_counts = {name: 0 for name in DETECTORS}
+        self.reset_reason = reason
+
+    @property
+    def warming_up(self) -> bool:
+        return self.baseline_mean is None
+
+    def update(self, values: Sequence[float], skip: bool = False):
+        """Feed one sample (one value per sensor); `skip` counts but ignores it (e.g. downtime)"""
+        if skip:
+            self.skipped += 1
+            return
+        x = np.asarray(values, dtype=np.float64)
+        self.samples += 1
+        self._last = x
+
+        if self.baseline_mean is None:
+            self._count += 1
+            delta = x - self._mean
+            self._mean += delta / self._count
+            self._m2 += delta * (x - self._mean)
+            if self._count >= self.warmup:
+                self.baseline_mean = self._mean.copy()
+                std = np.sqrt(self._m2 / (self._count - 1))
+                # Constant sensors (e.g. zero waste) would otherwise alarm on any change at all
+                self.baseline_std = np.maximum(std, 1e-3 * np.maximum(np.abs(self._mean), 1.0))
+            return
+
+        z = (x - self.baseline_mean) / self.baseline_std
+
+        # EWMA chart
+        self.ewma += self.ewma_lambda * (z - self.ewma)
+        ewma_alarm = np.abs(self.ewma) > self.ewma_limit
+
+        # Two-sided CUSUM (updated in place, no temporaries kept)
+        self.cusum_pos += z
+        self.cusum_pos -= self.cusum_k
+        np.maximum(self.cusum_pos, 0.0, out=self.cusum_pos)
+        self.cusum_neg -= z
+        self.cusum_neg -= self.cusum_k
+        np.maximum(self.cusum_neg, 0.0, out=self.cusum_neg)
+        cusum_alarm = np.maximum(self.cusum_pos, self.cusum_neg) > self.cusum_h
+
+        # Page-Hinkley (increase and decrease)
+        self._ph_count += 1
+        self._ph_mean += (z - self._ph_mean) / self._ph_count
+        deviation = z - self._ph_mean
+        self.ph_pos += deviation - self.ph_delta
+        np.minimum(self.ph_pos_min, self.ph_pos, out=self.ph_pos_min)
+        self.ph_neg += deviation + self.ph_delta
+        np.maximum(self.ph_neg_max, self.ph_neg, out=self.ph_neg_max)
+        ph_alarm = np.maximum(self.ph_pos - self.ph_pos_min, self.ph_neg_max - self.ph_neg) > self.ph_threshold
+
+        if ewma_alarm.any() or self.alarms['ewma'].any() or cusum_alarm.any() or ph_alarm.any():
+            self._record(z, ewma=ewma_alarm, cusum=cusum_alarm, page_hinkley=ph_alarm)
+
+        # Restart the cumulative tests that signalled
+        if cusum_alarm.any():
+            self.cusum_pos[cusum_alarm] = 0.0
+            self.cusum_neg[cusum_alarm] = 0.0
+        if ph_alarm.any():
+            self.ph_pos[ph_alarm] = self.ph_pos_min[ph_alarm] = 0.0
+            self.ph_neg[ph_alarm] = self.ph_neg_max[ph_alarm] = 0.0
+
+    def _record(self, z: np.ndarray, ewma: np.ndarray, cusum: np.ndarray, page_hinkley: np.ndarray):
+        # An event is raised when a flag turns on; the EWMA flag follows the chart, the cumulative tests latch
+        onsets = {name: alarm & ~self.alarms[name] for name, alarm in
+                  (('ewma', ewma), ('cusum', cusum), ('page_hinkley', page_hinkley))}
+        self.signal_counts['ewma'] += int(onsets['ewma'].sum())
+        self.signal_counts['cusum'] += int(cusum.sum())
+        self.signal_counts['page_hinkley'] += int(page_hinkley.sum())
+        self.alarms['ewma'] = ewma
+        self.alarms['cusum'] |= cusum
+        self.alarms['page_hinkley'] |= page_hinkley
+        for detector, onset in onsets.items():
+            if not onset.any():
+                continue
+            for index in np.flatnonzero(onset):
+                self.event_count += 1
+                self.events.append({
+                    "sensor": self.sensors[index],
+                    "detector": detector,
+                    "direction": "up" if z[index] >= 0 else "down",
+                    "value": float(self._last[index]),
+                    "z_score": round(float(z[index]), 3),
+                    "sample": self.samples,
+                    "timestamp": datetime.now().isoformat()
+                })
+
+    def acknowledge(self, sensor: Optional[str] = None):
+        """Clear latched CUSUM / Page-Hinkley alarms (all sensors or one)"""
+        for detector in ('cusum', 'page_hinkley'):
+            if sensor is None:
+                self.alarms[detector][:] = False
+            else:
+                self.alarms[detector][self.sensors.index(sensor)] = False
+
+    def status(self, max_events: int = 20) -> Dict[str, Any]:
+        sensors = {}
+        for index, name in enumerate(self.sensors):
+            entry = {"value": float(self._last[index]), "alarms": {d: bool(self.alarms[d][index]) for d in DETECTORS}}
+            if not self.warming_up:
+                entry.update({
+                    "baseline_mean": round(float(self.baseline_mean[index]), 4),
+                    "baseline_std": round(float(self.baseline_std[index]), 4),
+                    "ewma": round(float(self.ewma[index]), 4),
+                    "cusum_pos": round(float(self.cusum_pos[index]), 4),
+                    "cusum_neg": round(float(self.cusum_neg[index]), 4),
+                    "page_hinkley_pos": round(float(self.ph_pos[index] - self.ph_pos_min[index]), 4),
+                    "page_hinkley_neg": round(float(self.ph_neg_max[index] - self.ph_neg[index]), 4)
+                })
+            sensors[name] = entry
+        return {
+            "samples": self.samples,
+            "skipped_samples": self.skipped,
+            "warming_up": self.warming_up,
+            "warmup_samples": self.warmup,
+            "active": sorted({name for name, entry in sensors.items() if any(entry["alarms"].values())}),
+            "limits": {"ewma": round(float(self.ewma_limit), 4), "cusum_h": self.cusum_h,
+                       "page_hinkley_threshold": self.ph_threshold},
+            "sensors": sensors,
+            "signal_counts": dict(self.signal_counts),
+            "event_count": self.event_count,
+            "recent_events": list(self.events)[-max_events:] if max_events > 0 else [],
+            "reset_reason": self.reset_reason
+        }
+
+def benchmark(samples: int = 100000, n_sensors: int = 7, shift: float = 1.5) -> Dict[str, Any]:
+    """Per-sample update cost, in-control false alarm rate and detection delay on synthetic data"""
+    rng = np.random.default_rng(0)
+    rows: List[List[float]] = rng.normal(100.0, 5.0, size=(samples, n_sensors)).tolist()
+    sensors = [f"sensor_{i}" for i in range(n_sensors)]
+
+    monitor = StreamingSensorMonitor(sensors)
+    start = time.perf_counter()
+    for row in rows:
+        monitor.update(row)
+    elapsed = time.perf_counter() - start
+    in_control = samples - monitor.warmup
+    false_alarms = monitor.signal_counts
+
+    # Detection delay: shift sensor_0 by `shift` sigma 200 samples after warm-up, per detector
+    delays = {}
+    for detector in DETECTORS:
+        runs = []
+        for trial in range(20):
+            probe = StreamingSensorMonitor(sensors)
+            shift_at = probe.warmup + 200
+            data = rng.normal(100.0, 5.0, size=(shift_at + 500, n_sensors))
+            data[shift_at:, 0] += shift * 5.0
+            for step, row in enumerate(data.tolist()):
+                probe.update(row)
+                if step == shift_at - 1:
+                    probe.acknowledge()
+                if step >= shift_at and probe.alarms[detector][0]:
+                    runs.append(step - shift_at + 1)
+                    break
+        delays[detector] = float(np.median(runs)) if runs else None
+
+    return {
+        "samples": samples,
+        "sensors": n_sensors,
+        "elapsed_s": round(elapsed, 3),
+        "us_per_sample": round(elapsed / samples * 1e6, 2),
+        "samples_per_second": int(samples / elapsed),
+        "in_control_run_length": {d: round(in_control * n_sensors / n) if n else None for d, n in false_alarms.items()},
+        f"median_delay_{shift}_sigma_shift": delays
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Streaming sensor anomaly detectors')
+    parser.add_argument('--benchmark', action='store_true', help='Measure the per-sample update cost')
+    parser.add_argument('--samples', type=int, default=100000)
+    args = parser.parse_args()
+    if args.benchmark:
+        for key, value in benchmark(args.samples).items():
+            print(f"{key:>32}: {value}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,276 @@
+"""
+Batch-Lifetime Features for PharmaCopilot
+Accumulates the batch-level process features of Process.csv (total_waste, startup_waste, SREL_startup_mean,
+tbl_speed_0_duration, ...) over every reading of the running batch in O(1) per reading, so the
+classifiers see the whole batch instead of the last 60 points; closed batches are appended to a CSV
+"""
+
+import csv
+import logging
+import math
+import os
+from collections import deque
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Batch-level process features produced here, in feature_names.txt order (plus two Process.csv extras)
+LIFETIME_FEATURES = [
+    'tbl_speed_mean', 'tbl_speed_change', 'total_waste', 'startup_waste', 'fom_mean', 'fom_change',
+    'SREL_startup_mean', 'SREL_production_mean', 'main_CompForce mean', 'main_CompForce_sd',
+    'pre_CompForce_mean', 'tbl_fill_mean', 'tbl_fill_sd', 'stiffness_mean', 'ejection_mean',
+    'tbl_speed_0_duration', 'SREL_production_max'
+]
+
+# Production-phase means / standard deviations: feature -> sensor column of the time series
+PRODUCTION_MEANS = {
+    'SREL_production_mean': 'SREL',
+    'main_CompForce mean': 'main_comp',
+    'pre_CompForce_mean': 'pre_comp',
+    'tbl_fill_mean': 'tbl_fill',
+    'stiffness_mean': 'stiffness',
+    'ejection_mean': 'ejection'
+}
+PRODUCTION_SDS = {'main_CompForce_sd': 'main_comp', 'tbl_fill_sd': 'tbl_fill'}
+
+# Reading fields the accumulator looks at
+READING_FIELDS = sorted({'tbl_speed', 'produced', 'waste', 'fom'} | set(PRODUCTION_MEANS.values()))
+
+STARTUP = 'startup'
+PRODUCTION = 'production'
+
+HISTORY_COLUMNS = ['batch', 'campaign', 'code', 'started', 'closed', 'readings', 'production_readings',
+                   'joined_mid_batch'] + LIFETIME_FEATURES
+
+class RunningMoments:
+    """Count, mean, sample variance (Welford) and maximum of a stream"""
+
+    __slots__ = ('count', 'mean', 'm2', 'max')
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.max = -math.inf
+
+    def update(self, x: float):
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (x - self.mean)
+        if x > self.max:
+            self.max = x
+
+    @property
+    def std(self) -> float:
+        return math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else 0.0
+
+def parse_reading(data: Dict[str, Any]) -> Dict[str, float]:
+    """Numeric fields of a sensor API reading (timestamps and non-numeric fields dropped)"""
+    reading = {}
+    for key, value in data.items():
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            continue
+        if math.isfinite(value):
+            reading[key] = value
+    return reading
+
+class BatchFeatureAccumulator:
+    """Process.csv features of one batch, updated per reading.
+
+    Definitions follow the Process.csv aggregates as far as the 10 s time series reproduce them:
+    the batch is in startup until the produced counter first moves, production rows are the
+    rows after that with the table turning; waste is a cumulative counter, so startup_waste is
+    its value when production starts and total_waste its maximum. Counts and durations are in
+    readings divided by the product's normalization factor, like the table. fom_change and
+    SREL_startup_mean come from finer data than the stream and are only approximated.
+    """
+
+    def __init__(self, batch: int, campaign: Optional[int] = None, code: Optional[int] = None,
+                 normalization_factor: float = 1.0):
+        self.batch = batch
+        self.campaign = campaign
+        self.code = code
+        self.normalization_factor = normalization_factor if normalization_factor and normalization_factor > 0 else 1.0
+        self.phase = STARTUP
+        self.started = datetime.now().isoformat()
+        self.readings = 0
+        self.production_readings = 0
+        self.joined_mid_batch = False
+        self.speed_zero = 0
+        self.speed_changes = 0
+        self.fom_changes = 0
+        self.max_waste = 0.0
+        self.startup_waste: Optional[float] = None
+        self.last: Dict[str, float] = {}
+        self.running = {'tbl_speed': RunningMoments(), 'fom': RunningMoments()}
+        self.startup_srel = RunningMoments()
+        self.production = {column: RunningMoments() for column in set(PRODUCTION_MEANS.values())}
+
+    def update(self, reading: Dict[str, float]):
+        """Add one reading (sensor column -> value)"""
+        speed = reading.get('tbl_speed')
+        produced = reading.get('produced')
+        waste = reading.get('waste')
+        fom = reading.get('fom')
+        turning = speed is not None and speed > 0
+
+        if self.readings == 0 and produced is not None and produced > 0:
+            # Started mid-batch (e.g. after a restart): the startup phase was not seen
+            self.joined_mid_batch = True
+        if self.phase == STARTUP and produced is not None and produced > 0:
+            self.phase = PRODUCTION
+            self.startup_waste = waste
+        self.readings += 1
+
+        if speed is not None:
+            self.speed_zero += not turning
+            # The first reading counts as a change, as in Process.csv
+            self.speed_changes += speed != self.last.get('tbl_speed')
+        if waste is not None:
+            self.max_waste = max(self.max_waste, waste)
+        if turning:
+            self.running['tbl_speed'].update(speed)
+            if fom is not None:
+                self.running['fom'].update(fom)
+            if self.phase == STARTUP and 'SREL' in reading:
+                self.startup_srel.update(reading['SREL'])
+
+        if self.phase == PRODUCTION:
+            if fom is not None and 'fom' in self.last and fom != self.last['fom']:
+                self.fom_changes += 1
+            if turning:
+                self.production_readings += 1
+                for column, moments in self.production.items():
+                    if column in reading:
+                        moments.update(reading[column])
+        self.last = reading
+
+    def features(self) -> Dict[str, float]:
+        """Features accumulated so far (those without data yet are left out)"""
+        norm = self.normalization_factor
+        features = {
+            'tbl_speed_change': self.speed_changes / norm,
+            'tbl_speed_0_duration': self.speed_zero / norm,
+            'total_waste': self.max_waste / norm,
+            # Still in startup: the waste so far is the startup waste
+            'startup_waste': self.startup_waste if self.startup_waste is not None else self.max_waste,
+            'fom_change': float(self.fom_changes)
+        }
+        if self.running['tbl_speed'].count:
+            features['tbl_speed_mean'] = self.running['tbl_speed'].mean
+        if self.running['fom'].count:
+            features['fom_mean'] = self.running['fom'].mean
+        if self.startup_srel.count:
+            features['SREL_startup_mean'] = self.startup_srel.mean
+        for name, column in PRODUCTION_MEANS.items():
+            if self.production[column].count:
+                features[name] = self.production[column].mean
+        for name, column in PRODUCTION_SDS.items():
+            if self.production[column].count:
+                features[name] = self.production[column].std
+        if self.production['SREL'].count:
+            features['SREL_production_max'] = self.production['SREL'].max
+        return features
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "batch": self.batch,
+            "campaign": self.campaign,
+            "code": self.code,
+            "phase": self.phase,
+            "started": self.started,
+            "readings": self.readings,
+            "production_readings": self.production_readings,
+            "joined_mid_batch": self.joined_mid_batch,
+            "normalization_factor": self.normalization_factor,
+            "features": self.features()
+        }
+
+class BatchFeatureTracker:
+    """Accumulator of the running batch, keyed by (campaign, batch).
+
+    A reading from another batch closes the running accumulator: it is appended to `history_path`
+    (semicolon separated like Process.csv, empty path disables) and kept in `recent`.
+    """
+
+    def __init__(self, normalization_factor: Callable[[Optional[int], Optional[int]], float],
+                 history_path: Optional[str] = None, min_production_readings: int = 30, keep_recent: int = 20):
+        self.normalization_factor = normalization_factor
+        self.history_path = history_path or None
+        self.min_production_readings = min_production_readings
+        self.current: Optional[BatchFeatureAccumulator] = None
+        self.recent: deque = deque(maxlen=keep_recent)
+        self.closed = 0
+        self.persist_failures = 0
+
+    @property
+    def key(self) -> Optional[Tuple[Optional[int], int]]:
+        return (self.current.campaign, self.current.batch) if self.current is not None else None
+
+    def update(self, reading: Dict[str, float], batch: Optional[int], campaign: Optional[int] = None,
+               code: Optional[int] = None) -> bool:
+        """Add a reading of `batch`, returns whether it was accumulated (readings without a batch id are not)"""
+        if batch is None:
+            return False
+        if self.key != (campaign, batch):
+            self.close()
+            self.current = BatchFeatureAccumulator(batch, campaign, code, self.normalization_factor(batch, code))
+            logger.info(f"Accumulating batch features for batch {batch} (campaign {campaign}, product code {code})")
+        self.current.update(reading)
+        return True
+
+    def close(self):
+        """Close the running batch, persisting its features"""
+        if self.current is None:
+            return
+        closed = self.current.describe()
+        closed["closed"] = datetime.now().isoformat()
+        self.current = None
+        self.closed += 1
+        self.recent.append(closed)
+        if self.history_path:
+            try:
+                self._append(closed)
+            except OSError as e:
+                self.persist_failures += 1
+                logger.error(f"Could not persist features of batch {closed['batch']}: {e}")
+        logger.info(f"Closed batch {closed['batch']} after {closed['readings']} readings "
+                    f"({closed['production_readings']} in production)")
+
+    def reset(self):
+        """Drop the running batch without closing it"""
+        self.current = None
+
+    def _append(self, closed: Dict[str, Any]):
+        new_file = not os.path.exists(self.history_path) or os.path.getsize(self.history_path) == 0
+        row = {**closed, **closed["features"]}
+        with open(self.history_path, 'a', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=HISTORY_COLUMNS, delimiter=';', extrasaction='ignore')
+            if new_file:
+                writer.writeheader()
+            writer.writerow(row)
+
+    def state(self) -> Optional[Dict[str, Any]]:
+        """Running batch with its features; `ready` once enough production readings back them"""
+        if self.current is None:
+            return None
+        state = self.current.describe()
+        state["ready"] = state["production_readings"] >= self.min_production_readings
+        return state
+
+    def recent_batches(self, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        batches = list(reversed(self.recent))
+        return batches[:limit] if limit is not None else batches
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "running": list(self.key) if self.key is not None else None,
+            "closed": self.closed,
+            "history_path": self.history_path,
+            "persist_failures": self.persist_failures,
+            "min_production_readings": self.min_production_readings
+        }
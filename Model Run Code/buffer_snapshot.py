@@ -0,0 +1,87 @@
+"""
+Buffer Snapshot for PharmaCopilot
+Persists the sensor buffers and the last pipeline results to a small memory-mapped file on every tick,
+so a restarted server can forecast immediately instead of waiting 10 minutes for 60 new points.
+
+The file uses the shared_state.py layout; each tick is a handful of stores into the page cache and
+survives a process crash. A write interrupted mid-way leaves an odd sequence number and is discarded.
+"""
+
+import logging
+import mmap
+import os
+from typing import Any, Dict, Optional
+
+from shared_state import SensorStateBuffer
+
+logger = logging.getLogger(__name__)
+
+# Room for the JSON pipeline snapshot (a full snapshot is ~15 KB)
+SNAPSHOT_FILE_BYTES = 256 * 1024
+
+class PersistentSensorState(SensorStateBuffer):
+    """Sensor state in a memory-mapped file"""
+
+    def __init__(self, path: str, file, mapping: mmap.mmap):
+        super().__init__(mapping)
+        self.path = path
+        self._file = file
+        self._mapping = mapping
+        self.torn_on_open = self.torn
+        self.repair_sequence()
+
+    @classmethod
+    def open(cls, path: str, capacity: int = 60, n_sensors: int = 7,
+             snapshot_bytes: int = SNAPSHOT_FILE_BYTES) -> 'PersistentSensorState':
+        """Map the snapshot file, starting a fresh one if it is missing or has a different layout"""
+        size = cls.segment_size(capacity, n_sensors, snapshot_bytes)
+        exists = os.path.exists(path) and os.path.getsize(path) == size
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        file = open(path, 'r+b' if exists else 'w+b')
+        if not exists:
+            file.truncate(size)
+        mapping = mmap.mmap(file.fileno(), size)
+
+        if not exists or not cls.has_layout(mapping, capacity, n_sensors):
+            if exists:
+                logger.warning(f"Buffer snapshot {path} has a different layout, starting a new one")
+            cls.initialize(mapping, capacity, n_sensors, snapshot_bytes)
+
+        return cls(path, file, mapping)
+
+    def restore(self, max_age_seconds: float) -> Optional[Dict[str, Any]]:
+        """Buffers, batch context and pipeline snapshot from the previous run, None if missing, torn or stale"""
+        age = self.last_write_age()
+        if age is None:
+            logger.info(f"No buffer snapshot to restore in {self.path}")
+            return None
+        if self.torn_on_open:
+            logger.warning("Buffer snapshot was interrupted mid-write, not restoring")
+            return None
+        if age > max_age_seconds or age < -60:
+            logger.warning(f"Buffer snapshot is {age:.0f}s old (limit {max_age_seconds:.0f}s), not restoring")
+            return None
+
+        sequence, snapshot = self.read_snapshot()
+        return {
+            "raw": self.read_rows('raw'),
+            "processed": self.read_rows('processed'),
+            "snapshot": snapshot,
+            "context": self.batch_context(),
+            "sequence": sequence,
+            "age_seconds": age
+        }
+
+    def flush(self):
+        """Force the mapped pages to disk (the kernel writes them back on its own otherwise)"""
+        self._mapping.flush()
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self._release_views()
+            self._mapping.close()
+            self._file.close()
@@ -0,0 +1,50 @@
+"""
+Conditional Requests for PharmaCopilot
+Weak ETags for the prediction and sensor endpoints derived from the buffer and model versions, so polls
+between two sensor ticks are answered with 304 Not Modified without recomputing or serializing anything
+"""
+
+import hashlib
+from typing import Any, Dict, Optional
+
+def make_etag(*parts) -> str:
+    """Weak validator over the state a response depends on (its body also carries timestamps)"""
+    digest = hashlib.sha1(':'.join(str(part) for part in parts).encode()).hexdigest()[:20]
+    return f'W/"{digest}"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Weak comparison of an If-None-Match header (a list of tags or '*') against `etag`"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    opaque = etag[2:] if etag.startswith('W/') else etag
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if (candidate[2:] if candidate.startswith('W/') else candidate) == opaque:
+            return True
+    return False
+
+class ConditionalGetStats:
+    """Per-route counts of revalidations answered with 304 versus full responses"""
+
+    def __init__(self):
+        self._routes: Dict[str, Dict[str, int]] = {}
+
+    def record(self, route: str, not_modified: bool, conditional: bool):
+        stats = self._routes.setdefault(route, {"requests": 0, "conditional": 0, "not_modified": 0})
+        stats["requests"] += 1
+        stats["conditional"] += conditional
+        stats["not_modified"] += not_modified
+
+    def get_stats(self) -> Dict[str, Any]:
+        routes = {}
+        for route, stats in self._routes.items():
+            routes[route] = {
+                **stats,
+                "hit_rate": round(stats["not_modified"] / stats["requests"], 4) if stats["requests"] else 0.0,
+                "revalidation_hit_rate": round(stats["not_modified"] / stats["conditional"], 4) if stats["conditional"] else 0.0
+            }
+        total = sum(stats["requests"] for stats in self._routes.values())
+        hits = sum(stats["not_modified"] for stats in self._routes.values())
+        return {"requests": total, "not_modified": hits, "hit_rate": round(hits / total, 4) if total else 0.0, "routes": routes}
@@ -0,0 +1,150 @@
+"""
+Batch Feature Store for PharmaCopilot
+Loads the batch-level Laboratory / Process / Normalization tables once into a typed feature matrix
+indexed by batch and product code, so the classifiers get the real static features of the running batch
+"""
+
+import logging
+import os
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from training_data import TABLE_DATA_DIR
+
+logger = logging.getLogger(__name__)
+
+# Static (per batch) classifier inputs, in feature_names.txt order
+STATIC_FEATURES = [
+    'code', 'strength_encoded', 'weekend_encoded', 'start_month', 'normalization_factor',
+    'api_content', 'lactose_water', 'smcc_water', 'smcc_td', 'smcc_bd',
+    'starch_ph', 'starch_water', 'tbl_min_thickness', 'tbl_max_thickness'
+]
+LAB_FEATURES = STATIC_FEATURES[5:]
+
+# Used only when the tables are not deployed next to the server
+DEFAULT_STATIC_FEATURES = {
+    'code': 25, 'strength_encoded': 0, 'weekend_encoded': 0, 'start_month': datetime.now().month,
+    'normalization_factor': 1.0, 'api_content': 94.4, 'lactose_water': 4.5, 'smcc_water': 2.8,
+    'smcc_td': 0.5, 'smcc_bd': 0.3, 'starch_ph': 7.0, 'starch_water': 12.0,
+    'tbl_min_thickness': 3.5, 'tbl_max_thickness': 4.2
+}
+
+# Month spellings found in Laboratory.csv 'start' (e.g. 'nov.18', 'maj.19', 'okt.20'), as in the training notebook
+MONTH_ABBREVIATIONS = {
+    'jan': 1, 'feb': 2, 'mar': 3, 'apr': 4, 'may': 5, 'maj': 5, 'jun': 6, 'jul': 7,
+    'aug': 8, 'avg': 8, 'sep': 9, 'oct': 10, 'okt': 10, 'nov': 11, 'dec': 12
+}
+
+def parse_start_month(value) -> float:
+    """Month number of a 'mon.yy' start date, NaN if it can't be parsed"""
+    text = str(value).strip().lower()
+    month = MONTH_ABBREVIATIONS.get(text.split('.')[0])
+    if month is not None:
+        return float(month)
+    parsed = pd.to_datetime(text, errors='coerce')
+    return float(parsed.month) if not pd.isna(parsed) else np.nan
+
+class BatchFeatureStore:
+    """Static feature vectors per batch, with per-product and global fallbacks.
+
+    `matrix` holds one float64 row per batch (columns STATIC_FEATURES); `batch_index` and
+    `product_index` map ids to rows, so a lookup is a dict hit and a row view.
+    """
+
+    def __init__(self, matrix: np.ndarray, batch_index: Dict[int, int], product_matrix: np.ndarray,
+                 product_index: Dict[int, int], default_row: np.ndarray, source: Optional[str]):
+        self.matrix = matrix
+        self.batch_index = batch_index
+        self.product_matrix = product_matrix
+        self.product_index = product_index
+        self.default_row = default_row
+        self.source = source
+
+    @classmethod
+    def defaults(cls) -> 'BatchFeatureStore':
+        """Store without tables, every lookup returns the training-time defaults"""
+        empty = np.empty((0, len(STATIC_FEATURES)))
+        default_row = np.array([DEFAULT_STATIC_FEATURES[name] for name in STATIC_FEATURES], dtype=np.float64)
+        return cls(empty, {}, empty, {}, default_row, None)
+
+    @classmethod
+    def from_tables(cls, data_dir: Optional[str] = None) -> 'BatchFeatureStore':
+        """Build the store with the same merge and encodings as the Phase-1 training notebook"""
+        data_dir = data_dir or TABLE_DATA_DIR
+        process = pd.read_csv(os.path.join(data_dir, 'Process.csv'), sep=';', usecols=['batch', 'code', 'weekend'])
+        laboratory = pd.read_csv(os.path.join(data_dir, 'Laboratory.csv'), sep=';',
+                                 usecols=['batch', 'code', 'strength', 'start'] + LAB_FEATURES)
+        normalization = pd.read_csv(os.path.join(data_dir, 'Normalization.csv'), sep=';')
+        normalization.columns = ['code', 'batch_size_tablets', 'normalization_factor']
+
+        merged = pd.merge(process, laboratory, on=['batch', 'code'], how='inner')
+        merged = pd.merge(merged, normalization[['code', 'normalization_factor']], on='code', how='left')
+
+        for column in LAB_FEATURES:
+            merged[column] = pd.to_numeric(merged[column], errors='coerce')
+            merged[column] = merged[column].fillna(merged[column].median())
+
+        # LabelEncoder equivalents: codes are the positions in the sorted unique values
+        merged['strength_encoded'] = np.unique(merged['strength'].astype(str), return_inverse=True)[1]
+        merged['weekend_encoded'] = np.unique(merged['weekend'].astype(str), return_inverse=True)[1]
+        merged['start_month'] = merged['start'].map(parse_start_month)
+        merged['start_month'] = merged['start_month'].fillna(merged['start_month'].median())
+
+        merged = merged.drop_duplicates('batch', keep='last').sort_values('batch')
+        matrix = np.ascontiguousarray(merged[STATIC_FEATURES].to_numpy(dtype=np.float64))
+        batch_index = {int(batch): row for row, batch in enumerate(merged['batch'])}
+
+        # Product fallback: median batch of the product, normalization factor even for products without batches
+        product_frame = merged.groupby('code')[STATIC_FEATURES].median()
+        factors = normalization.set_index('code')['normalization_factor']
+        product_frame = product_frame.reindex(product_frame.index.union(factors.index))
+        product_frame['code'] = product_frame.index
+        product_frame['normalization_factor'] = factors.reindex(product_frame.index).fillna(
+            product_frame['normalization_factor'])
+        default_row = np.array(merged[STATIC_FEATURES].median(), dtype=np.float64)
+        default_row[STATIC_FEATURES.index('code')] = merged['code'].mode().iloc[0]
+        product_frame = product_frame.fillna(pd.Series(default_row, index=STATIC_FEATURES))
+        product_matrix = np.ascontiguousarray(product_frame[STATIC_FEATURES].to_numpy(dtype=np.float64))
+        product_index = {int(code): row for row, code in enumerate(product_frame.index)}
+
+        logger.info(f"Batch feature store: {len(batch_index)} batches, {len(product_index)} products from {data_dir}")
+        return cls(matrix, batch_index, product_matrix, product_index, default_row, os.path.abspath(data_dir))
+
+    def lookup(self, batch: Optional[int] = None, code: Optional[int] = None) -> Tuple[np.ndarray, str]:
+        """(feature row, resolution) where resolution is 'batch', 'product' or 'default'"""
+        row = self.batch_index.get(batch) if batch is not None else None
+        if row is not None:
+            return self.matrix[row], 'batch'
+        row = self.product_index.get(code) if code is not None else None
+        if row is not None:
+            return self.product_matrix[row], 'product'
+        return self.default_row, 'default'
+
+    def features(self, batch: Optional[int] = None, code: Optional[int] = None) -> Dict[str, float]:
+        """Static features of a batch as a feature-name dict"""
+        values, resolution = self.lookup(batch, code)
+        features = dict(zip(STATIC_FEATURES, values.tolist()))
+        if resolution != 'batch':
+            # A batch missing from the tables is the one running now
+            features['start_month'] = float(datetime.now().month)
+        return features
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "source": self.source,
+            "batches": len(self.batch_index),
+            "products": len(self.product_index),
+            "features": STATIC_FEATURES,
+            "matrix_bytes": int(self.matrix.nbytes + self.product_matrix.nbytes)
+        }
+
+def load_feature_store(data_dir: Optional[str] = None) -> BatchFeatureStore:
+    """Load the store from the tables, falling back to the training defaults if they are missing"""
+    try:
+        return BatchFeatureStore.from_tables(data_dir)
+    except Exception as e:
+        logger.warning(f"Batch feature tables not available ({e}), using default batch features")
+        return BatchFeatureStore.defaults()
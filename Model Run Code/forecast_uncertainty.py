@@ -0,0 +1,58 @@
+"""
+Forecast Uncertainty for PharmaCopilot
+Monte Carlo dropout intervals for the LSTM forecaster: the input window is repeated K times in the
+batch dimension and run once with dropout active, giving K forecast samples from a single batched call
+"""
+
+from typing import Any, Dict, List
+
+import numpy as np
+
+def supports_mc_dropout(model) -> bool:
+    """Whether the forecaster is a Keras model with Dropout layers (TFLite / ONNX graphs drop them)"""
+    layers = getattr(model, 'layers', None)
+    return callable(model) and bool(layers) and any('Dropout' in type(layer).__name__ for layer in layers)
+
+def mc_dropout_samples(model, sequence_scaled: np.ndarray, target_scaler, passes: int) -> np.ndarray:
+    """(passes, horizon, sensors) inverse-scaled forecasts for one scaled (steps, sensors) window"""
+    batch = np.repeat(sequence_scaled[np.newaxis, :, :], passes, axis=0).astype(np.float32)
+    # training=True keeps the Dropout layers active; there is no BatchNorm whose statistics could change
+    samples_scaled = np.asarray(model(batch, training=True))
+    horizon, n_sensors = samples_scaled.shape[1:]
+    samples = target_scaler.inverse_transform(samples_scaled.reshape(-1, n_sensors))
+    return samples.reshape(passes, horizon, n_sensors)
+
+def summarize_samples(samples: np.ndarray, sensors: List[str], interval: float = 0.9) -> Dict[str, Any]:
+    """Per-step, per-sensor mean, std and central `interval` quantiles of the forecast samples"""
+    tail = (1.0 - interval) / 2.0
+    lower, median, upper = np.quantile(samples, [tail, 0.5, 1.0 - tail], axis=0)
+    mean = samples.mean(axis=0)
+    std = samples.std(axis=0)
+
+    steps = []
+    for step in range(samples.shape[1]):
+        steps.append({
+            "timestep": step + 1,
+            "sensors": {
+                sensor: {
+                    "mean": float(mean[step, i]),
+                    "std": float(std[step, i]),
+                    "lower": float(lower[step, i]),
+                    "median": float(median[step, i]),
+                    "upper": float(upper[step, i])
+                }
+                for i, sensor in enumerate(sensors)
+            }
+        })
+
+    # Interval width relative to the forecast level, averaged over the horizon
+    relative_width = (upper - lower) / np.maximum(np.abs(mean), 1e-6)
+    return {
+        "available": True,
+        "method": "mc_dropout",
+        "passes": int(samples.shape[0]),
+        "interval": interval,
+        "quantiles": [round(tail, 4), 0.5, round(1.0 - tail, 4)],
+        "mean_relative_width": {sensor: float(relative_width[:, i].mean()) for i, sensor in enumerate(sensors)},
+        "forecast": steps
+    }
@@ -0,0 +1,243 @@
+"""
+History Pyramid for PharmaCopilot
+Fixed-memory sensor history at several resolutions: every resampled row updates the open 1-minute,
+10-minute and hourly buckets (running sum/min/max/count), and closed buckets go into a numpy ring
+per resolution, so hours to weeks of trends cost a few hundred KB instead of raw rows
+"""
+
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# resolution -> (bucket seconds, closed buckets kept)
+DEFAULT_LEVELS = {
+    '1min': (60, 24 * 60),       # one day
+    '10min': (600, 7 * 24 * 6),  # one week
+    '1h': (3600, 30 * 24)        # 30 days
+}
+
+def isoformat(timestamp: float) -> str:
+    return datetime.fromtimestamp(timestamp).isoformat()
+
+class AggregateLevel:
+    """Closed buckets of one resolution in a ring (oldest overwritten first) plus the open bucket"""
+
+    def __init__(self, bucket_seconds: float, capacity: int, n_sensors: int):
+        self.bucket_seconds = float(bucket_seconds)
+        self.capacity = capacity
+        self.start = np.zeros(capacity)
+        self.count = np.zeros(capacity, dtype=np.int64)
+        self.mean = np.zeros((capacity, n_sensors))
+        self.min = np.zeros((capacity, n_sensors))
+        self.max = np.zeros((capacity, n_sensors))
+        self.size = 0
+        self.head = 0  # next slot to write
+        self.open_start: Optional[float] = None
+        self.open_count = 0
+        self.open_sum = np.zeros(n_sensors)
+        self.open_min = np.full(n_sensors, np.inf)
+        self.open_max = np.full(n_sensors, -np.inf)
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.start.nbytes + self.count.nbytes + self.mean.nbytes + self.min.nbytes + self.max.nbytes)
+
+    def add(self, timestamp: float, values: np.ndarray):
+        bucket = timestamp - timestamp % self.bucket_seconds
+        if self.open_start is not None and bucket != self.open_start:
+            # Next bucket, or the source clock went back (restart / replayed batch): close the open one
+            self.close()
+        if self.open_start is None:
+            self.open_start = bucket
+        self.open_count += 1
+        self.open_sum += values
+        np.minimum(self.open_min, values, out=self.open_min)
+        np.maximum(self.open_max, values, out=self.open_max)
+
+    def close(self):
+        if self.open_start is None or self.open_count == 0:
+            return
+        slot = self.head
+        self.start[slot] = self.open_start
+        self.count[slot] = self.open_count
+        self.mean[slot] = self.open_sum / self.open_count
+        self.min[slot] = self.open_min
+        self.max[slot] = self.open_max
+        self.head = (slot + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+        self.open_start = None
+        self.open_count = 0
+        self.open_sum[:] = 0.0
+        self.open_min[:] = np.inf
+        self.open_max[:] = -np.inf
+
+    def closed_slots(self, limit: Optional[int] = None) -> np.ndarray:
+        """Ring slots of the closed buckets, oldest first (the newest `limit` if given)"""
+        n = self.size if limit is None else min(limit, self.size)
+        return (self.head - n + np.arange(n)) % self.capacity
+
+    def state_size(self) -> int:
+        return 4 + self.capacity * 2 + self.mean.size * 3 + self.open_sum.size * 3
+
+    def to_array(self) -> np.ndarray:
+        """The whole level as one float64 array (see load_array)"""
+        scalars = [self.size, self.head, np.nan if self.open_start is None else self.open_start, self.open_count]
+        return np.concatenate([scalars, self.start, self.count, self.mean.ravel(), self.min.ravel(), self.max.ravel(),
+                               self.open_sum, self.open_min, self.open_max])
+
+    def load_array(self, values: np.ndarray):
+        size, head, open_start, open_count = values[:4].tolist()
+        self.size, self.head, self.open_count = int(size), int(head), int(open_count)
+        self.open_start = None if np.isnan(open_start) else open_start
+        offset = 4
+        for array in (self.start, self.count, self.mean, self.min, self.max, self.open_sum, self.open_min, self.open_max):
+            array.reshape(-1)[:] = values[offset:offset + array.size]
+            offset += array.size
+
+    def clear(self):
+        self.size = 0
+        self.head = 0
+        self.open_start = None
+        self.open_count = 0
+        self.open_sum[:] = 0.0
+        self.open_min[:] = np.inf
+        self.open_max[:] = -np.inf
+
+class HistoryPyramid:
+    """Aggregates of the sensor rows at every resolution in `levels` (see DEFAULT_LEVELS).
+
+    Each row updates every level's open bucket in O(1); a level's bucket closes when a row
+    falls into a later (or earlier) bucket, so a closed bucket always holds complete data.
+    The last `raw_window` rows are kept as they are, with their timestamps.
+    """
+
+    def __init__(self, sensors: Sequence[str], levels: Optional[Dict[str, Tuple[float, int]]] = None,
+                 raw_window: int = 60):
+        self.sensors = list(sensors)
+        self.raw_window = raw_window
+        self.raw_times = np.zeros(raw_window)
+        self.raw_values = np.zeros((raw_window, len(self.sensors)))
+        self.raw_size = 0
+        self.raw_head = 0
+        self.levels = {name: AggregateLevel(seconds, capacity, len(self.sensors))
+                       for name, (seconds, capacity) in (levels or DEFAULT_LEVELS).items()}
+        self.rows = 0
+        self.last_timestamp: Optional[float] = None
+
+    def add(self, timestamp: float, values: Sequence[float]):
+        values = np.asarray(values, dtype=np.float64)
+        self.raw_times[self.raw_head] = timestamp
+        self.raw_values[self.raw_head] = values
+        self.raw_head = (self.raw_head + 1) % self.raw_window
+        self.raw_size = min(self.raw_size + 1, self.raw_window)
+        for level in self.levels.values():
+            level.add(timestamp, values)
+        self.rows += 1
+        self.last_timestamp = timestamp
+
+    @property
+    def resolutions(self) -> List[str]:
+        return ['raw'] + list(self.levels)
+
+    def clear(self):
+        self.raw_size = 0
+        self.raw_head = 0
+        for level in self.levels.values():
+            level.clear()
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.raw_times.nbytes + self.raw_values.nbytes) + sum(level.nbytes for level in self.levels.values())
+
+    def state_size(self) -> int:
+        """Length of to_array()"""
+        return 4 + self.raw_times.size + self.raw_values.size + sum(level.state_size() for level in self.levels.values())
+
+    def to_array(self) -> np.ndarray:
+        """The whole pyramid as one float64 array, for copying it to another process (shared_state.py)"""
+        scalars = [self.raw_size, self.raw_head, self.rows, np.nan if self.last_timestamp is None else self.last_timestamp]
+        return np.concatenate([scalars, self.raw_times, self.raw_values.ravel()]
+                              + [level.to_array() for level in self.levels.values()])
+
+    def load_array(self, values: np.ndarray):
+        """Take over the state of a pyramid with the same sensors and levels from its to_array()"""
+        if len(values) != self.state_size():
+            raise ValueError(f"Pyramid state has {len(values)} values, expected {self.state_size()}")
+        raw_size, raw_head, rows, last_timestamp = values[:4].tolist()
+        self.raw_size, self.raw_head, self.rows = int(raw_size), int(raw_head), int(rows)
+        self.last_timestamp = None if np.isnan(last_timestamp) else last_timestamp
+        offset = 4
+        for array in (self.raw_times, self.raw_values):
+            array.reshape(-1)[:] = values[offset:offset + array.size]
+            offset += array.size
+        for level in self.levels.values():
+            level.load_array(values[offset:offset + level.state_size()])
+            offset += level.state_size()
+
+    def _columns(self, sensors: Optional[List[str]]) -> List[int]:
+        return [self.sensors.index(name) for name in sensors] if sensors else list(range(len(self.sensors)))
+
+    def query_raw(self, limit: Optional[int] = None, sensors: Optional[List[str]] = None) -> Dict[str, Any]:
+        """The last raw rows, oldest first"""
+        n = self.raw_size if limit is None else min(limit, self.raw_size)
+        slots = (self.raw_head - n + np.arange(n)) % self.raw_window
+        columns = self._columns(sensors)
+        values = self.raw_values[slots][:, columns]
+        return {
+            "resolution": "raw",
+            "bucket_seconds": None,
+            "buckets": n,
+            "last_bucket_partial": False,
+            "timestamps": [isoformat(t) for t in self.raw_times[slots].tolist()],
+            "count": [1] * n,
+            "sensors": {self.sensors[column]: {"value": values[:, i].tolist()} for i, column in enumerate(columns)}
+        }
+
+    def query(self, resolution: str, limit: Optional[int] = None, sensors: Optional[List[str]] = None,
+              include_open: bool = True) -> Dict[str, Any]:
+        """Buckets of one resolution, oldest first, as timestamps plus per-sensor mean/min/max columns"""
+        if resolution == 'raw':
+            return self.query_raw(limit, sensors)
+        level = self.levels[resolution]
+        columns = self._columns(sensors)
+        slots = level.closed_slots(limit)
+
+        starts = level.start[slots].tolist()
+        counts = level.count[slots].tolist()
+        mean, low, high = level.mean[slots][:, columns], level.min[slots][:, columns], level.max[slots][:, columns]
+        partial = include_open and level.open_count > 0
+        if partial:
+            starts.append(level.open_start)
+            counts.append(level.open_count)
+            mean = np.vstack([mean, (level.open_sum / level.open_count)[columns]])
+            low = np.vstack([low, level.open_min[columns]])
+            high = np.vstack([high, level.open_max[columns]])
+            if limit is not None and len(starts) > limit:
+                starts, counts, mean, low, high = starts[1:], counts[1:], mean[1:], low[1:], high[1:]
+
+        return {
+            "resolution": resolution,
+            "bucket_seconds": level.bucket_seconds,
+            "buckets": len(starts),
+            "last_bucket_partial": partial,
+            "timestamps": [isoformat(start) for start in starts],
+            "count": counts,
+            "sensors": {
+                self.sensors[column]: {"mean": mean[:, i].tolist(), "min": low[:, i].tolist(), "max": high[:, i].tolist()}
+                for i, column in enumerate(columns)
+            }
+        }
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "rows": self.rows,
+            "last_row": isoformat(self.last_timestamp) if self.last_timestamp is not None else None,
+            "memory_kb": round(self.nbytes / 1024, 1),
+            "raw_rows": self.raw_size,
+            "levels": {
+                name: {"bucket_seconds": level.bucket_seconds, "capacity": level.capacity, "buckets": level.size,
+                       "span_hours": round(level.capacity * level.bucket_seconds / 3600, 1)}
+                for name, level in self.levels.items()
+            }
+        }
@@ -0,0 +1,160 @@
+"""
+Inference Executor for PharmaCopilot
+Runs CPU-bound model calls on a bounded worker pool off the event loop, with an explicit
+intra-op thread budget for TensorFlow, PyTorch, XGBoost and onnxruntime and admission control
+"""
+
+import asyncio
+import logging
+import math
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
+logger = logging.getLogger(__name__)
+
+# Thread pools read by the native libraries when they initialise
+THREAD_ENV_VARS = ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'TF_NUM_INTRAOP_THREADS')
+
+def thread_budget(workers: int, cpu_count: int = None) -> int:
+    """Intra-op threads per worker so that workers x threads does not exceed the cores"""
+    cpu_count = cpu_count or os.cpu_count() or 1
+    return max(1, cpu_count // max(1, workers))
+
+def configure_thread_environment(threads: int):
+    """Default the library thread pools to the budget; only affects libraries imported afterwards"""
+    for name in THREAD_ENV_VARS:
+        os.environ.setdefault(name, str(threads))
+    os.environ.setdefault('TF_NUM_INTEROP_THREADS', '1')
+
+def configure_framework_threads(threads: int, tf=None, torch=None):
+    """Apply the budget to already imported TensorFlow / PyTorch runtimes"""
+    if tf is not None:
+        try:
+            tf.config.threading.set_intra_op_parallelism_threads(threads)
+            tf.config.threading.set_inter_op_parallelism_threads(1)
+        except RuntimeError as e:
+            # Raised once the TF runtime has started, the environment defaults still apply
+            logger.warning(f"Could not set TensorFlow thread budget: {e}")
+    if torch is not None:
+        torch.set_num_threads(threads)
+        try:
+            torch.set_num_interop_threads(1)
+        except RuntimeError as e:
+            logger.warning(f"Could not set PyTorch inter-op threads: {e}")
+
+def limit_model_threads(model, threads: int):
+    """Cap sklearn-style estimators (XGBoost n_jobs) to the budget"""
+    try:
+        if 'n_jobs' in model.get_params():
+            model.set_params(n_jobs=threads)
+    except Exception as e:
+        logger.warning(f"Could not limit threads for {type(model).__name__}: {e}")
+    return model
+
+class InferenceOverloaded(Exception):
+    """The queue is full, retry after `retry_after` seconds"""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Inference queue is full, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+class InferenceUnavailable(Exception):
+    """The executor is shut down"""
+
+class InferenceExecutor:
+    """Bounded thread pool for model calls.
+
+    At most `max_workers` calls run at once and at most `max_queue` wait behind them;
+    further requests are rejected immediately instead of piling up on the event loop.
+    """
+
+    def __init__(self, max_workers: int = 2, max_queue: int = 8):
+        self.max_workers = max(1, max_workers)
+        self.max_queue = max(0, max_queue)
+        self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='inference')
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._closed = False
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.peak_pending = 0
+        # Exponentially weighted call duration, used for Retry-After
+        self.avg_call_ms = 0.0
+
+    def _admit(self, enforce_limit: bool):
+        with self._lock:
+            if self._closed:
+                raise InferenceUnavailable("Inference executor is shut down")
+            if enforce_limit and self._pending >= self.max_workers + self.max_queue:
+                self.rejected += 1
+                raise InferenceOverloaded(self.retry_after())
+            self._pending += 1
+            self.submitted += 1
+            self.peak_pending = max(self.peak_pending, self._pending)
+
+    def _run(self, fn: Callable, args, kwargs):
+        start = time.perf_counter()
+        try:
+            result = fn(*args, **kwargs)
+        except Exception:
+            with self._lock:
+                self.failed += 1
+            raise
+        finally:
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            with self._lock:
+                self._pending -= 1
+                self.completed += 1
+                self.avg_call_ms = elapsed_ms if self.completed == 1 else 0.9 * self.avg_call_ms + 0.1 * elapsed_ms
+        return result
+
+    def _submit(self, fn: Callable, args, kwargs, enforce_limit: bool):
+        self._admit(enforce_limit)
+        try:
+            return self._pool.submit(self._run, fn, args, kwargs)
+        except RuntimeError as e:
+            with self._lock:
+                self._pending -= 1
+            raise InferenceUnavailable(str(e))
+
+    async def run(self, fn: Callable, *args, **kwargs) -> Any:
+        """Run a model call from a request handler, raises InferenceOverloaded when the queue is full"""
+        return await asyncio.wrap_future(self._submit(fn, args, kwargs, enforce_limit=True))
+
+    def call(self, fn: Callable, *args, **kwargs) -> Any:
+        """Run a model call from a background thread and wait for it.
+
+        Background work (the per-tick pipeline) is never rejected but still shares
+        the workers, so it stays inside the thread budget.
+        """
+        return self._submit(fn, args, kwargs, enforce_limit=False).result()
+
+    def retry_after(self) -> int:
+        """Seconds until the current backlog should have drained"""
+        backlog_ms = self.avg_call_ms * max(1, self._pending) / self.max_workers
+        return max(1, math.ceil(backlog_ms / 1000))
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "max_workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "in_flight": min(self._pending, self.max_workers),
+                "queued": max(0, self._pending - self.max_workers),
+                "peak_pending": self.peak_pending,
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+                "avg_call_ms": round(self.avg_call_ms, 3)
+            }
+
+    def shutdown(self):
+        with self._lock:
+            self._closed = True
+        self._pool.shutdown(wait=False)
@@ -0,0 +1,247 @@
+"""
+LSTM Quantization for PharmaCopilot
+Builds float16 and dynamic-range int8 TFLite variants of the sensor forecasting LSTM for
+small CPU-only edge boxes, and compares them with the float32 Keras model on held-out batches
+
+Usage:
+    python lstm_quantization.py --modes int8 float16 --max-windows 2000
+"""
+
+import argparse
+import json
+import logging
+import os
+import pickle
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import tensorflow as tf
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+MODEL_DIR = os.path.join(BASE_DIR, 'New Output/')
+
+# float32 keeps the original Keras model, the others run through a TFLite interpreter
+QUANTIZATION_MODES = ('float32', 'float16', 'int8')
+
+SEQUENCE_LENGTH = 60
+N_FEATURES = 7
+
+def quantized_model_path(model_dir: str, mode: str) -> str:
+    """Location of the converted model for a quantization mode"""
+    return os.path.join(model_dir, f'lstm_sensor_forecasting_model_{mode}.tflite')
+
+def convert_lstm_model(keras_model, mode: str) -> bytes:
+    """Convert the Keras LSTM to a quantized TFLite flatbuffer.
+
+    int8 uses dynamic-range quantization (int8 weights, float activations), which
+    needs no calibration data; float16 halves the weights and dequantizes on load.
+    """
+    if mode not in ('float16', 'int8'):
+        raise ValueError(f"Unsupported quantization mode: {mode}")
+
+    # A fixed input signature lets the converter emit the fused LSTM builtin op
+    input_spec = tf.TensorSpec([1, SEQUENCE_LENGTH, N_FEATURES], tf.float32)
+    concrete_fn = tf.function(lambda x: keras_model(x, training=False)).get_concrete_function(input_spec)
+
+    converter = tf.lite.TFLiteConverter.from_concrete_functions([concrete_fn], keras_model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if mode == 'float16':
+        converter.target_spec.supported_types = [tf.float16]
+
+    return converter.convert()
+
+class QuantizedLSTMForecaster:
+    """TFLite-backed forecaster exposing the subset of the Keras predict() API the server uses"""
+
+    def __init__(self, model_content: bytes, mode: str, num_threads: Optional[int] = None):
+        self.mode = mode
+        self.model_size_bytes = len(model_content)
+        self._interpreter = tf.lite.Interpreter(model_content=model_content, num_threads=num_threads)
+        self._interpreter.allocate_tensors()
+        self._input_index = self._interpreter.get_input_details()[0]['index']
+        self._output_index = self._interpreter.get_output_details()[0]['index']
+        self._batch_size = 1
+        # The interpreter holds mutable tensor buffers and is not thread safe
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_file(cls, path: str, mode: str, num_threads: Optional[int] = None):
+        with open(path, 'rb') as f:
+            return cls(f.read(), mode, num_threads=num_threads)
+
+    def _invoke(self, batch: np.ndarray) -> np.ndarray:
+        if len(batch) != self._batch_size:
+            self._interpreter.resize_tensor_input(self._input_index, list(batch.shape))
+            self._interpreter.allocate_tensors()
+            self._batch_size = len(batch)
+        self._interpreter.set_tensor(self._input_index, batch)
+        self._interpreter.invoke()
+        return self._interpreter.get_tensor(self._output_index).copy()
+
+    def predict(self, x, verbose: int = 0, batch_size: Optional[int] = None) -> np.ndarray:
+        """Forecast for a batch of scaled windows of shape (n, 60, 7)"""
+        x = np.ascontiguousarray(x, dtype=np.float32)
+        with self._lock:
+            try:
+                return self._invoke(x)
+            except (ValueError, RuntimeError) as e:
+                # Some fused kernels refuse a resized batch dimension, fall back to single windows
+                logger.debug(f"Batched TFLite invoke failed ({e}), predicting window by window")
+                return np.concatenate([self._invoke(x[i:i + 1]) for i in range(len(x))])
+
+def load_quantized_lstm(keras_model, mode: str, model_dir: str = MODEL_DIR,
+                        num_threads: Optional[int] = None) -> QuantizedLSTMForecaster:
+    """Load a converted model from disk, converting and caching it from the Keras model if missing"""
+    path = quantized_model_path(model_dir, mode)
+    if os.path.exists(path):
+        logger.info(f"Loading {mode} LSTM from {path}")
+        return QuantizedLSTMForecaster.from_file(path, mode, num_threads=num_threads)
+
+    if keras_model is None:
+        raise FileNotFoundError(f"No {mode} LSTM at {path} and no Keras model to convert")
+
+    logger.info(f"Converting LSTM to {mode}, caching at {path}")
+    content = convert_lstm_model(keras_model, mode)
+    try:
+        with open(path, 'wb') as f:
+            f.write(content)
+    except OSError as e:
+        logger.warning(f"Could not cache {mode} LSTM at {path}: {e}")
+    return QuantizedLSTMForecaster(content, mode, num_threads=num_threads)
+
+def _current_rss_bytes() -> int:
+    """Resident set size of this process"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def _forecast_errors(y_true: np.ndarray, y_pred: np.ndarray, sensors: List[str]) -> Dict[str, Any]:
+    """Per-sensor MAE/RMSE in original sensor units"""
+    err = y_pred - y_true
+    mae = np.abs(err).mean(axis=(0, 1))
+    rmse = np.sqrt((err ** 2).mean(axis=(0, 1)))
+    return {
+        "mae": dict(zip(sensors, mae.round(6).tolist())),
+        "rmse": dict(zip(sensors, rmse.round(6).tolist())),
+        "mean_mae": float(mae.mean())
+    }
+
+def _measure_latency(model, window: np.ndarray, runs: int) -> Dict[str, float]:
+    """Single-window latency as the /api/forecast endpoint sees it"""
+    model.predict(window, verbose=0)  # warm-up
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        model.predict(window, verbose=0)
+        timings.append((time.perf_counter() - start) * 1000)
+    timings = np.array(timings)
+    return {
+        "mean_ms": float(timings.mean()),
+        "p50_ms": float(np.percentile(timings, 50)),
+        "p95_ms": float(np.percentile(timings, 95))
+    }
+
+def evaluate_quantization(keras_model, lstm_scalers: Dict[str, Any], X: np.ndarray, y: np.ndarray,
+                          modes: List[str], sensors: List[str], model_dir: str = MODEL_DIR,
+                          latency_runs: int = 100, batch_size: int = 256) -> Dict[str, Any]:
+    """Compare quantized variants with the float32 model on held-out windows"""
+    scaler_X, scaler_y = lstm_scalers['feature'], lstm_scalers['target']
+    n, steps, n_features = X.shape
+    X_scaled = scaler_X.transform(X.reshape(-1, n_features)).reshape(n, steps, n_features).astype(np.float32)
+
+    def predict_original_units(model):
+        preds = [model.predict(X_scaled[i:i + batch_size], verbose=0) for i in range(0, n, batch_size)]
+        preds = np.concatenate(preds)
+        return scaler_y.inverse_transform(preds.reshape(-1, n_features)).reshape(preds.shape)
+
+    reference = predict_original_units(keras_model)
+    float32_bytes = int(sum(w.nbytes for w in keras_model.get_weights()))
+    report = {
+        "held_out_windows": int(n),
+        "float32": {
+            "accuracy": _forecast_errors(y, reference, sensors),
+            "model_size_bytes": float32_bytes,
+            "latency": _measure_latency(keras_model, X_scaled[:1], latency_runs)
+        }
+    }
+
+    for mode in modes:
+        if mode == 'float32':
+            continue
+        rss_before = _current_rss_bytes()
+        model = load_quantized_lstm(keras_model, mode, model_dir=model_dir)
+        rss_delta = _current_rss_bytes() - rss_before
+
+        preds = predict_original_units(model)
+        deviation = np.abs(preds - reference)
+        report[mode] = {
+            "accuracy": _forecast_errors(y, preds, sensors),
+            "deviation_from_float32": {
+                "max_abs": dict(zip(sensors, deviation.max(axis=(0, 1)).round(6).tolist())),
+                "mean_abs": dict(zip(sensors, deviation.mean(axis=(0, 1)).round(6).tolist()))
+            },
+            "model_size_bytes": model.model_size_bytes,
+            "size_ratio_vs_float32": round(model.model_size_bytes / max(float32_bytes, 1), 4),
+            "load_rss_delta_bytes": int(rss_delta),
+            "latency": _measure_latency(model, X_scaled[:1], latency_runs)
+        }
+
+    return report
+
+def main():
+    from training_data import FORECAST_SENSORS, load_holdout_windows
+
+    parser = argparse.ArgumentParser(description='Quantize the LSTM forecaster and compare against float32')
+    parser.add_argument('--modes', nargs='+', default=['float16', 'int8'], choices=['float16', 'int8'])
+    parser.add_argument('--model-dir', default=MODEL_DIR)
+    parser.add_argument('--data-dir', default=None, help='Directory with per-product process time series')
+    parser.add_argument('--max-windows', type=int, default=2000)
+    parser.add_argument('--latency-runs', type=int, default=100)
+    parser.add_argument('--rebuild', action='store_true', help='Reconvert even if .tflite files exist')
+    parser.add_argument('--output', default=None, help='Report path (default: <model-dir>/lstm_quantization_report.json)')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    with open(os.path.join(args.model_dir, 'lstm_scalers.pkl'), 'rb') as f:
+        lstm_scalers = pickle.load(f)
+
+    model_path = os.path.join(args.model_dir, 'lstm_sensor_forecasting_model.h5')
+    try:
+        keras_model = tf.keras.models.load_model(model_path, compile=False)
+    except Exception as e:
+        logger.warning(f"Standard loading failed ({e}), rebuilding architecture from weights")
+        from prediction_api import create_lstm_model_from_weights
+        keras_model = create_lstm_model_from_weights()
+
+    if args.rebuild:
+        for mode in args.modes:
+            path = quantized_model_path(args.model_dir, mode)
+            if os.path.exists(path):
+                os.remove(path)
+
+    X, y, _ = load_holdout_windows(args.data_dir, max_windows=args.max_windows)
+    report = evaluate_quantization(keras_model, lstm_scalers, X, y, args.modes, FORECAST_SENSORS,
+                                   model_dir=args.model_dir, latency_runs=args.latency_runs)
+
+    output = args.output or os.path.join(args.model_dir, 'lstm_quantization_report.json')
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    print(f"\nHeld-out windows: {report['held_out_windows']}")
+    print(f"{'mode':8} {'mean MAE':>10} {'size (KB)':>10} {'p50 (ms)':>9} {'p95 (ms)':>9}")
+    for mode in ['float32'] + args.modes:
+        entry = report[mode]
+        print(f"{mode:8} {entry['accuracy']['mean_mae']:10.4f} {entry['model_size_bytes'] / 1024:10.1f} "
+              f"{entry['latency']['p50_ms']:9.2f} {entry['latency']['p95_ms']:9.2f}")
+    print(f"\nFull report written to {output}")
+
+if __name__ == '__main__':
+    main()
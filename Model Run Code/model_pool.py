@@ -0,0 +1,169 @@
+"""
+Product Model Pool for PharmaCopilot
+Keeps the model sets of the products that are actually running: a set is loaded from its own directory
+on first use, reloaded when its files change, and the least recently used sets are evicted once the
+pool exceeds its entry or memory budget
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Callable, Dict, Hashable, List, Optional
+
+from model_registry import fingerprint
+
+logger = logging.getLogger(__name__)
+
+class PooledModelSet:
+    """A loaded model set of one key (product code)"""
+
+    def __init__(self, key: Hashable, version: str, paths: List[str], artifacts: Dict[str, Any]):
+        self.key = key
+        self.version = version
+        self.paths = list(paths)
+        self.artifacts = artifacts
+        # Accounted as the size of the artifact files, a close proxy for weights held in memory
+        self.size_bytes = sum(os.path.getsize(p) for p in self.paths if os.path.exists(p))
+        self.loaded_at = datetime.now().isoformat()
+        self.checked = time.monotonic()
+        self.last_used = time.monotonic()
+        self.hits = 0
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "key": self.key,
+            "version": self.version,
+            "groups": sorted(self.artifacts),
+            "size_mb": round(self.size_bytes / 2 ** 20, 2),
+            "hits": self.hits,
+            "loaded_at": self.loaded_at,
+            "idle_s": round(time.monotonic() - self.last_used, 1)
+        }
+
+class ModelPool:
+    """LRU pool of model sets bounded by `max_entries` and `max_bytes`.
+
+    paths(key) -> artifact files of the key's set, empty when it has none (callers then use shared models)
+    load(key, paths) -> artifacts dict
+
+    Files are re-fingerprinted at most every `recheck_seconds` per key, so lookups on the request
+    path are a dictionary hit. Loads run one at a time outside the pool lock; an entry being loaded
+    is never the one evicted to make room for it.
+    """
+
+    def __init__(self, paths: Callable[[Hashable], List[str]], load: Callable[[Hashable, List[str]], Dict[str, Any]],
+                 max_entries: int = 4, max_bytes: int = 1024 * 2 ** 20, recheck_seconds: float = 30.0):
+        self.paths = paths
+        self.load = load
+        self.max_entries = max(1, max_entries)
+        self.max_bytes = max_bytes
+        self.recheck_seconds = recheck_seconds
+        self._entries: "OrderedDict[Hashable, PooledModelSet]" = OrderedDict()
+        # Keys without a set of their own (or whose set failed to load), with the time of the check
+        self._absent: Dict[Hashable, float] = {}
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self.counts = {"hits": 0, "fallbacks": 0, "loads": 0, "reloads": 0, "evictions": 0, "load_failures": 0}
+
+    def _hit(self, entry: PooledModelSet) -> PooledModelSet:
+        entry.hits += 1
+        entry.last_used = time.monotonic()
+        self.counts["hits"] += 1
+        self._entries.move_to_end(entry.key)
+        return entry
+
+    def peek(self, key: Hashable) -> Optional[PooledModelSet]:
+        """The loaded set of `key` without checking files or loading (safe on the event loop)"""
+        with self._lock:
+            return self._entries.get(key)
+
+    def get(self, key: Hashable) -> Optional[PooledModelSet]:
+        """The current set of `key`, loading it if needed; None when the key has no set of its own"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry.checked < self.recheck_seconds:
+                return self._hit(entry)
+            if entry is None and now - self._absent.get(key, float('-inf')) < self.recheck_seconds:
+                self.counts["fallbacks"] += 1
+                return None
+
+        paths = self.paths(key)
+        version = fingerprint(paths) if paths else None
+        if version is None:
+            with self._lock:
+                if self._entries.pop(key, None) is not None:
+                    logger.info(f"Model set for {key} removed from disk, using the shared models")
+                self._absent[key] = now
+                self.counts["fallbacks"] += 1
+            return None
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.version == version:
+                entry.checked = now
+                return self._hit(entry)
+
+        with self._load_lock:
+            # Another request may have loaded it while this one waited
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None and entry.version == version:
+                    return self._hit(entry)
+
+            start = time.perf_counter()
+            try:
+                artifacts = self.load(key, paths)
+            except Exception as e:
+                logger.error(f"Could not load model set for {key}: {e}")
+                with self._lock:
+                    self.counts["load_failures"] += 1
+                    if entry is None:
+                        self._absent[key] = now
+                    else:
+                        # Keep serving the previous version until the files load again
+                        entry.checked = now
+                return entry
+
+            loaded = PooledModelSet(key, version, paths, artifacts)
+            with self._lock:
+                self.counts["reloads" if entry is not None else "loads"] += 1
+                self._absent.pop(key, None)
+                self._entries[key] = loaded
+                self._hit(loaded)
+                self._evict(keep=key)
+            logger.info(f"Loaded model set for {key} ({loaded.size_bytes / 2 ** 20:.1f} MB, "
+                        f"{(time.perf_counter() - start) * 1000:.0f} ms), pool holds {list(self._entries)}")
+            return loaded
+
+    def _evict(self, keep: Hashable):
+        while len(self._entries) > 1 and (len(self._entries) > self.max_entries or self.size_bytes > self.max_bytes):
+            key = next(k for k in self._entries if k != keep)
+            evicted = self._entries.pop(key)
+            self.counts["evictions"] += 1
+            logger.info(f"Evicted model set for {key} ({evicted.size_bytes / 2 ** 20:.1f} MB, idle "
+                        f"{time.monotonic() - evicted.last_used:.0f}s)")
+
+    @property
+    def size_bytes(self) -> int:
+        return sum(entry.size_bytes for entry in self._entries.values())
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._absent.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries = [entry.describe() for entry in reversed(self._entries.values())]
+            size = self.size_bytes
+        return {
+            "max_entries": self.max_entries,
+            "max_mb": round(self.max_bytes / 2 ** 20, 2),
+            "size_mb": round(size / 2 ** 20, 2),
+            **self.counts,
+            "entries": entries
+        }
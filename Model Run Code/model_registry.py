@@ -0,0 +1,371 @@
+"""
+Model Registry for PharmaCopilot
+Watches the model directories (or a manifest) for new artifact versions, loads them in the background,
+swaps them in atomically and optionally scores a candidate version in shadow mode against the live one
+"""
+
+import glob
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Training runs suffix artifacts with _YYYYMMDD_HHMMSS, newer runs sort later
+TIMESTAMP_SUFFIX = re.compile(r'_\d{8}_\d{6}(?=\.[^.]+$)')
+
+def resolve_latest(directory: str, configured_file: str) -> str:
+    """Newest file of the same family as `configured_file` (same name apart from the timestamp suffix)"""
+    if not TIMESTAMP_SUFFIX.search(configured_file):
+        return os.path.join(directory, configured_file)
+    prefix, ext = os.path.splitext(TIMESTAMP_SUFFIX.sub('', configured_file))
+    candidates = sorted(glob.glob(os.path.join(directory, f'{prefix}_*{ext}')))
+    candidates = [c for c in candidates if TIMESTAMP_SUFFIX.search(os.path.basename(c))]
+    return candidates[-1] if candidates else os.path.join(directory, configured_file)
+
+def fingerprint(paths: List[str]) -> Optional[str]:
+    """Version id from path, size and mtime of every artifact, None if any file is missing"""
+    digest = hashlib.sha1()
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        digest.update(f'{os.path.basename(path)}:{stat.st_size}:{stat.st_mtime_ns};'.encode())
+    return digest.hexdigest()[:12]
+
+class ModelVersion:
+    """A loaded set of artifacts for one slot"""
+
+    def __init__(self, slot: str, version: str, paths: List[str], artifacts: Dict[str, Any]):
+        self.slot = slot
+        self.version = version
+        self.paths = list(paths)
+        self.artifacts = artifacts
+        self.loaded_at = datetime.now().isoformat()
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "version": self.version,
+            "files": [os.path.basename(p) for p in self.paths],
+            "loaded_at": self.loaded_at
+        }
+
+class ShadowStats:
+    """Running agreement and latency statistics for a shadow candidate, O(1) per comparison"""
+
+    def __init__(self):
+        self.comparisons = 0
+        self.agreements = 0
+        self.mean_abs_diff = 0.0
+        self.max_abs_diff = 0.0
+        self.live_latency_ms = 0.0
+        self.shadow_latency_ms = 0.0
+        self.shadow_latency_max_ms = 0.0
+        self.errors = 0
+        self.skipped = 0
+
+    def update(self, agreed: bool, abs_diff: float, live_ms: float, shadow_ms: float):
+        self.comparisons += 1
+        n = self.comparisons
+        self.agreements += int(agreed)
+        self.mean_abs_diff += (abs_diff - self.mean_abs_diff) / n
+        self.max_abs_diff = max(self.max_abs_diff, abs_diff)
+        self.live_latency_ms += (live_ms - self.live_latency_ms) / n
+        self.shadow_latency_ms += (shadow_ms - self.shadow_latency_ms) / n
+        self.shadow_latency_max_ms = max(self.shadow_latency_max_ms, shadow_ms)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "comparisons": self.comparisons,
+            "agreement_rate": self.agreements / self.comparisons if self.comparisons else None,
+            "mean_abs_diff": self.mean_abs_diff,
+            "max_abs_diff": self.max_abs_diff,
+            "live_latency_ms": self.live_latency_ms,
+            "shadow_latency_ms": self.shadow_latency_ms,
+            "shadow_latency_max_ms": self.shadow_latency_max_ms,
+            "errors": self.errors,
+            "skipped_busy": self.skipped
+        }
+
+class ModelSlot:
+    """How to find, load, swap in and shadow-score one group of artifacts that must change together.
+
+    resolve() -> list of artifact paths for the live version
+    load(paths) -> artifacts dict
+    apply(version) -> install a version as live (called under the registry swap lock)
+    predict(artifacts, inputs) -> output, used for shadow scoring
+    compare(live_output, shadow_output) -> (agreed, abs_diff)
+
+    Relative file names (manifest entries, shadow requests) are resolved against `directory`.
+    """
+
+    def __init__(self, name: str, directory: str, resolve: Callable[[], List[str]],
+                 load: Callable[[List[str]], Dict[str, Any]],
+                 apply: Callable[[ModelVersion], None],
+                 predict: Optional[Callable[[Dict[str, Any], Any], Any]] = None,
+                 compare: Optional[Callable[[Any, Any], tuple]] = None):
+        self.name = name
+        self.directory = directory
+        self.resolve = resolve
+        self.load = load
+        self.apply = apply
+        self.predict = predict
+        self.compare = compare
+
+class ModelRegistry:
+    """Versioned model slots with background reload, atomic swap and shadow scoring"""
+
+    def __init__(self, poll_interval: float = 30.0, manifest_path: Optional[str] = None):
+        self.poll_interval = poll_interval
+        self.manifest_path = manifest_path
+        self.slots: Dict[str, ModelSlot] = {}
+        self.live: Dict[str, ModelVersion] = {}
+        self.shadow: Dict[str, ModelVersion] = {}
+        self.shadow_stats: Dict[str, ShadowStats] = {}
+        self.history: List[Dict[str, Any]] = []
+        # Held only while references are swapped or read, never during inference
+        self.swap_lock = threading.RLock()
+        self._pending: Dict[str, str] = {}
+        self._failed: Dict[str, str] = {}
+        # Promoted candidates: slot -> {"paths": promoted files, "basis": what the slot resolved to when promoted}
+        self._pinned: Dict[str, Dict[str, List[str]]] = {}
+        self._refresh_lock = threading.Lock()
+        self._live_signature: Optional[str] = None
+        self._stop = threading.Event()
+        self._watcher = None
+        self._shadow_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='shadow-scoring')
+        self._shadow_busy = threading.Semaphore(1)
+
+    # --- slot management ---
+    def register(self, slot: ModelSlot, artifacts: Optional[Dict[str, Any]] = None):
+        """Add a slot; pass the artifacts already loaded at startup to avoid loading them twice"""
+        self.slots[slot.name] = slot
+        if artifacts is not None:
+            paths = self._resolve(slot)
+            self.live[slot.name] = ModelVersion(slot.name, fingerprint(paths) or 'unknown', paths, artifacts)
+            self._live_signature = None
+
+    def _manifest(self) -> Dict[str, Any]:
+        if not self.manifest_path or not os.path.exists(self.manifest_path):
+            return {}
+        try:
+            with open(self.manifest_path) as f:
+                return json.load(f).get('slots', {})
+        except Exception as e:
+            logger.warning(f"Could not read model manifest {self.manifest_path}: {e}")
+            return {}
+
+    def _manifest_paths(self, slot_name: str, key: str) -> Optional[List[str]]:
+        entry = self._manifest().get(slot_name, {})
+        files = entry.get(key)
+        if not files:
+            return None
+        return self.slot_paths(slot_name, [files] if isinstance(files, str) else files)
+
+    def slot_paths(self, slot_name: str, files: List[str]) -> List[str]:
+        """Resolve file names relative to the slot's directory"""
+        directory = self.slots[slot_name].directory
+        return [f if os.path.isabs(f) else os.path.join(directory, f) for f in files]
+
+    def _resolve(self, slot: ModelSlot) -> List[str]:
+        """Live artifact paths: a promoted candidate stays live until the manifest or the model
+        directory points the slot at different files"""
+        paths = self._manifest_paths(slot.name, 'live') or slot.resolve()
+        pinned = self._pinned.get(slot.name)
+        if pinned is not None:
+            if pinned["basis"] == paths:
+                return pinned["paths"]
+            logger.info(f"Model slot {slot.name} resolves to new files, promoted version is no longer pinned")
+            self._pinned.pop(slot.name, None)
+        return paths
+
+    def get(self, slot_name: str) -> Optional[ModelVersion]:
+        """Current live version of a slot (a single reference read, safe from any thread)"""
+        return self.live.get(slot_name)
+
+    def live_signature(self) -> str:
+        """Short hash over every slot's live version, changes whenever a model is swapped"""
+        signature = self._live_signature
+        if signature is None:
+            with self.swap_lock:
+                text = ';'.join(f'{name}={version.version}' for name, version in sorted(self.live.items()))
+            signature = self._live_signature = hashlib.sha1(text.encode()).hexdigest()[:12]
+        return signature
+
+    def live_versions(self) -> Dict[str, str]:
+        """Live version of every slot"""
+        with self.swap_lock:
+            return {name: version.version for name, version in sorted(self.live.items())}
+
+    # --- reload and swap ---
+    def _install(self, slot: ModelSlot, version: ModelVersion, reason: str):
+        with self.swap_lock:
+            previous = self.live.get(slot.name)
+            slot.apply(version)
+            self.live[slot.name] = version
+            self._live_signature = None
+        self.history.append({
+            "slot": slot.name,
+            "from": previous.version if previous else None,
+            "to": version.version,
+            "reason": reason,
+            "timestamp": datetime.now().isoformat()
+        })
+        del self.history[:-50]
+        logger.info(f"Model slot {slot.name} swapped to version {version.version} ({reason})")
+
+    def refresh(self, wait_stable: bool = True) -> Dict[str, str]:
+        """Check every slot for a new version and load it; returns slot -> outcome.
+
+        The watcher only loads a version once its fingerprint has been seen on two consecutive
+        polls, so artifacts that are still being copied are never picked up half-written.
+        """
+        with self._refresh_lock:
+            return {name: self._refresh_slot(slot, wait_stable) for name, slot in list(self.slots.items())}
+
+    def _refresh_slot(self, slot: ModelSlot, wait_stable: bool) -> str:
+        name = slot.name
+        paths = self._resolve(slot)
+        version = fingerprint(paths)
+        live = self.live.get(name)
+        if version is None:
+            outcome = "missing_files"
+        elif live is not None and live.version == version:
+            self._pending.pop(name, None)
+            outcome = "unchanged"
+        elif wait_stable and self._failed.get(name) == version:
+            # Retried only on an explicit reload or once the files change again
+            outcome = "load_failed"
+        elif wait_stable and self._pending.get(name) != version:
+            self._pending[name] = version
+            outcome = "pending"
+        else:
+            try:
+                start = time.perf_counter()
+                artifacts = slot.load(paths)
+                load_ms = (time.perf_counter() - start) * 1000
+                self._install(slot, ModelVersion(name, version, paths, artifacts), f"reload in {load_ms:.0f} ms")
+                self._failed.pop(name, None)
+                outcome = "swapped"
+            except Exception as e:
+                logger.error(f"Failed to load new version of {name}, keeping live version: {e}")
+                self._failed[name] = version
+                outcome = "load_failed"
+            self._pending.pop(name, None)
+
+        shadow_paths = self._manifest_paths(name, 'shadow')
+        shadow_version = fingerprint(shadow_paths) if shadow_paths else None
+        current_shadow = self.shadow.get(name)
+        live = self.live.get(name)
+        # A manifest shadow entry that has been promoted is live now, not a candidate
+        if (shadow_version and self._failed.get(f'{name}:shadow') != shadow_version
+                and (live is None or live.version != shadow_version)
+                and (current_shadow is None or current_shadow.version != shadow_version)):
+            try:
+                self.load_shadow(name, shadow_paths)
+            except Exception as e:
+                logger.error(f"Failed to load shadow candidate for {name}: {e}")
+                self._failed[f'{name}:shadow'] = shadow_version
+        return outcome
+
+    def _watch(self):
+        while not self._stop.wait(self.poll_interval):
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.error(f"Model registry refresh failed: {e}")
+
+    def start(self):
+        """Start the background watcher"""
+        if self._watcher is None or not self._watcher.is_alive():
+            self._stop.clear()
+            self._watcher = threading.Thread(target=self._watch, name='model-registry', daemon=True)
+            self._watcher.start()
+            logger.info(f"Model registry watching {len(self.slots)} slots every {self.poll_interval}s")
+
+    def stop(self):
+        self._stop.set()
+        self._shadow_executor.shutdown(wait=False)
+
+    # --- shadow scoring ---
+    def load_shadow(self, slot_name: str, paths: List[str]) -> ModelVersion:
+        """Load a candidate version to be scored alongside the live one"""
+        slot = self.slots[slot_name]
+        version = ModelVersion(slot_name, fingerprint(paths) or 'unknown', paths, slot.load(paths))
+        with self.swap_lock:
+            self.shadow[slot_name] = version
+            self.shadow_stats[slot_name] = ShadowStats()
+        logger.info(f"Shadow candidate {version.version} loaded for {slot_name}")
+        return version
+
+    def clear_shadow(self, slot_name: str):
+        with self.swap_lock:
+            self.shadow.pop(slot_name, None)
+            self.shadow_stats.pop(slot_name, None)
+
+    def promote(self, slot_name: str) -> ModelVersion:
+        """Make the shadow candidate live; it stays live (the watcher resolves the slot to its files) until
+        the manifest or the model directory offers a different version"""
+        candidate = self.shadow.get(slot_name)
+        if candidate is None:
+            raise KeyError(f"No shadow candidate for {slot_name}")
+        slot = self.slots[slot_name]
+        with self._refresh_lock:
+            self._pinned.pop(slot_name, None)
+            self._pinned[slot_name] = {"paths": list(candidate.paths), "basis": self._resolve(slot)}
+            self._pending.pop(slot_name, None)
+            self._install(slot, candidate, "shadow promoted")
+        self.clear_shadow(slot_name)
+        return candidate
+
+    def submit_shadow(self, slot_name: str, inputs: Any, live_output: Any, live_ms: float):
+        """Score the shadow candidate on the inputs the live model just saw, off the request path"""
+        candidate = self.shadow.get(slot_name)
+        slot = self.slots.get(slot_name)
+        if candidate is None or slot is None or slot.predict is None:
+            return
+        stats = self.shadow_stats[slot_name]
+        if not self._shadow_busy.acquire(blocking=False):
+            stats.skipped += 1
+            return
+
+        def score():
+            try:
+                start = time.perf_counter()
+                shadow_output = slot.predict(candidate.artifacts, inputs)
+                shadow_ms = (time.perf_counter() - start) * 1000
+                agreed, abs_diff = slot.compare(live_output, shadow_output)
+                stats.update(agreed, abs_diff, live_ms, shadow_ms)
+            except Exception as e:
+                stats.errors += 1
+                logger.warning(f"Shadow scoring failed for {slot_name}: {e}")
+            finally:
+                self._shadow_busy.release()
+
+        self._shadow_executor.submit(score)
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "poll_interval_seconds": self.poll_interval,
+            "manifest": self.manifest_path if self.manifest_path and os.path.exists(self.manifest_path) else None,
+            "watching": self._watcher is not None and self._watcher.is_alive(),
+            "slots": {
+                name: {
+                    "live": self.live[name].describe() if name in self.live else None,
+                    "shadow": self.shadow[name].describe() if name in self.shadow else None,
+                    "shadow_stats": self.shadow_stats[name].to_dict() if name in self.shadow_stats else None,
+                    "pending_version": self._pending.get(name),
+                    "promoted": name in self._pinned
+                }
+                for name in self.slots
+            },
+            "recent_swaps": list(self.history)
+        }
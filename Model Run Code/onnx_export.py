@@ -0,0 +1,324 @@
+"""
+ONNX Export Pipeline for PharmaCopilot
+Converts the LSTM forecaster, the XGBoost defect/quality classifiers (with the feature scaler fused in)
+and the CQL policy networks to ONNX, then checks parity against the original frameworks.
+
+Requires the full training stack plus: pip install tf2onnx skl2onnx onnxmltools onnxruntime
+
+Usage:
+    python onnx_export.py                 # export to "New Output/onnx/" and verify parity
+    python onnx_export.py --skip-verify   # export only
+"""
+
+import argparse
+import copy
+import hashlib
+import json
+import logging
+import os
+import pickle
+import sys
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+MODEL_DIR = os.path.join(BASE_DIR, 'New Output/')
+RL_DIR = os.path.join(BASE_DIR, 'Models/')
+ONNX_DIR = os.path.join(MODEL_DIR, 'onnx')
+
+DEFAULT_OPSET = 13
+
+# Maximum absolute output difference accepted by the parity check
+PARITY_TOLERANCE = {
+    "lstm": 1e-4,
+    "classifier": 1e-4,
+    "policy": 1e-5
+}
+
+def _sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def export_lstm(keras_model, path: str, opset: int = DEFAULT_OPSET):
+    """Export the Keras LSTM with a dynamic batch dimension"""
+    import tensorflow as tf
+    import tf2onnx
+
+    input_shape = keras_model.input_shape
+    spec = (tf.TensorSpec((None, input_shape[1], input_shape[2]), tf.float32, name='input'),)
+    tf2onnx.convert.from_keras(keras_model, input_signature=spec, opset=opset, output_path=path)
+
+def export_lstm_scalers(lstm_scalers: Dict[str, Any], path: str):
+    """Store the MinMaxScaler parameters so the slim runtime does not need to unpickle sklearn objects"""
+    np.savez(
+        path,
+        feature_scale=lstm_scalers['feature'].scale_,
+        feature_min=lstm_scalers['feature'].min_,
+        target_scale=lstm_scalers['target'].scale_,
+        target_min=lstm_scalers['target'].min_
+    )
+
+def _register_xgboost_converter():
+    from skl2onnx import update_registered_converter
+    from skl2onnx.common.shape_calculator import calculate_linear_classifier_output_shapes
+    from onnxmltools.convert.xgboost.operator_converters.XGBoost import convert_xgboost
+    from xgboost import XGBClassifier
+
+    update_registered_converter(
+        XGBClassifier, 'XGBoostXGBClassifier',
+        calculate_linear_classifier_output_shapes, convert_xgboost,
+        options={'nocl': [True, False], 'zipmap': [True, False, 'columns']}
+    )
+
+def export_classifier(model, feature_scaler, n_features: int, path: str, opset: int = DEFAULT_OPSET):
+    """Export scaler + classifier as a single graph taking raw feature vectors"""
+    from skl2onnx import convert_sklearn
+    from skl2onnx.common.data_types import FloatTensorType
+    from sklearn.pipeline import Pipeline
+
+    _register_xgboost_converter()
+
+    model = copy.deepcopy(model)
+    if hasattr(model, 'get_booster'):
+        # The converter parses the tree dump and expects positional f0..fN feature names
+        model.get_booster().feature_names = None
+
+    pipeline = Pipeline([('scaler', feature_scaler), ('classifier', model)])
+    onnx_model = convert_sklearn(
+        pipeline,
+        initial_types=[('input', FloatTensorType([None, n_features]))],
+        target_opset={'': opset, 'ai.onnx.ml': 3},
+        options={id(model): {'zipmap': False}}
+    )
+    with open(path, 'wb') as f:
+        f.write(onnx_model.SerializeToString())
+
+def build_policy_network(policy_state_dict):
+    """Rebuild the deterministic policy from its state dict.
+
+    The d3rlpy CQL checkpoints hold a squashed Gaussian policy (encoder.fcs.* with ReLU,
+    then mu/logstd heads); the greedy action is tanh(mu(encoder(state))). Other layouts are
+    treated as a plain MLP: Linear layers in order, ReLU between, Tanh output.
+    """
+    import torch
+
+    if 'mu.weight' in policy_state_dict:
+        encoder_keys = sorted(
+            (k for k in policy_state_dict if k.startswith('encoder.fcs.') and k.endswith('.weight')),
+            key=lambda k: int(k.split('.')[2])
+        )
+        weights = [(k, policy_state_dict[k]) for k in encoder_keys] + [('mu.weight', policy_state_dict['mu.weight'])]
+    else:
+        weights = [(k, v) for k, v in policy_state_dict.items() if k.endswith('weight') and v.dim() == 2]
+    if not weights:
+        raise ValueError("Policy state dict contains no linear layers")
+
+    layers = []
+    for i, (key, weight) in enumerate(weights):
+        linear = torch.nn.Linear(weight.shape[1], weight.shape[0])
+        linear.weight.data.copy_(weight)
+        bias = policy_state_dict.get(key[:-len('weight')] + 'bias')
+        if bias is not None:
+            linear.bias.data.copy_(bias)
+        layers.append(linear)
+        layers.append(torch.nn.ReLU() if i < len(weights) - 1 else torch.nn.Tanh())
+
+    return torch.nn.Sequential(*layers).eval()
+
+def export_policy(checkpoint_path: str, path: str, opset: int = DEFAULT_OPSET) -> int:
+    """Export a CQL checkpoint's policy network, returns its state dimension"""
+    import torch
+
+    checkpoint = torch.load(checkpoint_path, map_location='cpu')
+    network = build_policy_network(checkpoint['policy'])
+    state_dim = network[0].in_features
+
+    torch.onnx.export(
+        network, torch.zeros(1, state_dim), path,
+        input_names=['state'], output_names=['action'],
+        dynamic_axes={'state': {0: 'batch'}, 'action': {0: 'batch'}},
+        opset_version=opset
+    )
+    return state_dim
+
+def verify_parity(onnx_dir: str, native: Dict[str, Any], windows: Optional[np.ndarray] = None,
+                  n_samples: int = 512, seed: int = 0) -> Dict[str, Any]:
+    """Run the same inputs through the ONNX models and the original frameworks and compare outputs"""
+    import torch
+    from onnx_runtime import load_onnx_models
+
+    rng = np.random.default_rng(seed)
+    onnx_models = load_onnx_models(onnx_dir)
+    results = {}
+
+    def record(name, max_abs_diff, kind, extra=None):
+        entry = {
+            "max_abs_diff": float(max_abs_diff),
+            "tolerance": PARITY_TOLERANCE[kind],
+            "passed": bool(max_abs_diff <= PARITY_TOLERANCE[kind])
+        }
+        entry.update(extra or {})
+        results[name] = entry
+
+    if native.get("lstm") is not None and onnx_models["lstm"] is not None:
+        if windows is not None and len(windows):
+            n, steps, n_features = windows.shape
+            sample = native["lstm_scalers"]['feature'].transform(windows.reshape(-1, n_features)).reshape(windows.shape)
+        else:
+            sample = rng.uniform(0, 1, size=(64, 60, 7))
+        sample = sample[:n_samples].astype(np.float32)
+        expected = native["lstm"].predict(sample, verbose=0)
+        actual = onnx_models["lstm"].predict(sample)
+        record("lstm", np.abs(expected - actual).max(), "lstm", {"samples": len(sample)})
+
+    feature_scaler = native.get("feature_scaler")
+    if feature_scaler is not None:
+        # Feature rows spread around the training distribution
+        features = feature_scaler.mean_ + rng.standard_normal((n_samples, len(feature_scaler.mean_))) * feature_scaler.scale_
+        features = features.astype(np.float32)
+        scaled = feature_scaler.transform(features)
+        for name in ("defect", "quality"):
+            if native.get(name) is None or onnx_models[name] is None:
+                continue
+            expected = native[name].predict_proba(scaled)
+            actual = onnx_models[name].predict_proba(features)
+            label_agreement = float((native[name].predict(scaled) == onnx_models[name].predict(features)).mean())
+            record(name, np.abs(expected - actual).max(), "classifier",
+                   {"samples": n_samples, "label_agreement": label_agreement})
+
+    for name, network in native.get("policies", {}).items():
+        policy = onnx_models["policies"].get(name)
+        if policy is None:
+            continue
+        state_dim = network[0].in_features
+        states = rng.standard_normal((n_samples, state_dim)).astype(np.float32) * 50
+        with torch.no_grad():
+            expected = network(torch.from_numpy(states)).numpy()
+        actual = policy.predict(states)
+        record(f"policy_{name}", np.abs(expected - actual).max(), "policy", {"samples": n_samples})
+
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='Export PharmaCopilot models to ONNX')
+    parser.add_argument('--model-dir', default=MODEL_DIR)
+    parser.add_argument('--rl-dir', default=RL_DIR)
+    parser.add_argument('--output-dir', default=None, help='Default: <model-dir>/onnx')
+    parser.add_argument('--opset', type=int, default=DEFAULT_OPSET)
+    parser.add_argument('--skip-verify', action='store_true')
+    parser.add_argument('--parity-windows', type=int, default=512, help='Held-out LSTM windows used for parity')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    import tensorflow as tf
+    from prediction_api import RL_MODEL_CONFIG, create_lstm_model_from_weights
+
+    output_dir = args.output_dir or os.path.join(args.model_dir, 'onnx')
+    os.makedirs(output_dir, exist_ok=True)
+
+    manifest = {
+        "created": datetime.now().isoformat(),
+        "opset": args.opset,
+        "classifiers": {},
+        "policies": {}
+    }
+    native = {"policies": {}}
+
+    # LSTM forecaster and its scalers
+    with open(os.path.join(args.model_dir, 'lstm_scalers.pkl'), 'rb') as f:
+        native["lstm_scalers"] = pickle.load(f)
+    export_lstm_scalers(native["lstm_scalers"], os.path.join(output_dir, 'lstm_scalers.npz'))
+    manifest["lstm_scalers"] = {"file": 'lstm_scalers.npz'}
+
+    lstm_path = os.path.join(args.model_dir, 'lstm_sensor_forecasting_model.h5')
+    try:
+        native["lstm"] = tf.keras.models.load_model(lstm_path, compile=False)
+    except Exception as e:
+        logger.warning(f"Standard loading failed ({e}), rebuilding architecture from weights")
+        native["lstm"] = create_lstm_model_from_weights()
+    export_lstm(native["lstm"], os.path.join(output_dir, 'lstm_sensor_forecasting_model.onnx'), args.opset)
+    manifest["lstm"] = {"file": 'lstm_sensor_forecasting_model.onnx', "source_sha256": _sha256(lstm_path)}
+    logger.info("Exported LSTM forecaster")
+
+    # Classifiers with the feature scaler fused in front
+    with open(os.path.join(args.model_dir, 'feature_scaler.pkl'), 'rb') as f:
+        native["feature_scaler"] = pickle.load(f)
+    with open(os.path.join(args.model_dir, 'feature_names.txt')) as f:
+        manifest["feature_names"] = [line.strip() for line in f]
+    n_features = len(manifest["feature_names"])
+
+    for name, filename in (("defect", 'xgboost_defect_classifier.pkl'), ("quality", 'xgboost_quality_class_classifier.pkl')):
+        source = os.path.join(args.model_dir, filename)
+        with open(source, 'rb') as f:
+            native[name] = pickle.load(f)
+        onnx_file = filename.replace('.pkl', '.onnx')
+        export_classifier(native[name], native["feature_scaler"], n_features, os.path.join(output_dir, onnx_file), args.opset)
+        manifest["classifiers"][name] = {
+            "file": onnx_file,
+            "classes": np.asarray(native[name].classes_).tolist(),
+            "source_sha256": _sha256(source)
+        }
+        logger.info(f"Exported {name} classifier")
+
+    # CQL policy networks
+    for name, config in RL_MODEL_CONFIG.items():
+        if not config.get('file'):
+            continue
+        source = os.path.join(args.rl_dir, config['file'])
+        if not os.path.exists(source):
+            logger.warning(f"RL checkpoint not found: {source}")
+            continue
+        onnx_file = f'cql_policy_{name}.onnx'
+        try:
+            state_dim = export_policy(source, os.path.join(output_dir, onnx_file), args.opset)
+        except Exception as e:
+            logger.error(f"Could not export policy {name}: {e}")
+            continue
+
+        import torch
+        native["policies"][name] = build_policy_network(torch.load(source, map_location='cpu')['policy'])
+        manifest["policies"][name] = {
+            "file": onnx_file,
+            "state_dim": state_dim,
+            "description": config.get('description'),
+            "source_sha256": _sha256(source)
+        }
+        logger.info(f"Exported policy {name}")
+
+    with open(os.path.join(output_dir, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    if args.skip_verify:
+        print(f"Exported models to {output_dir} (parity not verified)")
+        return
+
+    windows = None
+    try:
+        from training_data import load_holdout_windows
+        windows, _, _ = load_holdout_windows(max_windows=args.parity_windows)
+    except Exception as e:
+        logger.warning(f"Held-out windows unavailable, using random LSTM inputs: {e}")
+
+    parity = verify_parity(output_dir, native, windows=windows)
+    manifest["parity"] = parity
+    with open(os.path.join(output_dir, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    print(f"\nExported models to {output_dir}")
+    print(f"{'model':20} {'max |diff|':>12} {'tolerance':>10}  result")
+    for name, entry in parity.items():
+        print(f"{name:20} {entry['max_abs_diff']:12.3e} {entry['tolerance']:10.0e}  {'PASS' if entry['passed'] else 'FAIL'}")
+
+    if not all(entry['passed'] for entry in parity.values()):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
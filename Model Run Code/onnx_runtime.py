@@ -0,0 +1,147 @@
+"""
+ONNX Runtime Backend for PharmaCopilot
+Slim inference path for prediction_api.py (PREDICTION_RUNTIME=onnx) that needs only onnxruntime and NumPy.
+The models are produced by onnx_export.py and expose the same predict APIs the server already calls.
+"""
+
+import json
+import logging
+import os
+from typing import Any, Dict, Optional
+
+import numpy as np
+import onnxruntime as ort
+
+logger = logging.getLogger(__name__)
+
+ONNX_MANIFEST = 'manifest.json'
+
+def create_session(path: str, num_threads: Optional[int] = None) -> ort.InferenceSession:
+    """CPU inference session with an explicit intra-op thread budget"""
+    options = ort.SessionOptions()
+    options.intra_op_num_threads = num_threads or 0
+    options.inter_op_num_threads = 1
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    return ort.InferenceSession(path, sess_options=options, providers=['CPUExecutionProvider'])
+
+class NumpyMinMaxScaler:
+    """MinMaxScaler.transform / inverse_transform from exported parameters"""
+
+    def __init__(self, scale: np.ndarray, min_: np.ndarray):
+        self.scale_ = np.asarray(scale, dtype=np.float64)
+        self.min_ = np.asarray(min_, dtype=np.float64)
+
+    def transform(self, X) -> np.ndarray:
+        return np.asarray(X, dtype=np.float64) * self.scale_ + self.min_
+
+    def inverse_transform(self, X) -> np.ndarray:
+        return (np.asarray(X, dtype=np.float64) - self.min_) / self.scale_
+
+class PassthroughScaler:
+    """Stands in for the feature scaler, which is fused into the exported classifier graphs"""
+
+    def transform(self, X) -> np.ndarray:
+        return np.asarray(X, dtype=np.float32)
+
+class OnnxLSTMForecaster:
+    """LSTM forecaster with the Keras predict() signature"""
+
+    mode = 'onnx'
+
+    def __init__(self, session: ort.InferenceSession):
+        self.session = session
+        self.input_name = session.get_inputs()[0].name
+
+    def predict(self, x, verbose: int = 0, batch_size: Optional[int] = None) -> np.ndarray:
+        x = np.ascontiguousarray(x, dtype=np.float32)
+        return self.session.run(None, {self.input_name: x})[0]
+
+class OnnxClassifier:
+    """Scaler + XGBoost classifier graph with the sklearn predict / predict_proba signature"""
+
+    def __init__(self, session: ort.InferenceSession, classes):
+        self.session = session
+        self.input_name = session.get_inputs()[0].name
+        self.classes_ = np.asarray(classes)
+
+    def _run(self, X):
+        X = np.ascontiguousarray(np.asarray(X, dtype=np.float32))
+        label, probabilities = self.session.run(None, {self.input_name: X})[:2]
+        return np.asarray(label), np.asarray(probabilities)
+
+    def predict_proba(self, X) -> np.ndarray:
+        return self._run(X)[1]
+
+    def predict(self, X) -> np.ndarray:
+        return self._run(X)[0]
+
+class OnnxPolicy:
+    """CQL policy network, predict() maps a batch of states to actions in [-1, 1]"""
+
+    def __init__(self, session: ort.InferenceSession, name: str):
+        self.session = session
+        self.name = name
+        self.input_name = session.get_inputs()[0].name
+        # State features the exported network takes (None if the export left the width symbolic)
+        width = session.get_inputs()[0].shape[-1]
+        self.state_dim = width if isinstance(width, int) else None
+
+    def predict(self, state) -> np.ndarray:
+        state = np.atleast_2d(np.asarray(state, dtype=np.float32))
+        return self.session.run(None, {self.input_name: state})[0]
+
+def load_manifest(onnx_dir: str) -> Dict[str, Any]:
+    """Read the export manifest written by onnx_export.py"""
+    with open(os.path.join(onnx_dir, ONNX_MANIFEST)) as f:
+        return json.load(f)
+
+def load_onnx_models(onnx_dir: str, num_threads: Optional[int] = None) -> Dict[str, Any]:
+    """Load every exported model listed in the manifest; missing entries come back as None"""
+    manifest = load_manifest(onnx_dir)
+    models = {
+        "lstm": None,
+        "scaler_X": None,
+        "scaler_y": None,
+        "defect": None,
+        "quality": None,
+        "feature_scaler": PassthroughScaler(),
+        "feature_names": manifest.get("feature_names", []),
+        "policies": {},
+        "manifest": manifest
+    }
+
+    def path_of(entry):
+        return os.path.join(onnx_dir, entry["file"])
+
+    lstm_entry = manifest.get("lstm")
+    if lstm_entry:
+        try:
+            models["lstm"] = OnnxLSTMForecaster(create_session(path_of(lstm_entry), num_threads))
+            logger.info("Loaded ONNX LSTM forecaster")
+        except Exception as e:
+            logger.error(f"Error loading ONNX LSTM forecaster: {e}")
+
+    scaler_entry = manifest.get("lstm_scalers")
+    if scaler_entry:
+        try:
+            params = np.load(path_of(scaler_entry))
+            models["scaler_X"] = NumpyMinMaxScaler(params["feature_scale"], params["feature_min"])
+            models["scaler_y"] = NumpyMinMaxScaler(params["target_scale"], params["target_min"])
+        except Exception as e:
+            logger.error(f"Error loading LSTM scaler parameters: {e}")
+
+    for name, entry in manifest.get("classifiers", {}).items():
+        try:
+            models[name] = OnnxClassifier(create_session(path_of(entry), num_threads), entry.get("classes", []))
+            logger.info(f"Loaded ONNX {name} classifier")
+        except Exception as e:
+            logger.error(f"Error loading ONNX {name} classifier: {e}")
+
+    for name, entry in manifest.get("policies", {}).items():
+        try:
+            models["policies"][name] = OnnxPolicy(create_session(path_of(entry), num_threads), name)
+            logger.info(f"Loaded ONNX policy: {name}")
+        except Exception as e:
+            logger.error(f"Error loading ONNX policy {name}: {e}")
+
+    return models
@@ -0,0 +1,370 @@
+"""
+Offline Policy Evaluation for PharmaCopilot
+Ranks the CQL checkpoints on logged transitions built from the historical batch time series with
+fitted-Q evaluation (random Fourier features, closed-form ridge steps) and a weighted importance
+sampling estimate, each with batch-level bootstrap confidence intervals computed in parallel.
+Checkpoints whose input width differs from the transition state are refused up front; checkpoints
+saturating their actions are reported but not ranked
+
+Usage:
+    python policy_evaluation.py --bootstrap 200 --jobs 4
+    python policy_evaluation.py --policies baseline new --segment-rows 30
+"""
+
+import argparse
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+from scipy.linalg import cho_factor, cho_solve
+
+from training_data import FORECAST_SENSORS, downtime_mask, load_process_time_series
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+RL_DIR = os.path.join(BASE_DIR, 'Models/')
+
+# Set-point columns of the time series behind speed / compression / fill adjustments
+ACTION_SENSORS = ('tbl_speed', 'main_comp', 'tbl_fill')
+
+# One decision per segment: 30 rows at the 10 s cadence is five minutes
+SEGMENT_ROWS = 30
+
+# A policy with more than this share of its actions at the tanh bounds is not ranked: its value
+# estimates describe the saturated corner, not the policy
+SATURATION_LIMIT = 0.5
+
+def build_transitions(df: pd.DataFrame, sensors: Sequence[str] = FORECAST_SENSORS, segment_rows: int = SEGMENT_ROWS,
+                      action_scale: float = 0.1, downtime_weight: float = 1.0) -> Dict[str, np.ndarray]:
+    """Logged (s, a, r, s', done) transitions, one per pair of consecutive segments of a batch.
+
+    s is the mean of the sensors over a segment's production rows (the RL state the API builds),
+    a is the relative change of the set-point columns to the next segment divided by `action_scale`
+    and clipped to [-1, 1] (the scale /api/what-if and the rollouts use), and r is minus the waste
+    share of the next segment's output minus `downtime_weight` times its share of downtime rows.
+    """
+    parts = {key: [] for key in ("states", "actions", "rewards", "next_states", "dones", "episodes")}
+    columns = list(sensors) + [c for c in ACTION_SENSORS if c not in sensors]
+    action_index = [columns.index(c) for c in ACTION_SENSORS]
+    produced_index, waste_index = columns.index('produced'), columns.index('waste')
+    down = downtime_mask(df).to_numpy()
+
+    for batch_id, rows in df.groupby('batch', sort=True).indices.items():
+        n_segments = len(rows) // segment_rows
+        if n_segments < 2:
+            continue
+        rows = rows[:n_segments * segment_rows]
+        values = df[columns].iloc[rows].ffill().bfill().fillna(0).to_numpy(dtype=np.float64)
+        values = values.reshape(n_segments, segment_rows, len(columns))
+        running = ~down[rows].reshape(n_segments, segment_rows)
+
+        # Means over production rows; a segment that is all downtime falls back to all rows
+        weights = np.where(running.any(axis=1, keepdims=True), running, True).astype(np.float64)
+        means = (values * weights[:, :, None]).sum(axis=1) / weights.sum(axis=1, keepdims=True)
+
+        # produced / waste are counters: output of a segment is its increase
+        produced = np.clip(values[:, -1, produced_index] - values[:, 0, produced_index], 0, None)
+        waste = np.clip(values[:, -1, waste_index] - values[:, 0, waste_index], 0, None)
+        output = produced + waste
+        waste_share = np.divide(waste, output, out=np.zeros_like(waste), where=output > 0)
+        reward = -waste_share - downtime_weight * (1.0 - running.mean(axis=1))
+
+        current, following = means[:-1, action_index], means[1:, action_index]
+        change = np.divide(following, current, out=np.ones_like(current), where=np.abs(current) > 1e-9) - 1.0
+
+        parts["states"].append(means[:-1, :len(sensors)])
+        parts["actions"].append(np.clip(change / action_scale, -1.0, 1.0))
+        parts["rewards"].append(reward[1:])
+        parts["next_states"].append(means[1:, :len(sensors)])
+        parts["dones"].append(np.arange(n_segments - 1) == n_segments - 2)
+        parts["episodes"].append(np.full(n_segments - 1, batch_id))
+
+    if not parts["states"]:
+        raise ValueError("No batch is long enough for two segments")
+    transitions = {key: np.concatenate(value) for key, value in parts.items()}
+    logger.info(f"Built {len(transitions['rewards'])} transitions from {len(parts['states'])} batches")
+    return transitions
+
+class FittedQEvaluator:
+    """Fitted-Q evaluation with a linear model on random Fourier features of (state, action).
+
+    The design matrix of the logged (s, a) pairs is built once. With a linear model the FQE update
+    theta <- A^-1 Phi' W (r + gamma Phi_next theta) stays in feature space, so a bootstrap replicate
+    costs one weighted Gram matrix plus one cross product per policy and the iterations are small
+    (features x features) solves.
+    """
+
+    def __init__(self, transitions: Dict[str, np.ndarray], n_features: int = 256, bandwidth: float = 1.0,
+                 ridge: float = 1e-2, gamma: float = 0.95, iterations: int = 60, seed: int = 0):
+        self.t = transitions
+        self.gamma = gamma
+        self.iterations = iterations
+        self.ridge = ridge
+        states, actions = transitions["states"], transitions["actions"]
+        self.state_mean, self.state_std = states.mean(axis=0), states.std(axis=0) + 1e-9
+
+        rng = np.random.default_rng(seed)
+        dim = states.shape[1] + actions.shape[1]
+        self._W = rng.normal(0.0, 1.0 / bandwidth, size=(dim, n_features))
+        self._b = rng.uniform(0.0, 2 * np.pi, size=n_features)
+
+        self.phi = self.features(states, actions)
+        # Episode starts, for the value of the initial state distribution
+        episodes = transitions["episodes"]
+        self.initial = np.flatnonzero(np.r_[True, episodes[1:] != episodes[:-1]])
+        self.episode_ids, self.episode_index = np.unique(episodes, return_inverse=True)
+
+    def features(self, states: np.ndarray, actions: np.ndarray) -> np.ndarray:
+        x = np.hstack([(states - self.state_mean) / self.state_std, actions])
+        phi = np.sqrt(2.0 / self._W.shape[1]) * np.cos(x @ self._W + self._b)
+        return np.hstack([phi, np.ones((len(phi), 1))])
+
+    def prepare(self, weights: np.ndarray) -> Dict[str, Any]:
+        """Weighted Gram factor and reward projection shared by every policy of a replicate"""
+        weighted = self.phi * weights[:, None]
+        gram = weighted.T @ self.phi
+        gram[np.diag_indices_from(gram)] += self.ridge * weights.sum()
+        return {"weights": weights, "weighted": weighted, "factor": cho_factor(gram),
+                "reward": weighted.T @ self.t["rewards"]}
+
+    def fit_value(self, next_phi: np.ndarray, initial_phi: np.ndarray, prepared: Dict[str, Any]) -> float:
+        """Discounted value of the target policy under the replicate's transition weights"""
+        continuation = self.gamma * (~self.t["dones"])
+        transition = prepared["weighted"].T @ (next_phi * continuation[:, None])
+        theta = np.zeros(self.phi.shape[1])
+        for _ in range(self.iterations):
+            theta = cho_solve(prepared["factor"], prepared["reward"] + transition @ theta)
+        start_weights = prepared["weights"][self.initial]
+        return float((initial_phi @ theta) @ start_weights / start_weights.sum())
+
+class BehaviorModel:
+    """Linear-Gaussian fit of the logged actions given the standardized state"""
+
+    def __init__(self, states: np.ndarray, actions: np.ndarray, ridge: float = 1e-2):
+        self.mean, self.std = states.mean(axis=0), states.std(axis=0) + 1e-9
+        x = self._design(states)
+        self.coef = np.linalg.solve(x.T @ x + ridge * np.eye(x.shape[1]), x.T @ actions)
+        residual = actions - x @ self.coef
+        self.cov = np.cov(residual, rowvar=False) + 1e-4 * np.eye(actions.shape[1])
+
+    def _design(self, states: np.ndarray) -> np.ndarray:
+        return np.hstack([(states - self.mean) / self.std, np.ones((len(states), 1))])
+
+    def log_density(self, states: np.ndarray, actions: np.ndarray) -> np.ndarray:
+        return _gaussian_log_density(actions - self._design(states) @ self.coef, self.cov)
+
+def _gaussian_log_density(residual: np.ndarray, cov: np.ndarray) -> np.ndarray:
+    inverse = np.linalg.inv(cov)
+    _, logdet = np.linalg.slogdet(cov)
+    quad = np.einsum('ij,jk,ik->i', residual, inverse, residual)
+    return -0.5 * (quad + logdet + residual.shape[1] * np.log(2 * np.pi))
+
+def importance_log_weights(behavior: BehaviorModel, states: np.ndarray, actions: np.ndarray,
+                           target_actions: np.ndarray, bandwidth: float = 0.2) -> np.ndarray:
+    """log pi(a|s) / mu(a|s) with the deterministic target smoothed by a Gaussian of `bandwidth`"""
+    target_cov = bandwidth ** 2 * np.eye(actions.shape[1])
+    return _gaussian_log_density(actions - target_actions, target_cov) - behavior.log_density(states, actions)
+
+def weighted_is_estimate(log_weights: np.ndarray, rewards: np.ndarray, counts: np.ndarray) -> Dict[str, float]:
+    """Self-normalized per-step reward under the target policy and the effective sample size"""
+    w = np.exp(log_weights - log_weights.max()) * counts
+    total = w.sum()
+    return {"reward": float(w @ rewards / total), "ess": float(total ** 2 / (w @ w))}
+
+def evaluate_policies(transitions: Dict[str, np.ndarray], policies: Dict[str, Callable[[np.ndarray], np.ndarray]],
+                      gamma: float = 0.95, n_bootstrap: int = 200, n_jobs: int = 4, interval: float = 0.9,
+                      is_bandwidth: float = 0.2, n_features: int = 256, iterations: int = 60,
+                      seed: int = 0, saturation_limit: float = SATURATION_LIMIT) -> Dict[str, Any]:
+    """FQE value and WIS per-step reward of every policy with bootstrap intervals over batches.
+
+    Policies saturating more than `saturation_limit` of their actions are left out of the ranking,
+    with the reason under "unranked"; the ranking is None when fewer than two policies remain to order.
+    """
+    start = time.perf_counter()
+    evaluator = FittedQEvaluator(transitions, n_features=n_features, gamma=gamma, iterations=iterations, seed=seed)
+    behavior = BehaviorModel(transitions["states"], transitions["actions"])
+    states, next_states = transitions["states"], transitions["next_states"]
+    initial_states = states[evaluator.initial]
+
+    # Every policy sees all states in one batched call
+    targets = {}
+    for name, policy in policies.items():
+        act = lambda s: np.clip(np.asarray(policy(s), dtype=np.float64).reshape(len(s), -1)[:, :3], -1.0, 1.0)
+        current = act(states)
+        targets[name] = {
+            "actions": current,
+            "next_phi": evaluator.features(next_states, act(next_states)),
+            "initial_phi": evaluator.features(initial_states, act(initial_states)),
+            "log_weights": importance_log_weights(behavior, states, transitions["actions"], current, is_bandwidth)
+        }
+    # The logged behaviour itself: next action from the log (SARSA-style), plain average reward
+    next_logged = np.vstack([transitions["actions"][1:], np.zeros((1, 3))])
+    logged = {"next_phi": evaluator.features(next_states, next_logged),
+              "initial_phi": evaluator.phi[evaluator.initial]}
+
+    def replicate(counts_per_episode: np.ndarray) -> Dict[str, Dict[str, float]]:
+        counts = counts_per_episode[evaluator.episode_index].astype(np.float64)
+        prepared = evaluator.prepare(counts)
+        result = {"logged": {"fqe": evaluator.fit_value(logged["next_phi"], logged["initial_phi"], prepared),
+                             "reward": float(counts @ transitions["rewards"] / counts.sum())}}
+        for name, target in targets.items():
+            wis = weighted_is_estimate(target["log_weights"], transitions["rewards"], counts)
+            result[name] = {"fqe": evaluator.fit_value(target["next_phi"], target["initial_phi"], prepared),
+                            "reward": wis["reward"], "ess": wis["ess"]}
+        return result
+
+    n_episodes = len(evaluator.episode_ids)
+    point = replicate(np.ones(n_episodes))
+    rng = np.random.default_rng(seed)
+    resamples = [np.bincount(rng.integers(0, n_episodes, n_episodes), minlength=n_episodes) for _ in range(n_bootstrap)]
+    # NumPy / LAPACK release the GIL, so threads run the replicates in parallel
+    with ThreadPoolExecutor(max_workers=max(1, n_jobs)) as pool:
+        replicates = list(pool.map(replicate, resamples))
+
+    tail = (1.0 - interval) / 2.0
+    def ci(name: str, key: str) -> Optional[List[float]]:
+        values = np.array([r[name][key] for r in replicates])
+        return np.quantile(values, [tail, 1.0 - tail]).tolist() if len(values) else None
+
+    report = {}
+    for name in ["logged"] + list(targets):
+        entry = {
+            "fqe_value": point[name]["fqe"],
+            "fqe_value_interval": ci(name, "fqe"),
+            "fqe_per_step_reward": point[name]["fqe"] * (1.0 - gamma),
+            "per_step_reward": point[name]["reward"],
+            "per_step_reward_interval": ci(name, "reward")
+        }
+        if name in targets:
+            entry["wis_effective_sample_size"] = round(point[name]["ess"], 1)
+            entry["mean_action"] = targets[name]["actions"].mean(axis=0).tolist()
+            # Share of actions at the tanh bounds: a policy fed states it wasn't trained on tends to saturate
+            entry["saturated_action_fraction"] = float((np.abs(targets[name]["actions"]) > 0.99).mean())
+            fqe_gain = np.array([r[name]["fqe"] - r["logged"]["fqe"] for r in replicates])
+            entry["fqe_gain_vs_logged"] = point[name]["fqe"] - point["logged"]["fqe"]
+            entry["probability_better_than_logged"] = float((fqe_gain > 0).mean()) if len(fqe_gain) else None
+        report[name] = entry
+
+    unranked = {}
+    for name in targets:
+        if report[name]["saturated_action_fraction"] > saturation_limit:
+            unranked[name] = (f"{report[name]['saturated_action_fraction']:.0%} of the actions at the tanh bounds "
+                              f"(limit {saturation_limit:.0%})")
+    ranked = [name for name in targets if name not in unranked]
+    ranking = sorted(ranked, key=lambda name: report[name]["fqe_value"], reverse=True) if len(ranked) > 1 else None
+
+    return {
+        "policies": report,
+        "ranking": ranking,
+        "unranked": unranked,
+        "transitions": int(len(transitions["rewards"])),
+        "batches": int(n_episodes),
+        "gamma": gamma,
+        "bootstrap_replicates": n_bootstrap,
+        "interval": interval,
+        "is_bandwidth": is_bandwidth,
+        "elapsed_s": round(time.perf_counter() - start, 2)
+    }
+
+def checkpoint_policy(path: str, state_dim: int) -> Callable[[np.ndarray], np.ndarray]:
+    """Greedy batched policy of a CQL checkpoint; raises ValueError unless it takes `state_dim` state features
+    (values estimated for a network fed padded or cut states would not describe the policy)"""
+    import torch
+    from onnx_export import build_policy_network
+
+    network = build_policy_network(torch.load(path, map_location='cpu')['policy'])
+    input_dim = network[0].in_features
+    if input_dim != state_dim:
+        raise ValueError(f"checkpoint expects {input_dim} state features, the logged transitions have {state_dim}")
+
+    def policy(states: np.ndarray) -> np.ndarray:
+        with torch.no_grad():
+            return network(torch.from_numpy(np.ascontiguousarray(states, dtype=np.float32))).numpy()
+
+    return policy
+
+def main():
+    from model_registry import resolve_latest
+    from prediction_api import RL_MODEL_CONFIG
+
+    parser = argparse.ArgumentParser(description='Offline evaluation of the CQL checkpoints on historical batches')
+    parser.add_argument('--policies', nargs='*', default=None, help='RL models to evaluate (default: all configured)')
+    parser.add_argument('--rl-dir', default=RL_DIR)
+    parser.add_argument('--data-dir', default=None, help='Directory with per-product process time series')
+    parser.add_argument('--segment-rows', type=int, default=SEGMENT_ROWS, help='Time series rows per decision')
+    parser.add_argument('--gamma', type=float, default=0.95)
+    parser.add_argument('--bootstrap', type=int, default=200, help='Bootstrap replicates over batches')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--interval', type=float, default=0.9)
+    parser.add_argument('--output', default=None, help='Report path (default: <rl-dir>/policy_evaluation_report.json)')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    # The state build_transitions builds: one value per forecast sensor
+    state_dim = len(FORECAST_SENSORS)
+
+    # Checked before any fitting: a checkpoint that can't take the logged states has nothing to be ranked on
+    policies, checkpoints, refused = {}, {}, {}
+    names = args.policies or [name for name, config in RL_MODEL_CONFIG.items() if config.get('file')]
+    for name in names:
+        path = resolve_latest(args.rl_dir, RL_MODEL_CONFIG[name]['file'])
+        if not os.path.exists(path):
+            logger.warning(f"RL checkpoint not found: {path}")
+            continue
+        try:
+            policies[name] = checkpoint_policy(path, state_dim)
+            checkpoints[name] = os.path.basename(path)
+        except ValueError as e:
+            refused[name] = f"{os.path.basename(path)}: {e}"
+    if not policies and not refused:
+        parser.error("No RL checkpoint found")
+    if not policies:
+        reasons = "\n".join(f"  {name}: {reason}" for name, reason in refused.items())
+        parser.error(f"No checkpoint can be evaluated on the logged transitions:\n{reasons}\n"
+                     f"The policies must take the state build_transitions builds ({', '.join(FORECAST_SENSORS)})")
+    for name, reason in refused.items():
+        logger.warning(f"Not evaluating {name}: {reason}")
+    policies['hold'] = lambda states: np.zeros((len(states), 3))
+
+    transitions = build_transitions(load_process_time_series(args.data_dir), segment_rows=args.segment_rows)
+
+    report = evaluate_policies(transitions, policies, gamma=args.gamma, n_bootstrap=args.bootstrap,
+                               n_jobs=args.jobs, interval=args.interval)
+    for name, checkpoint in checkpoints.items():
+        report["policies"][name]["checkpoint"] = checkpoint
+    report["refused"] = refused
+
+    output = args.output or os.path.join(args.rl_dir, 'policy_evaluation_report.json')
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    print(f"\n{report['transitions']} transitions from {report['batches']} batches, "
+          f"{report['bootstrap_replicates']} bootstrap replicates, {report['elapsed_s']}s")
+    print(f"{'policy':10} {'FQE value':>10} {'interval':>20} {'WIS reward':>11} {'ESS':>8} {'P(>logged)':>11}")
+    # Ranked policies by FQE value; without a valid ranking the table keeps the configured order
+    order = report["ranking"] or [name for name in policies if name not in report["unranked"]]
+    for name in ["logged"] + order + list(report["unranked"]):
+        entry = report["policies"][name]
+        interval = entry["fqe_value_interval"]
+        interval = f"[{interval[0]:.3f}, {interval[1]:.3f}]" if interval else "n/a"
+        ess = entry.get("wis_effective_sample_size", "")
+        better = entry.get("probability_better_than_logged")
+        print(f"{name:10} {entry['fqe_value']:10.4f} {interval:>20} {entry['per_step_reward']:11.4f} "
+              f"{ess:>8} {'' if better is None else f'{better:.2f}':>11}")
+    if report["ranking"] is None:
+        print("\nno ranking: fewer than two policies can be compared")
+    for name, reason in report["unranked"].items():
+        print(f"not ranked: {name}: {reason}")
+    for name, reason in refused.items():
+        print(f"not evaluated: {name}: {reason}")
+    print(f"\nFull report written to {output}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,368 @@
+"""
+Policy Rollout Simulator for PharmaCopilot
+Closed-loop rollouts of the RL policies with the LSTM forecaster as process model: every policy, start
+window and Monte Carlo sample is one row of a single batch, so a control step costs one policy call per
+policy, one forecaster call and one classifier call for all trajectories together
+
+Usage:
+    python policy_rollout.py --starts 32 --samples 8 --steps 6
+    python policy_rollout.py --benchmark --synthetic
+"""
+
+import argparse
+import json
+import logging
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from forecast_uncertainty import supports_mc_dropout
+from what_if import ADJUSTMENTS, QUALITY_CLASSES
+
+logger = logging.getLogger(__name__)
+
+# Sensor column each action component moves (same pairing as the what-if features)
+CONTROLLED_SENSORS = {
+    'speed_adjustment': 'tbl_speed',
+    'compression_adjustment': 'main_comp',
+    'fill_adjustment': 'produced'
+}
+
+# Reference policy that never adjusts anything, added to every comparison
+HOLD_POLICY = 'hold'
+
+def hold_policy(states: np.ndarray) -> np.ndarray:
+    return np.zeros((len(states), len(ADJUSTMENTS)))
+
+def fit_states(states: np.ndarray, input_dim: int) -> np.ndarray:
+    """States zero-padded (or cut) to a policy network's input width, as float32"""
+    fitted = np.zeros((len(states), input_dim), dtype=np.float32)
+    width = min(input_dim, states.shape[1])
+    fitted[:, :width] = states[:, :width]
+    return fitted
+
+def network_policy(predict: Callable[[np.ndarray], np.ndarray], input_dim: int, state_dim: int) -> Dict[str, Any]:
+    """Batched greedy policy around a network's `predict` ((n, input_dim) float32 -> (n, 3) actions), fed
+    `state_dim` rollout states; `state_note` discloses the adaptation when the widths differ"""
+    def policy(states: np.ndarray) -> np.ndarray:
+        return predict(fit_states(states, input_dim))
+
+    note = None if input_dim == state_dim else \
+        f"policy expects {input_dim} state features, the rollout state has {state_dim}; fed zero-padded"
+    return {"policy": policy, "input_dim": input_dim, "state_note": note}
+
+class RolloutEngine:
+    """Rolls policies forward through the forecaster.
+
+    At every control step the RL state of each trajectory (mean of its window, as `get_rl_state`)
+    goes to its policy, the forecaster predicts the next `steps_per_action` rows, the action scales
+    the controlled sensor columns of those rows by (1 + action_scale * action), and the rows are
+    appended to the window. Monte Carlo samples differ through dropout when the forecaster is a Keras
+    model with Dropout layers, otherwise through relative Gaussian noise of `process_noise` on the
+    predicted rows. `score_fn` maps (n, steps, sensors) windows to classifier scores.
+    """
+
+    def __init__(self, forecaster, scaler_X, scaler_y, sensors: Sequence[str],
+                 score_fn: Optional[Callable[[np.ndarray], Dict[str, np.ndarray]]] = None,
+                 steps_per_action: int = 10, action_scale: float = 0.1, process_noise: float = 0.02,
+                 seed: Optional[int] = None):
+        self.forecaster = forecaster
+        self.scaler_X = scaler_X
+        self.scaler_y = scaler_y
+        self.sensors = list(sensors)
+        self.score_fn = score_fn
+        self.steps_per_action = steps_per_action
+        self.action_scale = action_scale
+        self.process_noise = process_noise
+        self.mc_dropout = supports_mc_dropout(forecaster)
+        self.rng = np.random.default_rng(seed)
+        self._controlled = [self.sensors.index(CONTROLLED_SENSORS[name]) for name in ADJUSTMENTS]
+
+    def _forecast(self, windows: np.ndarray, stochastic: bool) -> np.ndarray:
+        n, steps, n_sensors = windows.shape
+        scaled = self.scaler_X.transform(windows.reshape(-1, n_sensors)).reshape(n, steps, n_sensors)
+        scaled = scaled.astype(np.float32)
+        if stochastic and self.mc_dropout:
+            predicted = np.asarray(self.forecaster(scaled, training=True))
+        else:
+            predicted = np.asarray(self.forecaster.predict(scaled, verbose=0))
+        horizon = predicted.shape[1]
+        rows = self.scaler_y.inverse_transform(predicted.reshape(-1, n_sensors)).reshape(n, horizon, n_sensors)
+        rows = rows[:, :self.steps_per_action]
+        if stochastic and not self.mc_dropout and self.process_noise > 0:
+            rows = rows * (1.0 + self.process_noise * self.rng.standard_normal(rows.shape))
+        return rows
+
+    @staticmethod
+    def _act(policy: Callable[[np.ndarray], np.ndarray], states: np.ndarray) -> np.ndarray:
+        actions = np.asarray(policy(states), dtype=np.float64)
+        expected = (len(states), len(ADJUSTMENTS))
+        if actions.shape != expected:
+            raise ValueError(f"policy returned actions of shape {actions.shape}, expected {expected}")
+        return np.clip(actions, -1.0, 1.0)
+
+    def rollout(self, policies: Dict[str, Callable[[np.ndarray], np.ndarray]], start_windows: np.ndarray,
+                steps: int = 6, samples: int = 8) -> Dict[str, Any]:
+        """Simulate `steps` control steps for every (policy, start window, sample).
+
+        Returns per-policy arrays of shape (starts, samples, ...) plus the policies that were
+        dropped because they could not act on the RL state.
+        """
+        start_windows = np.asarray(start_windows, dtype=np.float64)
+        if start_windows.ndim == 2:
+            start_windows = start_windows[np.newaxis]
+
+        # Check each policy once, on a batch the size of its block in the loop, so a broken model
+        # doesn't stop the others
+        probe_states = np.repeat(start_windows.mean(axis=1), samples, axis=0)
+        usable, errors = {}, {}
+        for name, policy in policies.items():
+            try:
+                self._act(policy, probe_states)
+                usable[name] = policy
+            except Exception as e:
+                logger.warning(f"Policy {name} cannot act on the rollout state: {e}")
+                errors[name] = str(e)
+
+        names = list(usable)
+        if not names:
+            return {"policies": {}, "errors": errors, "trajectories": 0, "steps": steps, "stochastic": samples > 1,
+                    "sampling": None, "elapsed_s": 0.0, "trajectory_steps_per_second": None}
+        n_starts = len(start_windows)
+        per_policy = n_starts * samples
+        # Row order: policy-major, then start window, then sample
+        windows = np.tile(np.repeat(start_windows, samples, axis=0), (len(names), 1, 1))
+        n = len(windows)
+        stochastic = samples > 1
+
+        actions = np.zeros((n, steps, len(ADJUSTMENTS)))
+        trajectory = np.zeros((n, steps * self.steps_per_action, len(self.sensors)))
+        scores: Dict[str, List[np.ndarray]] = {}
+
+        start = time.perf_counter()
+        for step in range(steps):
+            states = windows.mean(axis=1)
+            for p, name in enumerate(names):
+                rows = slice(p * per_policy, (p + 1) * per_policy)
+                actions[rows, step] = self._act(usable[name], states[rows])
+
+            predicted = self._forecast(windows, stochastic)
+            predicted[:, :, self._controlled] *= 1.0 + self.action_scale * actions[:, step, np.newaxis, :]
+            window_length = windows.shape[1]
+            windows = np.concatenate([windows, predicted], axis=1)[:, -window_length:]
+            trajectory[:, step * self.steps_per_action:(step + 1) * self.steps_per_action] = predicted
+
+            if self.score_fn is not None:
+                for key, value in self.score_fn(windows).items():
+                    scores.setdefault(key, []).append(np.asarray(value))
+        elapsed = time.perf_counter() - start
+
+        def split(array: np.ndarray, p: int) -> np.ndarray:
+            block = array[p * per_policy:(p + 1) * per_policy]
+            return block.reshape(n_starts, samples, *array.shape[1:])
+
+        stacked = {key: np.stack(values, axis=1) for key, values in scores.items()}
+        results = {}
+        for p, name in enumerate(names):
+            results[name] = {
+                "actions": split(actions, p),
+                "trajectory": split(trajectory, p),
+                "scores": {key: split(value, p) for key, value in stacked.items()}
+            }
+
+        return {
+            "policies": results,
+            "errors": errors,
+            "trajectories": n,
+            "steps": steps,
+            "stochastic": stochastic,
+            "sampling": ("mc_dropout" if self.mc_dropout else "process_noise") if stochastic else "deterministic",
+            "elapsed_s": elapsed,
+            "trajectory_steps_per_second": n * steps / elapsed if elapsed > 0 else None
+        }
+
+def summarize_rollout(result: Dict[str, Any], sensors: Sequence[str], interval: float = 0.8,
+                      unranked: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    """Per-policy outcome distribution over start windows and samples, and the ranking by defect risk.
+
+    Policies in `unranked` (name -> reason, e.g. fed zero-padded states) are summarized but neither
+    ranked nor compared with the hold reference.
+    """
+    unranked = {name: reason for name, reason in (unranked or {}).items() if name in result["policies"]}
+    tail = (1.0 - interval) / 2.0
+    summaries = {}
+    for name, policy in result["policies"].items():
+        actions = policy["actions"]
+        trajectory = policy["trajectory"]
+        entry = {
+            "mean_action": dict(zip(ADJUSTMENTS, actions.mean(axis=(0, 1, 2)).tolist())),
+            "mean_abs_action": dict(zip(ADJUSTMENTS, np.abs(actions).mean(axis=(0, 1, 2)).tolist())),
+            "final_sensor_mean": dict(zip(sensors, trajectory[:, :, -1].mean(axis=(0, 1)).tolist()))
+        }
+        defect = policy["scores"].get("defect")
+        if defect is not None:
+            final = defect[:, :, -1].reshape(-1)
+            lower, median, upper = np.quantile(final, [tail, 0.5, 1.0 - tail])
+            entry["defect_probability"] = {
+                "final_mean": float(final.mean()),
+                "final_median": float(median),
+                "final_interval": [float(lower), float(upper)],
+                "per_step_mean": defect.mean(axis=(0, 1)).tolist()
+            }
+        quality = policy["scores"].get("quality")
+        if quality is not None:
+            final = quality[:, :, -1].reshape(-1, len(QUALITY_CLASSES))
+            entry["final_quality"] = {
+                "class_probabilities": dict(zip(QUALITY_CLASSES, final.mean(axis=0).tolist())),
+                "class_shares": dict(zip(QUALITY_CLASSES, np.bincount(final.argmax(axis=1),
+                                                                      minlength=len(QUALITY_CLASSES)).tolist()))
+            }
+        summaries[name] = entry
+
+    ranking = sorted((name for name in summaries if "defect_probability" in summaries[name] and name not in unranked),
+                     key=lambda name: summaries[name]["defect_probability"]["final_mean"])
+    hold = summaries.get(HOLD_POLICY, {}).get("defect_probability")
+    if hold is not None:
+        for name in ranking:
+            summaries[name]["defect_probability"]["change_vs_hold"] = \
+                summaries[name]["defect_probability"]["final_mean"] - hold["final_mean"]
+
+    return {
+        "policies": summaries,
+        "ranking": ranking,
+        "unranked": unranked,
+        "errors": result["errors"],
+        "trajectories": result["trajectories"],
+        "control_steps": result["steps"],
+        "sampling": result["sampling"],
+        "interval": interval,
+        "elapsed_s": round(result["elapsed_s"], 4),
+        "trajectory_steps_per_second": round(result["trajectory_steps_per_second"] or 0.0, 1)
+    }
+
+class _SyntheticForecaster:
+    """Fixed random linear map from a scaled window to the next 30 rows (benchmark stand-in for the LSTM)"""
+
+    def __init__(self, steps: int = 60, n_sensors: int = 7, horizon: int = 30, seed: int = 0):
+        rng = np.random.default_rng(seed)
+        self.weights = rng.normal(0.0, 0.02, size=(steps * n_sensors, horizon * n_sensors)).astype(np.float32)
+        self.horizon, self.n_sensors = horizon, n_sensors
+
+    def predict(self, x, verbose: int = 0) -> np.ndarray:
+        x = np.asarray(x, dtype=np.float32)
+        flat = x[:, -1, :].repeat(self.horizon, axis=0).reshape(len(x), -1)
+        return (flat + np.tanh(x.reshape(len(x), -1) @ self.weights) * 0.05).reshape(len(x), self.horizon, self.n_sensors)
+
+class _IdentityScaler:
+    def transform(self, X):
+        return np.asarray(X)
+
+    def inverse_transform(self, X):
+        return np.asarray(X)
+
+def _synthetic_scores(windows: np.ndarray) -> Dict[str, np.ndarray]:
+    # Defect risk grows with the compression force drifting away from its starting level
+    drift = np.abs(windows[:, :, 6].mean(axis=1) - 1.0)
+    return {"defect": 1.0 / (1.0 + np.exp(-(drift * 40.0 - 2.0)))}
+
+def _synthetic_policy(seed: int) -> Callable[[np.ndarray], np.ndarray]:
+    weights = np.random.default_rng(seed).normal(0.0, 0.1, size=(7, len(ADJUSTMENTS)))
+    return lambda states: np.tanh((states - states.mean(axis=0)) @ weights)
+
+def benchmark(engine: RolloutEngine, policies: Dict[str, Callable[[np.ndarray], np.ndarray]],
+              start_windows: np.ndarray, steps: int = 6, samples: int = 8, loop_trajectories: int = 16) -> Dict[str, Any]:
+    """Batched rollout throughput against rolling the same trajectories one at a time"""
+    engine.rollout(policies, start_windows[:1], steps=1, samples=1)  # warm-up
+    batched = engine.rollout(policies, start_windows, steps=steps, samples=samples)
+
+    # One trajectory per call, as a per-trajectory loop would run them
+    start = time.perf_counter()
+    looped = 0
+    for name, policy in list(policies.items())[:1]:
+        for window in start_windows[:loop_trajectories]:
+            engine.rollout({name: policy}, window[np.newaxis], steps=steps, samples=1)
+            looped += 1
+    loop_elapsed = time.perf_counter() - start
+    loop_rate = looped * steps / loop_elapsed if loop_elapsed > 0 else None
+
+    rate = batched["trajectory_steps_per_second"]
+    return {
+        "policies": len(batched["policies"]),
+        "start_windows": len(start_windows),
+        "samples": samples,
+        "trajectories": batched["trajectories"],
+        "control_steps": steps,
+        "batched_elapsed_s": round(batched["elapsed_s"], 4),
+        "batched_trajectory_steps_per_second": round(rate, 1),
+        "looped_trajectory_steps_per_second": round(loop_rate, 1) if loop_rate else None,
+        "speedup": round(rate / loop_rate, 1) if loop_rate else None
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Closed-loop rollouts of the RL policies through the LSTM forecaster')
+    parser.add_argument('--policies', nargs='*', default=None, help='RL models to compare (default: all loaded)')
+    parser.add_argument('--starts', type=int, default=32, help='Start windows from the held-out batches')
+    parser.add_argument('--samples', type=int, default=8, help='Monte Carlo samples per start window')
+    parser.add_argument('--steps', type=int, default=6, help='Control steps per rollout')
+    parser.add_argument('--steps-per-action', type=int, default=10, help='Forecast rows each action is held for')
+    parser.add_argument('--data-dir', default=None, help='Directory with per-product process time series')
+    parser.add_argument('--benchmark', action='store_true', help='Measure batched versus per-trajectory throughput')
+    parser.add_argument('--synthetic', action='store_true', help='Use a synthetic forecaster and policies (no models needed)')
+    parser.add_argument('--output', default=None, help='Write the summary as JSON')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    if args.synthetic:
+        rng = np.random.default_rng(0)
+        sensors = ['waste', 'produced', 'ejection', 'tbl_speed', 'stiffness', 'SREL', 'main_comp']
+        windows = rng.normal(1.0, 0.05, size=(args.starts, 60, len(sensors)))
+        engine = RolloutEngine(_SyntheticForecaster(), _IdentityScaler(), _IdentityScaler(), sensors,
+                               score_fn=_synthetic_scores, steps_per_action=args.steps_per_action, seed=0)
+        policies = {f"policy_{i}": _synthetic_policy(i) for i in range(3)}
+        state_notes, policy_errors = {}, {}
+    else:
+        import prediction_api
+        from training_data import load_holdout_windows
+
+        prediction_api.load_models()
+        engine = prediction_api.build_rollout_engine(steps_per_action=args.steps_per_action)
+        if engine is None:
+            parser.error("The LSTM forecaster is not available, use --synthetic")
+        sensors = prediction_api.selected_sensors
+        windows, _, _ = load_holdout_windows(args.data_dir, max_windows=args.starts)
+        policies, state_notes, policy_errors = prediction_api.get_rollout_policies(args.policies)
+    policies[HOLD_POLICY] = hold_policy
+
+    if args.benchmark:
+        for key, value in benchmark(engine, policies, windows, steps=args.steps, samples=args.samples).items():
+            print(f"{key:>36}: {value}")
+        return
+
+    summary = summarize_rollout(engine.rollout(policies, windows, steps=args.steps, samples=args.samples), sensors,
+                                unranked=state_notes)
+    summary["errors"].update(policy_errors)
+    print(f"\n{summary['trajectories']} trajectories x {summary['control_steps']} control steps "
+          f"({summary['sampling']}), {summary['trajectory_steps_per_second']:.0f} trajectory-steps/s")
+    print(f"{'policy':12} {'defect p (mean)':>16} {'interval':>20} {'vs hold':>9}")
+    for name, entry in summary["policies"].items():
+        defect = entry.get("defect_probability")
+        if defect is None:
+            print(f"{name:12} {'n/a':>16}")
+            continue
+        interval = f"[{defect['final_interval'][0]:.3f}, {defect['final_interval'][1]:.3f}]"
+        change = defect.get("change_vs_hold")
+        print(f"{name:12} {defect['final_mean']:16.4f} {interval:>20} {'' if change is None else f'{change:+.4f}':>9}")
+    for name, reason in summary["unranked"].items():
+        print(f"{name:12} not ranked: {reason}")
+    for name, error in summary["errors"].items():
+        print(f"{name:12} skipped: {error}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(summary, f, indent=2)
+        print(f"\nSummary written to {args.output}")
+
+if __name__ == '__main__':
+    main()
@@ -1,24 +1,74 @@
 import fastapi
 import uvicorn
-from fastapi import FastAPI, HTTPException
+from fastapi import Body, FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from contextlib import asynccontextmanager
+from fastapi.responses import Response, StreamingResponse
+from contextlib import asynccontextmanager, suppress
 import requests
 import numpy as np
 import pandas as pd
 import pickle
-import tensorflow as tf
-import torch
-from d3rlpy.algos import CQL
-from sklearn.preprocessing import StandardScaler, MinMaxScaler, LabelEncoder
 from collections import deque
-from apscheduler.schedulers.background import BackgroundScheduler
 import logging
 import json
-import h5py
-from typing import List, Dict, Optional, Any
+from typing import List, Dict, Optional, Any, Tuple
 from datetime import datetime, timedelta
 import os
+import asyncio
+import itertools
+import time
+
+from prediction_stream import PredictionBroadcaster, STREAM_TOPICS, format_sse
+from model_registry import ModelRegistry, ModelSlot, fingerprint, resolve_latest
+from model_pool import ModelPool
+from shared_state import DEFAULT_SHARED_STATE_NAME, SharedBufferView, SharedSensorState, SharedStateClient
+from buffer_snapshot import PersistentSensorState
+from feature_store import BatchFeatureStore, load_feature_store
+from batch_features import READING_FIELDS, BatchFeatureTracker, parse_reading
+from robust_filter import HampelFilter
+from history_pyramid import HistoryPyramid
+from sensor_log import SensorLog, to_list
+from sensor_decoder import SensorRecordDecoder
+from prediction_audit import PredictionAudit, hash_inputs
+from request_coalescing import SingleFlight
+from anomaly_detection import StreamingSensorMonitor
+from sensor_resampler import TimestampResampler, parse_source_timestamp
+from adaptive_polling import DUPLICATE, FAILED, UNCHANGED, UPDATED, AdaptivePollInterval
+from forecast_uncertainty import mc_dropout_samples, summarize_samples, supports_mc_dropout
+from what_if import ADJUSTMENTS, build_scenarios, format_scenarios, grid_product_size, score_feature_matrix, score_scenarios
+from policy_rollout import HOLD_POLICY, RolloutEngine, hold_policy, network_policy, summarize_rollout
+from conditional_requests import ConditionalGetStats, etag_matches, make_etag
+from inference_executor import (InferenceExecutor, InferenceOverloaded, InferenceUnavailable, configure_framework_threads,
+                                configure_thread_environment, limit_model_threads, thread_budget)
+
+# Inference worker pool: model calls run on INFERENCE_WORKERS threads off the event loop, each library is limited
+# to INFERENCE_THREADS intra-op threads, and more than INFERENCE_MAX_QUEUE waiting calls are rejected with 429
+INFERENCE_WORKERS = int(os.environ.get('INFERENCE_WORKERS', '2'))
+INFERENCE_THREADS = int(os.environ.get('INFERENCE_THREADS', '0')) or thread_budget(INFERENCE_WORKERS)
+INFERENCE_MAX_QUEUE = int(os.environ.get('INFERENCE_MAX_QUEUE', '8'))
+
+# Must run before TensorFlow / PyTorch are imported
+configure_thread_environment(INFERENCE_THREADS)
+
+# Model runtime: 'native' loads the training frameworks (TensorFlow, PyTorch, d3rlpy, XGBoost, sklearn),
+# 'onnx' serves the exported models with onnxruntime and NumPy only (see onnx_export.py)
+PREDICTION_RUNTIME = os.environ.get('PREDICTION_RUNTIME', 'native').lower()
+
+if PREDICTION_RUNTIME == 'onnx':
+    from onnx_runtime import ONNX_MANIFEST, load_onnx_models
+    tf = None
+    torch = None
+    QUANTIZATION_MODES = ('float32',)
+else:
+    PREDICTION_RUNTIME = 'native'
+    import tensorflow as tf
+    import torch
+    import h5py
+    from d3rlpy.algos import CQL
+    from sklearn.preprocessing import StandardScaler, MinMaxScaler, LabelEncoder
+    from lstm_quantization import (QUANTIZATION_MODES, QuantizedLSTMForecaster, convert_lstm_model,
+                                   load_quantized_lstm, quantized_model_path)
+    configure_framework_threads(INFERENCE_THREADS, tf=tf, torch=torch)
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -28,6 +78,91 @@ logger = logging.getLogger(__name__)
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 MODEL_DIR = os.path.join(BASE_DIR, 'New Output/')
 RL_DIR = os.path.join(BASE_DIR, 'Models/')
+ONNX_DIR = os.environ.get('ONNX_MODEL_DIR', os.path.join(MODEL_DIR, 'onnx'))
+
+# Product-specific model sets: <PRODUCT_MODEL_DIR>/<product code>/ with the same file names as MODEL_DIR
+# (an onnx/ export for the onnx runtime); missing files fall back to the shared models. At most
+# PRODUCT_MODEL_POOL_SIZE sets / PRODUCT_MODEL_POOL_MB are kept, least recently used evicted first.
+PRODUCT_MODEL_DIR = os.environ.get('PRODUCT_MODEL_DIR', os.path.join(MODEL_DIR, 'products'))
+PRODUCT_MODEL_POOL_SIZE = int(os.environ.get('PRODUCT_MODEL_POOL_SIZE', '4'))
+PRODUCT_MODEL_POOL_MB = float(os.environ.get('PRODUCT_MODEL_POOL_MB', '1024'))
+
+# LSTM inference precision: float32 (Keras), float16 or int8 (TFLite, for CPU-only edge boxes)
+LSTM_INFERENCE_MODE = os.environ.get('LSTM_INFERENCE_MODE', 'float32').lower()
+if LSTM_INFERENCE_MODE not in QUANTIZATION_MODES:
+    LSTM_INFERENCE_MODE = 'float32'
+
+# Model registry: poll interval for new artifact versions (0 disables the watcher) and optional manifest
+# pinning live/shadow files per slot, e.g. {"slots": {"rl:current": {"live": "...pt", "shadow": "...pt"}}}
+MODEL_REGISTRY_POLL_SECONDS = float(os.environ.get('MODEL_REGISTRY_POLL_SECONDS', '30'))
+MODEL_MANIFEST = os.environ.get('MODEL_MANIFEST', os.path.join(BASE_DIR, 'model_manifest.json'))
+
+# Shadow forecasts agree with the live model when the mean absolute difference is within this fraction
+SHADOW_FORECAST_TOLERANCE = 0.05
+
+# Sensor state: 'local' (each process polls and buffers on its own), 'ingester' (sensor_ingester.py owns the
+# buffers and publishes them to shared memory) or 'worker' (stateless uvicorn worker reading the ingester's segment)
+SENSOR_STATE_MODE = os.environ.get('SENSOR_STATE_MODE', 'local').lower()
+SENSOR_STATE_SHM = os.environ.get('SENSOR_STATE_SHM', DEFAULT_SHARED_STATE_NAME)
+
+# Buffers and last pipeline results are persisted here every tick and restored at startup if younger than
+# BUFFER_SNAPSHOT_MAX_AGE seconds (one full buffer span by default); an empty path disables persistence
+BUFFER_SNAPSHOT_PATH = os.environ.get('BUFFER_SNAPSHOT_PATH', os.path.join(BASE_DIR, 'sensor_buffer_state.bin'))
+BUFFER_SNAPSHOT_MAX_AGE = float(os.environ.get('BUFFER_SNAPSHOT_MAX_AGE', '600'))
+
+# Every sensor reading is appended to an on-disk columnar log (segments rotated at SENSOR_LOG_SEGMENT_ROWS rows
+# or each UTC day) for investigations and replays; an empty path disables it. Range reads return at most
+# SENSOR_LOG_MAX_ROWS rows
+SENSOR_LOG_DIR = os.environ.get('SENSOR_LOG_DIR', os.path.join(BASE_DIR, 'sensor_log'))
+SENSOR_LOG_SEGMENT_ROWS = int(os.environ.get('SENSOR_LOG_SEGMENT_ROWS', '16384'))
+SENSOR_LOG_MAX_ROWS = int(os.environ.get('SENSOR_LOG_MAX_ROWS', '10000'))
+
+# Audit trail of every pipeline run and served prediction (SQLite, empty path disables): records wait in a
+# queue of AUDIT_QUEUE_SIZE (dropped when full) and are written AUDIT_BATCH_SIZE at a time, at least every
+# AUDIT_FLUSH_SECONDS; queries return at most AUDIT_MAX_RECORDS records
+AUDIT_DB_PATH = os.environ.get('AUDIT_DB_PATH', os.path.join(BASE_DIR, 'prediction_audit.db'))
+AUDIT_QUEUE_SIZE = int(os.environ.get('AUDIT_QUEUE_SIZE', '10000'))
+AUDIT_BATCH_SIZE = int(os.environ.get('AUDIT_BATCH_SIZE', '200'))
+AUDIT_FLUSH_SECONDS = float(os.environ.get('AUDIT_FLUSH_SECONDS', '1.0'))
+AUDIT_MAX_RECORDS = int(os.environ.get('AUDIT_MAX_RECORDS', '1000'))
+
+# Readings are resampled onto the training cadence (10 s); gaps up to SENSOR_MAX_GAP_SECONDS are interpolated,
+# a window with more than SPARSE_WINDOW_FRACTION interpolated rows (or a longer gap) is flagged as sparse
+SENSOR_CADENCE_SECONDS = float(os.environ.get('SENSOR_CADENCE_SECONDS', '10'))
+SENSOR_MAX_GAP_SECONDS = float(os.environ.get('SENSOR_MAX_GAP_SECONDS', '60'))
+SPARSE_WINDOW_FRACTION = float(os.environ.get('SPARSE_WINDOW_FRACTION', '0.2'))
+
+# Hampel outlier filter ahead of the smoothing: filtered sensors (empty disables), rolling window in rows,
+# threshold in robust standard deviations and the smallest relative deviation that counts as an outlier
+ROBUST_FILTER_SENSORS = [name.strip() for name in os.environ.get(
+    'ROBUST_FILTER_SENSORS', 'main_comp,ejection').split(',') if name.strip()]
+ROBUST_FILTER_WINDOW = int(os.environ.get('ROBUST_FILTER_WINDOW', '7'))
+ROBUST_FILTER_SIGMAS = float(os.environ.get('ROBUST_FILTER_SIGMAS', '3.0'))
+ROBUST_FILTER_MIN_DEVIATION = float(os.environ.get('ROBUST_FILTER_MIN_DEVIATION', '0.1'))
+
+# Sensor polling: base interval, the shortest interval while readings change, and the longest
+# backoff while the sensor API is down
+SENSOR_POLL_INTERVAL = float(os.environ.get('SENSOR_POLL_INTERVAL', '10'))
+SENSOR_POLL_MIN_INTERVAL = float(os.environ.get('SENSOR_POLL_MIN_INTERVAL', '2.5'))
+SENSOR_POLL_MAX_BACKOFF = float(os.environ.get('SENSOR_POLL_MAX_BACKOFF', '300'))
+
+# Batch-lifetime process features: they replace the 60-point approximations once the running batch has
+# BATCH_FEATURES_MIN_READINGS production readings; closed batches are appended to BATCH_HISTORY_PATH (empty disables)
+BATCH_FEATURES_MIN_READINGS = int(os.environ.get('BATCH_FEATURES_MIN_READINGS', '30'))
+BATCH_HISTORY_PATH = os.environ.get('BATCH_HISTORY_PATH', os.path.join(BASE_DIR, 'batch_history.csv'))
+
+# Monte Carlo dropout forecast intervals (/api/forecast?uncertainty=true): default and maximum stochastic passes
+FORECAST_MC_PASSES = int(os.environ.get('FORECAST_MC_PASSES', '50'))
+FORECAST_MC_MAX_PASSES = int(os.environ.get('FORECAST_MC_MAX_PASSES', '200'))
+
+# What-if scoring: maximum scenarios per request and the relative change an RL action of 1.0 stands for
+WHAT_IF_MAX_SCENARIOS = int(os.environ.get('WHAT_IF_MAX_SCENARIOS', '20000'))
+WHAT_IF_RL_ACTION_SCALE = float(os.environ.get('WHAT_IF_RL_ACTION_SCALE', '0.1'))
+
+# Policy rollouts: cap on policies x start windows x samples per request, and the relative noise
+# that separates Monte Carlo samples when the forecaster has no dropout at inference time
+ROLLOUT_MAX_TRAJECTORIES = int(os.environ.get('ROLLOUT_MAX_TRAJECTORIES', '4096'))
+ROLLOUT_PROCESS_NOISE = float(os.environ.get('ROLLOUT_PROCESS_NOISE', '0.02'))
 
 # API base URL
 SENSOR_API_BASE = 'https://cholesterol-sensor-api-4ad950146578.herokuapp.com'
@@ -42,6 +177,7 @@ xgb_quality = None
 feature_scaler = None
 feature_names = []
 cql_models = {}
+onnx_models_version = None
 
 # RL model configuration for version compatibility
 RL_MODEL_CONFIG = {
@@ -72,6 +208,65 @@ sensor_buffer = deque(maxlen=60)
 # Processed sensor buffer (stores preprocessed sequences)
 processed_buffer = deque(maxlen=60)
 
+# Batch and product code of the running batch, as reported by the sensor API (None when not reported)
+current_batch_context = {"batch": None, "code": None}
+
+# Fixed-cadence resampling of the sensor readings by source timestamp
+sensor_resampler = TimestampResampler(len(selected_sensors), cadence_seconds=SENSOR_CADENCE_SECONDS,
+                                      max_gap_seconds=SENSOR_MAX_GAP_SECONDS, window=60,
+                                      sparse_fraction=SPARSE_WINDOW_FRACTION)
+
+# Raw window plus 1-minute / 10-minute / hourly aggregates of the resampled rows (fixed memory)
+history_pyramid = HistoryPyramid(selected_sensors, raw_window=sensor_buffer.maxlen)
+
+# Streaming Hampel filter (rows of selected_sensors) and the filtered rows the smoothing runs over
+robust_filter = HampelFilter(selected_sensors, ROBUST_FILTER_SENSORS, window=ROBUST_FILTER_WINDOW,
+                             n_sigmas=ROBUST_FILTER_SIGMAS, min_deviation=ROBUST_FILTER_MIN_DEVIATION) if ROBUST_FILTER_SENSORS else None
+filtered_rows = deque(maxlen=10)
+
+# Adaptive poll interval of the ingestion loop and the last source reading (for duplicate / change checks)
+sensor_poller = AdaptivePollInterval(base=SENSOR_POLL_INTERVAL, minimum=SENSOR_POLL_MIN_INTERVAL,
+                                     maximum=SENSOR_POLL_MAX_BACKOFF)
+last_source_reading = {"time": None, "values": None}
+
+# Online shift/drift detectors over the raw sensor stream (re-baselined when a new batch starts)
+sensor_monitor = StreamingSensorMonitor(selected_sensors)
+
+# Static per-batch classifier features (laboratory, process and normalization tables), loaded in load_models
+batch_feature_store = BatchFeatureStore.defaults()
+
+# Process features accumulated over every reading of the running batch (keyed by campaign and batch)
+batch_feature_tracker = BatchFeatureTracker(
+    lambda batch, code: batch_feature_store.features(batch, code)['normalization_factor'],
+    history_path=BATCH_HISTORY_PATH, min_production_readings=BATCH_FEATURES_MIN_READINGS)
+
+# Bumped on every local buffer change; concurrent identical requests are coalesced per version
+_buffer_versions = itertools.count(1)
+buffer_version = 0
+# Tells local buffer versions of this run apart from those of a previous run in ETags
+BUFFER_EPOCH = format(time.time_ns(), 'x')
+
+# On-disk sensor history, opened at startup (read-only in workers)
+sensor_log = None
+
+# Prediction audit trail, opened at startup, and the hash of the buffers per buffer version
+prediction_audit = None
+buffer_digest_cache = {"version": None, "digest": None}
+
+# Memory-mapped copy of the buffers for warm restarts (not used by workers, the ingester owns the buffers)
+buffer_snapshot = None
+
+# Shared-memory segment written by the ingester (ingester mode) or mapped read-only (worker mode)
+shared_state = None
+shared_state_client = None
+# Pyramid rows last copied to the segment (ingester) and the write version the local pyramid was loaded from (worker)
+shared_history_rows = None
+shared_history_version = None
+if SENSOR_STATE_MODE == 'worker':
+    shared_state_client = SharedStateClient(SENSOR_STATE_SHM)
+    sensor_buffer = SharedBufferView(shared_state_client, 'raw')
+    processed_buffer = SharedBufferView(shared_state_client, 'processed')
+
 # API endpoint mapping (from API to our sensor names)
 sensor_mapping = {
     'waste': 'waste',
@@ -94,8 +289,43 @@ default_sensor_values = {
     'main_comp': 15.0
 }
 
-# Initialize scheduler
-scheduler = BackgroundScheduler()
+# Sensor API records -> rows of selected_sensors, with the mapping and defaults resolved once. float64, so
+# rows decoded from /api/latest or /api/all equal the rows of the same readings from /api/current
+sensor_decoder = SensorRecordDecoder(selected_sensors, sensor_mapping, default_sensor_values, dtype=np.float64)
+
+# Reading fields kept in the sensor log: the model sensors, what the batch features read and the batch
+# context, i.e. everything ingestion uses, so a replay of the log reproduces the pipeline inputs exactly
+sensor_log_fields = list(dict.fromkeys([sensor_mapping.get(sensor, sensor) for sensor in selected_sensors]
+                                       + READING_FIELDS + ['campaign', 'batch', 'code']))
+
+# Latest pipeline results (one snapshot per sensor tick)
+pipeline_sequence = 0
+latest_pipeline_snapshot = None
+
+# Push delivery of pipeline snapshots to WebSocket/SSE clients
+prediction_broadcaster = PredictionBroadcaster()
+
+# MC dropout results of the current buffer version, keyed by (version, models, passes, interval)
+forecast_uncertainty_cache = {}
+
+# Rollout policy of each RL model type, with the model object it was built from (rebuilt after a swap)
+rollout_policy_cache = {}
+
+# Single-flight coalescing of concurrent identical prediction requests
+request_coalescer = SingleFlight()
+
+# GET routes whose response only changes with the buffered data or the live models; they carry an ETag
+# and answer If-None-Match with 304
+CONDITIONAL_GET_ROUTES = ('/api/current', '/api/forecast', '/api/defect', '/api/quality', '/api/batch-features',
+                          '/api/anomalies', '/api/history')
+CONDITIONAL_GET_PREFIXES = ('/api/rl_action/',)
+conditional_get_stats = ConditionalGetStats()
+
+# Bounded pool for CPU-bound model calls
+inference_executor = InferenceExecutor(max_workers=INFERENCE_WORKERS, max_queue=INFERENCE_MAX_QUEUE)
+
+# Versioned model slots with hot reload and shadow scoring
+model_registry = ModelRegistry(poll_interval=MODEL_REGISTRY_POLL_SECONDS, manifest_path=MODEL_MANIFEST)
 
 def detect_downtime(sensor_data: List[float], downtime_threshold: float = 0.1) -> bool:
     """Detect if current sensor readings indicate downtime (based on training logic)"""
@@ -222,23 +452,8 @@ def compute_advanced_features(buffer_data: List[List[float]]) -> Dict[str, float
         # 9. Ejection features
         features['ejection_mean'] = df['ejection'].mean()
         
-        # 10. Categorical features (defaults from training)
-        features['code'] = 25  # Default product code
-        features['strength_encoded'] = 0  # Default strength
-        features['weekend_encoded'] = 0  # Assume weekday
-        features['start_month'] = datetime.now().month
-        features['normalization_factor'] = 1.0
-        
-        # 11. Laboratory features (set to median values from training - matching feature_names.txt)
-        features['api_content'] = 94.4
-        features['lactose_water'] = 4.5
-        features['smcc_water'] = 2.8
-        features['smcc_td'] = 0.5
-        features['smcc_bd'] = 0.3
-        features['starch_ph'] = 7.0
-        features['starch_water'] = 12.0
-        features['tbl_min_thickness'] = 3.5
-        features['tbl_max_thickness'] = 4.2
+        # 10-11. Categorical and laboratory features of the running batch (product / training medians if unknown)
+        features.update(batch_feature_store.features(**get_batch_context()))
         
         return features
         
@@ -246,7 +461,7 @@ def compute_advanced_features(buffer_data: List[List[float]]) -> Dict[str, float
         logger.error(f"Error computing advanced features: {e}")
         return None
 
-def create_lstm_model_from_weights():
+def create_lstm_model_from_weights(weights_path: Optional[str] = None, require_weights: bool = False):
     """Create LSTM model architecture and load weights separately to avoid config issues"""
     try:
         # Define the model architecture based on training code
@@ -266,9 +481,11 @@ def create_lstm_model_from_weights():
         # Try to load weights from the saved model
         try:
             # Try to load weights directly
-            model.load_weights(MODEL_DIR + 'lstm_sensor_forecasting_model.h5')
+            model.load_weights(weights_path or MODEL_DIR + 'lstm_sensor_forecasting_model.h5')
             logger.info("Loaded LSTM model weights successfully")
         except Exception as e:
+            if require_weights:
+                raise
             logger.warning(f"Could not load weights: {e}, using initialized model")
         
         return model
@@ -277,6 +494,17 @@ def create_lstm_model_from_weights():
         logger.error(f"Error creating LSTM model: {e}")
         return None
 
+def get_d3rlpy_version() -> str:
+    """Installed d3rlpy version, or a marker when running without it"""
+    if PREDICTION_RUNTIME == 'onnx':
+        return 'not loaded (onnx runtime)'
+    import d3rlpy
+    import pkg_resources
+    try:
+        return pkg_resources.get_distribution('d3rlpy').version
+    except:
+        return getattr(d3rlpy, '__version__', 'unknown')
+
 def load_rl_models():
     """Load RL models with version compatibility handling"""
     global cql_models
@@ -284,11 +512,7 @@ def load_rl_models():
     try:
         # Check d3rlpy version
         import d3rlpy
-        import pkg_resources
-        try:
-            d3rlpy_version = pkg_resources.get_distribution('d3rlpy').version
-        except:
-            d3rlpy_version = getattr(d3rlpy, '__version__', 'unknown')
+        d3rlpy_version = get_d3rlpy_version()
         logger.info(f"Loading RL models with d3rlpy version: {d3rlpy_version}")
         
         # List RL model files
@@ -301,7 +525,10 @@ def load_rl_models():
         
         # Try to load each RL model
         for model_name, config in RL_MODEL_CONFIG.items():
-            model_path = os.path.join(RL_DIR, config['file'])
+            if config.get('file') is None:
+                continue
+            # Newest checkpoint of the same family, so retrained models are picked up without editing the config
+            model_path = resolve_latest(RL_DIR, config['file'])
             
             if not os.path.exists(model_path):
                 logger.warning(f"RL model file not found: {model_path}")
@@ -517,9 +744,43 @@ def load_cql_model_from_checkpoint(checkpoint_path: str):
         traceback.print_exc()
         return None
 
+def load_onnx_runtime_models():
+    """Load the exported ONNX models for the slim runtime"""
+    global lstm_model, scaler_X, scaler_y, xgb_defect, xgb_quality, feature_scaler, feature_names, cql_models
+    global onnx_models_version
+    
+    logger.info(f"ONNX_DIR path: {ONNX_DIR}")
+    try:
+        models = load_onnx_models(ONNX_DIR, num_threads=INFERENCE_THREADS)
+    except Exception as e:
+        logger.error(f"Error loading ONNX models: {e}")
+        logger.warning("Server will start with limited functionality")
+        return
+    
+    lstm_model = models["lstm"]
+    scaler_X = models["scaler_X"]
+    scaler_y = models["scaler_y"]
+    xgb_defect = models["defect"]
+    xgb_quality = models["quality"]
+    # The feature scaler is fused into the classifier graphs
+    feature_scaler = models["feature_scaler"]
+    feature_names = models["feature_names"]
+    cql_models.update(models["policies"])
+    # onnx_export.py rewrites the manifest with every export
+    onnx_models_version = fingerprint([os.path.join(ONNX_DIR, ONNX_MANIFEST)])
+    
+    logger.info(f"Final model status (onnx) - LSTM: {lstm_model is not None}, Defect: {xgb_defect is not None}, Quality: {xgb_quality is not None}, RL models: {list(cql_models.keys())}")
+
 def load_models():
     """Load all trained models at startup"""
     global lstm_model, lstm_scalers, scaler_X, scaler_y, xgb_defect, xgb_quality, feature_scaler, feature_names, cql_models
+    global batch_feature_store
+    
+    batch_feature_store = load_feature_store()
+    
+    if PREDICTION_RUNTIME == 'onnx':
+        load_onnx_runtime_models()
+        return
     
     try:
         logger.info(f"MODEL_DIR path: {MODEL_DIR}")
@@ -545,9 +806,22 @@ def load_models():
             scaler_y = lstm_scalers['target']
             logger.info("LSTM scalers loaded successfully")
         
+        # Prefer a pre-converted quantized LSTM so the Keras model never has to be built
+        if LSTM_INFERENCE_MODE != 'float32':
+            quantized_path = quantized_model_path(MODEL_DIR, LSTM_INFERENCE_MODE)
+            if os.path.exists(quantized_path):
+                try:
+                    lstm_model = QuantizedLSTMForecaster.from_file(quantized_path, LSTM_INFERENCE_MODE,
+                                                                   num_threads=INFERENCE_THREADS)
+                    logger.info(f"Loaded {LSTM_INFERENCE_MODE} LSTM model from {quantized_path}")
+                except Exception as e:
+                    logger.warning(f"Could not load {LSTM_INFERENCE_MODE} LSTM model: {e}")
+        
         # Try to load LSTM model with fallback approach
         lstm_model_path = os.path.join(MODEL_DIR, 'lstm_sensor_forecasting_model.h5')
-        if not os.path.exists(lstm_model_path):
+        if lstm_model is not None:
+            logger.info("Quantized LSTM model in use, skipping Keras model load")
+        elif not os.path.exists(lstm_model_path):
             logger.error(f"LSTM model file not found: {lstm_model_path}")
         else:
             logger.info("Loading LSTM model...")
@@ -576,6 +850,15 @@ def load_models():
                         logger.info("LSTM model created from scratch")
                     else:
                         logger.error("Failed to create LSTM model")
+            
+            # Convert on first start in a quantized mode, the result is cached next to the .h5
+            if lstm_model is not None and LSTM_INFERENCE_MODE != 'float32':
+                try:
+                    lstm_model = load_quantized_lstm(lstm_model, LSTM_INFERENCE_MODE, model_dir=MODEL_DIR,
+                                                     num_threads=INFERENCE_THREADS)
+                    logger.info(f"LSTM model quantized to {LSTM_INFERENCE_MODE}")
+                except Exception as e:
+                    logger.warning(f"LSTM quantization to {LSTM_INFERENCE_MODE} failed, using float32: {e}")
         
         # Load classification models with exact filenames from training
         xgb_defect_path = os.path.join(MODEL_DIR, 'xgboost_defect_classifier.pkl')
@@ -592,7 +875,7 @@ def load_models():
             else:
                 logger.info(f"Loading defect classifier from: {xgb_defect_path}")
                 with open(xgb_defect_path, 'rb') as f:
-                    xgb_defect = pickle.load(f)
+                    xgb_defect = limit_model_threads(pickle.load(f), INFERENCE_THREADS)
                 logger.info("Defect classifier loaded successfully")
         except ModuleNotFoundError as e:
             logger.warning(f"XGBoost module not available: {e}")
@@ -606,7 +889,7 @@ def load_models():
             else:
                 logger.info(f"Loading quality classifier from: {xgb_quality_path}")
                 with open(xgb_quality_path, 'rb') as f:
-                    xgb_quality = pickle.load(f)
+                    xgb_quality = limit_model_threads(pickle.load(f), INFERENCE_THREADS)
                 logger.info("Quality classifier loaded successfully")
         except ModuleNotFoundError as e:
             logger.warning(f"XGBoost module not available: {e}")
@@ -647,6 +930,212 @@ def load_models():
         # Don't raise to allow server to start without all models
         logger.warning("Server will start with limited functionality")
 
+def lstm_artifact_paths(directory: str = MODEL_DIR) -> List[str]:
+    return [os.path.join(directory, 'lstm_sensor_forecasting_model.h5'), os.path.join(directory, 'lstm_scalers.pkl')]
+
+def classifier_artifact_paths(directory: str = MODEL_DIR) -> List[str]:
+    return [os.path.join(directory, name) for name in (
+        'xgboost_defect_classifier.pkl', 'xgboost_quality_class_classifier.pkl', 'feature_scaler.pkl', 'feature_names.txt')]
+
+def load_lstm_artifacts(paths: List[str]) -> Dict[str, Any]:
+    """Load a new LSTM version (model and scalers) in the background for the model registry"""
+    model_path, scaler_path = paths
+    with open(scaler_path, 'rb') as f:
+        scalers = pickle.load(f)
+    try:
+        model = tf.keras.models.load_model(model_path, compile=False)
+    except Exception as e:
+        logger.warning(f"Standard loading failed ({e}), rebuilding architecture from weights")
+        model = create_lstm_model_from_weights(model_path, require_weights=True)
+        if model is None:
+            raise ValueError(f"Could not load LSTM model from {model_path}")
+    
+    if LSTM_INFERENCE_MODE != 'float32':
+        # The cached .tflite belongs to the previous version, convert the new model and replace it
+        content = convert_lstm_model(model, LSTM_INFERENCE_MODE)
+        try:
+            with open(quantized_model_path(os.path.dirname(model_path), LSTM_INFERENCE_MODE), 'wb') as f:
+                f.write(content)
+        except OSError as e:
+            logger.warning(f"Could not cache {LSTM_INFERENCE_MODE} LSTM: {e}")
+        model = QuantizedLSTMForecaster(content, LSTM_INFERENCE_MODE, num_threads=INFERENCE_THREADS)
+    
+    return {"model": model, "scalers": scalers}
+
+def load_classifier_artifacts(paths: List[str]) -> Dict[str, Any]:
+    """Load the classifiers together with the feature scaler and feature names they were trained with"""
+    defect_path, quality_path, scaler_path, names_path = paths
+    artifacts = {}
+    for key, path in (('defect', defect_path), ('quality', quality_path), ('feature_scaler', scaler_path)):
+        with open(path, 'rb') as f:
+            artifacts[key] = pickle.load(f)
+    with open(names_path, 'r') as f:
+        artifacts['feature_names'] = [line.strip() for line in f]
+    for key in ('defect', 'quality'):
+        limit_model_threads(artifacts[key], INFERENCE_THREADS)
+    return artifacts
+
+def load_rl_artifacts(paths: List[str]) -> Dict[str, Any]:
+    cql_model = load_cql_model_from_checkpoint(paths[0])
+    if cql_model is None:
+        raise ValueError(f"Could not load RL checkpoint {paths[0]}")
+    return {"model": cql_model}
+
+def apply_lstm_version(version):
+    global lstm_model, lstm_scalers, scaler_X, scaler_y
+    lstm_model = version.artifacts['model']
+    lstm_scalers = version.artifacts['scalers']
+    scaler_X = lstm_scalers['feature']
+    scaler_y = lstm_scalers['target']
+
+def apply_classifier_version(version):
+    global xgb_defect, xgb_quality, feature_scaler, feature_names
+    xgb_defect = version.artifacts['defect']
+    xgb_quality = version.artifacts['quality']
+    feature_scaler = version.artifacts['feature_scaler']
+    feature_names = version.artifacts['feature_names']
+
+def predict_forecast_shadow(artifacts: Dict[str, Any], lstm_sequence: np.ndarray) -> np.ndarray:
+    scalers = artifacts['scalers']
+    sequence_scaled = scalers['feature'].transform(lstm_sequence)[np.newaxis, :, :]
+    return scalers['target'].inverse_transform(artifacts['model'].predict(sequence_scaled, verbose=0)[0])
+
+def compare_forecasts(live: np.ndarray, shadow: np.ndarray):
+    abs_diff = float(np.mean(np.abs(live - shadow)))
+    return abs_diff <= SHADOW_FORECAST_TOLERANCE * (float(np.mean(np.abs(live))) + 1e-9), abs_diff
+
+def predict_classifier_shadow(artifacts: Dict[str, Any], inputs) -> np.ndarray:
+    # inputs is (task, raw feature dict) so the candidate applies its own scaler and feature list
+    task, features = inputs
+    scaled = scale_classification_features(features, artifacts['feature_scaler'], artifacts['feature_names'])
+    return artifacts[task].predict_proba(scaled)[0]
+
+def compare_class_probabilities(live: np.ndarray, shadow: np.ndarray):
+    return int(np.argmax(live)) == int(np.argmax(shadow)), float(np.max(np.abs(live - shadow)))
+
+def predict_rl_shadow(artifacts: Dict[str, Any], state: np.ndarray) -> np.ndarray:
+    return np.asarray(artifacts['model'].predict(state), dtype=float).reshape(-1)[:3]
+
+def compare_actions(live: np.ndarray, shadow: np.ndarray):
+    # Agreement means every adjustment points the same way
+    return bool(np.all(np.sign(live) == np.sign(shadow))), float(np.mean(np.abs(live - shadow)))
+
+def product_artifact_paths(code: int) -> List[str]:
+    """Artifact files of a product's own model set (complete groups only), empty if it has none"""
+    directory = os.path.join(PRODUCT_MODEL_DIR, str(code))
+    if not os.path.isdir(directory):
+        return []
+    if PREDICTION_RUNTIME == 'onnx':
+        onnx_dir = os.path.join(directory, 'onnx')
+        return sorted(os.path.join(onnx_dir, f) for f in os.listdir(onnx_dir)) if os.path.isdir(onnx_dir) else []
+    paths = []
+    for group in (lstm_artifact_paths(directory), classifier_artifact_paths(directory)):
+        if all(os.path.exists(p) for p in group):
+            paths.extend(group)
+    return paths
+
+def load_product_models(code: int, paths: List[str]) -> Dict[str, Any]:
+    """Load a product's model set as {"lstm": {...}, "classifiers": {...}} (groups it doesn't have are absent)"""
+    directory = os.path.join(PRODUCT_MODEL_DIR, str(code))
+    artifacts = {}
+    if PREDICTION_RUNTIME == 'onnx':
+        models = load_onnx_models(os.path.join(directory, 'onnx'), num_threads=INFERENCE_THREADS)
+        if models["lstm"] is not None:
+            artifacts["lstm"] = {"model": models["lstm"], "scalers": {"feature": models["scaler_X"], "target": models["scaler_y"]}}
+        if models["defect"] is not None and models["quality"] is not None:
+            artifacts["classifiers"] = {key: models[key] for key in ('defect', 'quality', 'feature_scaler', 'feature_names')}
+        return artifacts
+    
+    lstm_paths, classifier_paths = lstm_artifact_paths(directory), classifier_artifact_paths(directory)
+    if all(p in paths for p in lstm_paths):
+        artifacts["lstm"] = load_lstm_artifacts(lstm_paths)
+    if all(p in paths for p in classifier_paths):
+        artifacts["classifiers"] = load_classifier_artifacts(classifier_paths)
+    return artifacts
+
+# Product-specific model sets, loaded when a product starts running
+product_model_pool = ModelPool(product_artifact_paths, load_product_models, max_entries=PRODUCT_MODEL_POOL_SIZE,
+                               max_bytes=int(PRODUCT_MODEL_POOL_MB * 2 ** 20))
+
+def get_product_models(load: bool = True):
+    """Model set of the running product from the pool, None when it uses the shared models"""
+    code = get_batch_context()["code"]
+    if code is None:
+        return None
+    return product_model_pool.get(code) if load else product_model_pool.peek(code)
+
+def active_lstm():
+    """(forecaster, feature scaler, target scaler, product set) for the running product; the shared,
+    hot-swappable forecaster unless the product has its own (product set is then not None)"""
+    product_set = get_product_models()
+    if product_set is not None and "lstm" in product_set.artifacts:
+        lstm = product_set.artifacts["lstm"]
+        return lstm["model"], lstm["scalers"]["feature"], lstm["scalers"]["target"], product_set
+    # Take the model and its scalers together so a hot swap can't mix versions
+    with model_registry.swap_lock:
+        return lstm_model, scaler_X, scaler_y, None
+
+def active_classifiers():
+    """(defect, quality, feature scaler, feature names, product set) for the running product"""
+    product_set = get_product_models()
+    if product_set is not None and "classifiers" in product_set.artifacts:
+        classifiers = product_set.artifacts["classifiers"]
+        return (classifiers["defect"], classifiers["quality"], classifiers["feature_scaler"],
+                classifiers["feature_names"], product_set)
+    with model_registry.swap_lock:
+        return xgb_defect, xgb_quality, feature_scaler, feature_names, None
+
+def model_signature(load: bool = True) -> str:
+    """Versions of the models serving the running product (shared live versions plus its own set)"""
+    product_set = get_product_models(load=load)
+    signature = model_registry.live_signature()
+    return signature if product_set is None else f"{signature}|{product_set.key}:{product_set.version}"
+
+def model_versions() -> Dict[str, str]:
+    """Version of every model that can serve a prediction, for the audit trail"""
+    versions = {"runtime": PREDICTION_RUNTIME, **model_registry.live_versions()}
+    if onnx_models_version is not None:
+        versions["onnx"] = onnx_models_version
+    product_set = get_product_models(load=False)
+    if product_set is not None:
+        versions[f"product:{product_set.key}"] = product_set.version
+    return versions
+
+def register_model_slots():
+    """Register the loaded native models with the registry so new versions can be hot-swapped"""
+    if PREDICTION_RUNTIME == 'onnx':
+        logger.info("Model registry disabled for the onnx runtime, re-run onnx_export.py and restart to update models")
+        return
+    
+    model_registry.register(
+        ModelSlot('lstm', MODEL_DIR, lstm_artifact_paths, load_lstm_artifacts, apply_lstm_version,
+                  predict=predict_forecast_shadow, compare=compare_forecasts),
+        artifacts={"model": lstm_model, "scalers": lstm_scalers} if lstm_model is not None and lstm_scalers else None
+    )
+    
+    classifiers_loaded = all(m is not None for m in (xgb_defect, xgb_quality, feature_scaler)) and feature_names
+    model_registry.register(
+        ModelSlot('classifiers', MODEL_DIR, classifier_artifact_paths, load_classifier_artifacts, apply_classifier_version,
+                  predict=predict_classifier_shadow, compare=compare_class_probabilities),
+        artifacts={"defect": xgb_defect, "quality": xgb_quality, "feature_scaler": feature_scaler,
+                   "feature_names": feature_names} if classifiers_loaded else None
+    )
+    
+    for model_name, config in RL_MODEL_CONFIG.items():
+        if config.get('file') is None:
+            continue
+        
+        def apply_rl_version(version, model_name=model_name):
+            cql_models[model_name] = version.artifacts['model']
+        
+        model_registry.register(
+            ModelSlot(f'rl:{model_name}', RL_DIR, lambda file=config['file']: [resolve_latest(RL_DIR, file)],
+                      load_rl_artifacts, apply_rl_version, predict=predict_rl_shadow, compare=compare_actions),
+            artifacts={"model": cql_models[model_name]} if model_name in cql_models else None
+        )
+    
+    logger.info(f"Model registry slots: {list(model_registry.slots.keys())}")
+
 def fetch_sensor_api_data(endpoint: str) -> Optional[Dict[str, Any]]:
     """Generic function to fetch data from sensor API endpoints"""
     try:
@@ -664,31 +1153,10 @@ def fetch_historical_sensor_data(count: int = 60) -> List[List[float]]:
         # Try to get latest data points
         data = fetch_sensor_api_data(f"/api/latest/{count}")
         if data and data.get('status') == 'success':
-            historical_data = []
-            sensor_records = data.get('data', [])
-            
-            for record in sensor_records:
-                values = []
-                for sensor in selected_sensors:
-                    api_key = sensor_mapping.get(sensor, sensor)
-                    value = record.get(api_key)
-                    
-                    # Handle None values with defaults
-                    if value is None:
-                        default_values = {
-                            'waste': 0.0,
-                            'produced': 0.0,
-                            'ejection': 120.0,
-                            'tbl_speed': 100.0,
-                            'stiffness': 100.0,
-                            'SREL': 3.5,
-                            'main_comp': 15.0
-                        }
-                        value = default_values.get(sensor, 0.0)
-                    
-                    values.append(float(value))
-                
-                historical_data.append(values)
+            values, missing = sensor_decoder.decode(data.get('data', []))
+            historical_data = values.tolist()
+            if missing.any():
+                logger.warning(f"Using default values for {int(missing.sum())} missing historical sensor values")
             
             logger.info(f"Fetched {len(historical_data)} historical data points")
             return historical_data
@@ -703,30 +1171,10 @@ def fetch_all_sensor_data() -> Optional[List[List[float]]]:
     try:
         data = fetch_sensor_api_data("/api/all")
         if data and data.get('status') == 'success':
-            all_data = []
-            sensor_records = data.get('data', [])
-            
-            for record in sensor_records:
-                values = []
-                for sensor in selected_sensors:
-                    api_key = sensor_mapping.get(sensor, sensor)
-                    value = record.get(api_key)
-                    
-                    if value is None:
-                        default_values = {
-                            'waste': 0.0,
-                            'produced': 0.0,
-                            'ejection': 120.0,
-                            'tbl_speed': 100.0,
-                            'stiffness': 100.0,
-                            'SREL': 3.5,
-                            'main_comp': 15.0
-                        }
-                        value = default_values.get(sensor, 0.0)
-                    
-                    values.append(float(value))
-                
-                all_data.append(values)
+            values, missing = sensor_decoder.decode(data.get('data', []))
+            all_data = values.tolist()
+            if missing.any():
+                logger.warning(f"Using default values for {int(missing.sum())} missing sensor values")
             
             logger.info(f"Fetched {len(all_data)} total data points")
             return all_data
@@ -765,99 +1213,295 @@ def get_api_status() -> Dict[str, Any]:
         logger.error(f"Error fetching API status: {e}")
         return {"status": "error", "message": str(e)}
 
-def supplement_buffer_with_historical_data():
-    """Supplement sensor buffer with historical data when insufficient"""
-    if len(sensor_buffer) >= 60:
-        return  # Buffer is already full
-    
-    needed_points = 60 - len(sensor_buffer)
-    logger.info(f"Buffer has {len(sensor_buffer)} points, need {needed_points} more")
-    
-    # Try to get historical data
-    historical_data = fetch_historical_sensor_data(needed_points)
-    
+def missing_buffer_points() -> int:
+    """Points the buffer lacks to a full window"""
+    if SENSOR_STATE_MODE == 'worker':
+        # Only the ingester writes the shared buffers; it supplements them when it starts
+        raise HTTPException(status_code=503, detail=f"Sensor buffer is warming up in the ingester ({len(sensor_buffer)}/60 points)",
+                            headers={"Retry-After": "10"})
+    needed_points = max(0, 60 - len(sensor_buffer))
+    if needed_points:
+        logger.info(f"Buffer has {len(sensor_buffer)} points, need {needed_points} more")
+    return needed_points
+
+def apply_historical_data(historical_data: List[List[float]]):
+    """Prepend fetched historical points to the buffer (on the event loop, like every buffer update)"""
     if historical_data:
         # Add historical data to buffer (older data first)
         for data_point in reversed(historical_data):
             if len(sensor_buffer) < 60:
                 sensor_buffer.appendleft(data_point)
+        mark_buffer_updated()
         
         logger.info(f"Supplemented buffer with {len(historical_data)} historical points. Buffer size: {len(sensor_buffer)}")
     else:
         logger.warning("Could not fetch historical data to supplement buffer")
 
-def fetch_current_sensor_data():
-    """Fetch current sensor data from the API with enhanced preprocessing"""
+def supplement_buffer_with_historical_data():
+    """Supplement sensor buffer with historical data when insufficient (blocking, for callers without a running loop)"""
+    needed_points = missing_buffer_points()
+    if needed_points:
+        apply_historical_data(fetch_historical_sensor_data(needed_points))
+
+async def fill_sensor_buffer(min_points: int, purpose: str) -> int:
+    """Supplement the buffer with historical data, falling back to all available data; returns the buffer size.
+    
+    Only the HTTP requests run in threads: the rows are applied here on the event loop, where
+    ingestion updates the buffers, never while a pipeline or inference thread iterates them.
+    """
+    needed_points = missing_buffer_points()
+    if needed_points:
+        apply_historical_data(await asyncio.to_thread(fetch_historical_sensor_data, needed_points))
+    
+    # Check again after supplementation
+    if len(sensor_buffer) < min_points:
+        # Try to get all available data as last resort
+        all_data = await asyncio.to_thread(fetch_all_sensor_data)
+        if all_data and len(all_data) >= min_points and len(sensor_buffer) < min_points:
+            # Use the most recent data points
+            for data_point in all_data[-min(60, len(all_data)):]:
+                sensor_buffer.append(data_point)
+            mark_buffer_updated()
+            logger.info(f"Used all available data to supplement buffer for {purpose}. Buffer size: {len(sensor_buffer)}")
+    return len(sensor_buffer)
+
+async def ensure_sensor_data(min_points: int, purpose: str) -> bool:
+    """Make sure the buffer holds `min_points`, supplementing it once for all concurrent requests"""
+    if len(sensor_buffer) >= min_points:
+        return True
+    logger.info(f"Insufficient data for {purpose}. Need {min_points} points, have {len(sensor_buffer)}. Attempting to supplement...")
+    await request_coalescer.run(('supplement', min_points, get_buffer_version()), fill_sensor_buffer, min_points, purpose)
+    return len(sensor_buffer) >= min_points
+
+def ingest_sensor_payload(data: Optional[Dict[str, Any]]):
+    """Add a /api/current response to the buffers, returns (poll outcome, whether the model inputs changed).
+
+    The inputs are the buffer rows, the batch context (feature-store lookup) and the batch-lifetime
+    features; a change bumps the buffer version, which keys the ETags and coalesced requests, and the
+    caller republishes the pipeline results (and, as the ingester, the shared state workers read the
+    version from).
+    """
+    if not data or data.get('status') != 'success':
+        return FAILED, False
+    sensor_data = data['data']
+    
+    # Extract sensor values according to mapping, defaults for the missing ones
+    values, missing = sensor_decoder.decode_record(sensor_data)
+    for sensor in missing:
+        logger.warning(f"Using default value {default_sensor_values.get(sensor, 0.0)} for missing sensor {sensor}")
+    
+    # The source repeats its latest row until it writes a new one: skip those before any processing
+    source_time = parse_source_timestamp(sensor_data.get('timestamp'))
+    if source_time is not None and source_time == last_source_reading["time"]:
+        return DUPLICATE, False
+    outcome = UNCHANGED if values == last_source_reading["values"] else UPDATED
+    last_source_reading.update(time=source_time, values=values)
+    
+    # The simulator streams the per-batch time series, which carry the batch and product code
+    context_changed = update_batch_context(sensor_data.get('batch'), sensor_data.get('code'))
+    # Every source row counts towards the batch features, whether or not it completes a cadence slot, so
+    # an accumulated reading changes the classifier inputs even without new buffer rows
+    features_changed = batch_feature_tracker.update(parse_reading(sensor_data), parse_batch_id(sensor_data.get('batch')),
+                                 parse_batch_id(sensor_data.get('campaign')), parse_batch_id(sensor_data.get('code')))
+    
+    # Resample onto the training cadence by source timestamp (reading time if it has none)
+    if source_time is None:
+        source_time = parse_source_timestamp(data.get('timestamp')) or time.time()
+    log_sensor_reading(source_time, sensor_data)
+    rows = sensor_resampler.add(source_time, values)
+    if not rows:
+        logger.info("Sensor reading did not complete a new cadence slot (late or between slots)")
+        if context_changed or features_changed:
+            mark_buffer_updated()
+        return outcome, context_changed or features_changed
+    
+    for row_time, row in rows:
+        history_pyramid.add(row_time, row)
+    for _, row in rows[-sensor_buffer.maxlen:]:
+        append_sensor_row(row)
+    mark_buffer_updated()
+    
+    logger.info(f"Fetched sensor data: {dict(zip(selected_sensors, values))} ({len(rows)} resampled rows)")
+    return outcome, True
+
+def fetch_current_sensor_data() -> str:
+    """Poll the sensor API once, ingest the reading and publish the pipeline results; returns the poll outcome"""
     try:
-        data = fetch_sensor_api_data('/api/current')
-        if data and data['status'] == 'success':
-            sensor_data = data['data']
-            
-            # Extract sensor values according to mapping
-            values = []
-            for sensor in selected_sensors:
-                api_key = sensor_mapping.get(sensor, sensor)
-                value = sensor_data.get(api_key)
-                
-                # Handle None values and convert to float
-                if value is None:
-                    value = default_sensor_values.get(sensor, 0.0)
-                    logger.warning(f"Using default value {value} for missing sensor {sensor}")
-                
-                values.append(float(value))
-            
-            # Add to raw buffer
-            sensor_buffer.append(values)
-            
-            # Preprocess the data and add to processed buffer
-            if len(sensor_buffer) >= 3:  # Need at least 3 points for smoothing
-                # Get recent data for preprocessing
-                recent_data = list(sensor_buffer)[-min(10, len(sensor_buffer)):]
-                processed_data = preprocess_sensor_data(recent_data)
-                
-                if len(processed_data) > 0:
-                    # Add the most recent processed point
-                    processed_buffer.append(processed_data[-1].tolist())
-            else:
-                # For initial data points, add directly
-                processed_buffer.append(values)
-            
-            logger.info(f"Fetched sensor data: {dict(zip(selected_sensors, values))}")
-            return True
-            
+        outcome, changed = ingest_sensor_payload(fetch_sensor_api_data('/api/current'))
+        if changed:
+            # Run the models once for this tick and push the results to stream clients
+            publish_pipeline_snapshot()
+        return outcome
     except Exception as e:
         logger.error(f"Error fetching sensor data: {e}")
+        return FAILED
+
+async def sensor_ingestion_loop():
+    """Poll the sensor API on the event loop at the adaptive interval until cancelled.
+    
+    Only the HTTP request and the model pipeline run in threads; the buffers are updated here,
+    between handler steps, so requests never see a half-applied reading.
+    """
+    logger.info(f"Sensor ingestion started (base interval {SENSOR_POLL_INTERVAL}s)")
+    while True:
+        start = time.monotonic()
+        try:
+            data = await asyncio.to_thread(fetch_sensor_api_data, '/api/current')
+            outcome, changed = ingest_sensor_payload(data)
+            if changed:
+                await asyncio.to_thread(publish_pipeline_snapshot)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error fetching sensor data: {e}")
+            outcome = FAILED
+        
+        delay = sensor_poller.next_delay(outcome)
+        if outcome == FAILED and sensor_poller.consecutive_failures > 1:
+            logger.warning(f"Sensor API unavailable ({sensor_poller.consecutive_failures} failed polls), retrying in {delay:.1f}s")
+        await asyncio.sleep(max(0.0, delay - (time.monotonic() - start)))
+
+def append_sensor_row(values: List[float]):
+    """Add one resampled row to the raw and processed buffers and the anomaly detectors"""
+    # Add to raw buffer
+    sensor_buffer.append(values)
+    sensor_monitor.update(values, skip=detect_downtime(values))
+    
+    # Spikes are replaced before smoothing; the raw buffer and the detectors keep the raw values
+    filtered = robust_filter.update(values) if robust_filter is not None else values
+    filtered_rows.append(filtered)
+    
+    # Preprocess the data and add to processed buffer
+    if len(filtered_rows) >= 3:  # Need at least 3 points for smoothing
+        processed_data = preprocess_sensor_data(list(filtered_rows))
+        
+        if len(processed_data) > 0:
+            # Add the most recent processed point
+            processed_buffer.append(processed_data[-1].tolist())
+    else:
+        # For initial data points, add directly
+        processed_buffer.append(filtered)
+
+def parse_batch_id(value) -> Optional[int]:
+    """Batch / product id from the sensor API, None if missing or not a number"""
+    try:
+        return int(float(value)) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+def update_batch_context(batch, code) -> bool:
+    """Remember which batch the incoming points belong to, returns whether the context changed"""
+    batch, code = parse_batch_id(batch), parse_batch_id(code)
+    if batch is None and code is None:
+        return False
+    if batch == current_batch_context["batch"] and code == current_batch_context["code"]:
         return False
+    logger.info(f"Sensor data now from batch {batch} (product code {code})")
+    if current_batch_context["batch"] is not None:
+        sensor_monitor.reset(reason=f"batch {batch} started")
+        if robust_filter is not None:
+            robust_filter.reset()
+    current_batch_context.update(batch=batch, code=code)
+    return True
+
+def mark_buffer_updated():
+    """Record that the local buffers changed"""
+    global buffer_version
+    buffer_version = next(_buffer_versions)
+
+def get_buffer_version() -> int:
+    """Version of the buffered data (the ingester's last write in worker mode)"""
+    if SENSOR_STATE_MODE == 'worker':
+        state = shared_state_client.get()
+        return state.write_version() if state is not None else 0
+    return buffer_version
+
+def get_response_etag(request: Request) -> str:
+    """ETag of a conditional GET route for the current buffer and model versions"""
+    version = get_buffer_version() if SENSOR_STATE_MODE == 'worker' else f"{BUFFER_EPOCH}-{buffer_version}"
+    # Runs on the event loop: only looks at product sets already in the pool, never loads one
+    return make_etag(request.url.path, request.url.query, version, model_signature(load=False),
+                     PREDICTION_RUNTIME, LSTM_INFERENCE_MODE)
+
+def get_window_quality() -> Optional[Dict[str, Any]]:
+    """How much of the 60-step window is interpolated and whether it is too sparse to trust"""
+    if SENSOR_STATE_MODE == 'worker':
+        return (latest_pipeline_snapshot or {}).get("window_quality")
+    return sensor_resampler.window_quality(sensor_buffer.maxlen)
+
+def get_batch_context() -> Dict[str, Optional[int]]:
+    """Batch and product code of the buffered data (read from the ingester in worker mode)"""
+    if SENSOR_STATE_MODE == 'worker':
+        state = shared_state_client.get()
+        return state.batch_context() if state is not None else {"batch": None, "code": None}
+    return dict(current_batch_context)
+
+def compute_advanced_features_batch(windows: np.ndarray) -> pd.DataFrame:
+    """compute_advanced_features for a stack of (n, steps, sensors) windows, one row per window"""
+    column = {sensor: windows[:, :, i] for i, sensor in enumerate(selected_sensors)}
+    startup = slice(0, min(10, windows.shape[1]))
+    produced_total = column['produced'].sum(axis=1)
+    waste_total = column['waste'].sum(axis=1)
+    
+    features = pd.DataFrame({
+        'tbl_speed_mean': column['tbl_speed'].mean(axis=1),
+        'tbl_speed_change': np.ptp(column['tbl_speed'], axis=1),
+        'total_waste': waste_total,
+        'startup_waste': column['waste'][:, startup].sum(axis=1),
+        'fom_mean': produced_total / (produced_total + waste_total + 1e-6) * 50,
+        'fom_change': np.abs(np.ptp(column['produced'], axis=1)) * 0.1,
+        'SREL_startup_mean': column['SREL'][:, startup].mean(axis=1),
+        'SREL_production_mean': column['SREL'].mean(axis=1),
+        'main_CompForce mean': column['main_comp'].mean(axis=1),
+        'main_CompForce_sd': column['main_comp'].std(axis=1, ddof=1),
+        'pre_CompForce_mean': column['main_comp'].mean(axis=1) * 0.1,
+        'tbl_fill_mean': column['produced'].mean(axis=1) / 1000,
+        'tbl_fill_sd': column['produced'].std(axis=1, ddof=1) / 1000,
+        'stiffness_mean': column['stiffness'].mean(axis=1),
+        'ejection_mean': column['ejection'].mean(axis=1)
+    })
+    for name, value in batch_feature_store.features(**get_batch_context()).items():
+        features[name] = value
+    return features
+
+def get_batch_lifetime_state() -> Optional[Dict[str, Any]]:
+    """Running batch with its accumulated features (from the ingester's snapshot in worker mode)"""
+    if SENSOR_STATE_MODE == 'worker':
+        return (latest_pipeline_snapshot or {}).get("batch_lifetime")
+    return batch_feature_tracker.state()
 
-def compute_classification_features(buffer_data):
-    """Compute features for classification models using advanced feature engineering"""
+def get_batch_lifetime_features() -> Dict[str, float]:
+    """Accumulated features of the running batch, empty until it has enough production readings"""
+    state = get_batch_lifetime_state()
+    return state["features"] if state is not None and state["ready"] else {}
+
+def compute_raw_classification_features(buffer_data) -> Optional[Dict[str, float]]:
+    """Unscaled engineered features for the classification models"""
     if not buffer_data or len(buffer_data) < 5:
         return None
     
     try:
         # Use the advanced feature computation from training pipeline
         features = compute_advanced_features(list(buffer_data))
-        
-        if features is None:
-            return None
-        
-        # Ensure all required features are present
-        for feature_name in feature_names:
-            if feature_name not in features:
-                features[feature_name] = 0.0
-        
-        # Create DataFrame with features in the correct order
-        feature_df = pd.DataFrame([features])
-        feature_df = feature_df.reindex(columns=feature_names, fill_value=0.0)
-        
-        # Scale features using the trained scaler
-        scaled_features = feature_scaler.transform(feature_df)
-        return scaled_features
-        
+        if features is not None:
+            # Whole-batch process features replace the window approximations once the batch is in production
+            features.update(get_batch_lifetime_features())
+        return features
     except Exception as e:
         logger.error(f"Error computing classification features: {e}")
         return None
 
+def scale_classification_features(features: Dict[str, float], scaler, names: List[str]):
+    """Order the features like the training data and scale them with the trained scaler"""
+    try:
+        # Missing features are filled with 0 in the correct column order
+        feature_df = pd.DataFrame([features])
+        feature_df = feature_df.reindex(columns=names, fill_value=0.0)
+        return scaler.transform(feature_df)
+    except Exception as e:
+        logger.error(f"Error scaling classification features: {e}")
+        return None
+
 def get_rl_state(buffer_data):
     """Compute state vector for RL models"""
     if not buffer_data:
@@ -876,73 +1520,744 @@ def get_rl_state(buffer_data):
         logger.error(f"Error computing RL state: {e}")
         return np.zeros(len(selected_sensors))
 
-@asynccontextmanager
-async def lifespan(app: FastAPI):
-    """Manage application lifespan"""
-    # Startup
-    logger.info("Starting up Prediction API...")
-    load_models()
+def format_forecast(prediction: np.ndarray) -> List[Dict[str, Any]]:
+    """Format an inverse-scaled forecast matrix as per-timestep sensor dictionaries"""
+    forecast_data = []
+    for i, timestep_pred in enumerate(prediction):
+        forecast_point = {
+            "timestep": i + 1,
+            "sensors": dict(zip(selected_sensors, timestep_pred.tolist()))
+        }
+        forecast_data.append(forecast_point)
+    return forecast_data
+
+def prepare_forecast_window():
+    """The unscaled 60-step LSTM input from the current buffer, returns (sequence, preprocessing_applied)"""
+    # Use processed buffer for better quality predictions
+    data_source = processed_buffer if len(processed_buffer) >= 60 else sensor_buffer
     
-    # Start periodic data fetching
-    scheduler.add_job(
-        fetch_current_sensor_data,
-        'interval',
-        seconds=10,
-        id='fetch_sensor_data'
-    )
-    scheduler.start()
-    logger.info("Prediction API server started and data fetching scheduled")
+    # Prepare sequence data with enhanced preprocessing
+    raw_sequence = np.array(list(data_source))
     
-    yield
+    # Apply additional preprocessing if using raw sensor_buffer
+    if data_source is sensor_buffer:
+        processed_sequence = preprocess_sensor_data(list(data_source))
+        if len(processed_sequence) > 0:
+            raw_sequence = processed_sequence
     
-    # Shutdown
-    logger.info("Shutting down Prediction API...")
-    scheduler.shutdown()
+    # Create LSTM sequence
+    return create_lstm_sequences(raw_sequence, sequence_length=60), data_source is processed_buffer
 
-# Create FastAPI app with enhanced CORS and lifespan
-app = FastAPI(
-    title="Pharmaceutical Manufacturing Prediction API",
-    description="AI-powered predictions for pharmaceutical manufacturing processes",
-    version="1.0.0",
-    lifespan=lifespan
-)
+def run_forecast_model():
+    """Run the LSTM forecaster on the current buffer, returns (prediction, preprocessing_applied)"""
+    lstm_sequence, preprocessing_applied = prepare_forecast_window()
+    model, feature_scaler_X, target_scaler_y, product_set = active_lstm()
+    
+    # Scale the sequence
+    sequence_scaled = feature_scaler_X.transform(lstm_sequence)
+    sequence_scaled = sequence_scaled[np.newaxis, :, :]
+    
+    # Make prediction
+    start = time.perf_counter()
+    prediction_scaled = model.predict(sequence_scaled, verbose=0)[0]
+    prediction = target_scaler_y.inverse_transform(prediction_scaled)
+    if product_set is None:
+        # Shadow candidates are versions of the shared models
+        model_registry.submit_shadow('lstm', lstm_sequence, prediction, (time.perf_counter() - start) * 1000)
+    
+    return prediction, preprocessing_applied
 
-# Enhanced CORS configuration
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=[
-        "http://localhost:3000",  # React dev server
-        "http://localhost:3001",  # Express proxy server
-        "http://127.0.0.1:3000",
-        "http://127.0.0.1:3001",
-        "http://0.0.0.0:3000",
-        "http://0.0.0.0:3001"
-    ],
-    allow_credentials=True,
-    allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
-    allow_headers=["*"],
-)
+def run_forecast_uncertainty(passes: int, interval: float) -> Dict[str, Any]:
+    """MC dropout intervals for the current window, computed once per buffer version"""
+    key = (get_buffer_version(), model_signature(), passes, interval)
+    cached = forecast_uncertainty_cache.get(key)
+    if cached is not None:
+        return cached
+    
+    model, feature_scaler_X, target_scaler_y, _ = active_lstm()
+    if not supports_mc_dropout(model):
+        return {"available": False, "method": "mc_dropout",
+                "reason": f"The {PREDICTION_RUNTIME}/{LSTM_INFERENCE_MODE} forecaster has no dropout layers at inference time"}
+    
+    lstm_sequence, _ = prepare_forecast_window()
+    start = time.perf_counter()
+    samples = mc_dropout_samples(model, feature_scaler_X.transform(lstm_sequence), target_scaler_y, passes)
+    result = summarize_samples(samples, selected_sensors, interval)
+    result["compute_ms"] = round((time.perf_counter() - start) * 1000, 2)
+    
+    # Only the current version is worth keeping
+    for stale in [k for k in forecast_uncertainty_cache if k[:2] != key[:2]]:
+        forecast_uncertainty_cache.pop(stale, None)
+    forecast_uncertainty_cache[key] = result
+    return result
 
-# Request logging middleware
-@app.middleware("http")
-async def log_requests(request, call_next):
-    start_time = datetime.now()
-    logger.info(f"Request: {request.method} {request.url}")
+def run_defect_model() -> Optional[Dict[str, Any]]:
+    """Run the defect classifier on the current buffer, returns None when data is insufficient"""
+    # Use processed buffer for better quality predictions
+    data_source = processed_buffer if len(processed_buffer) >= 5 else sensor_buffer
     
-    response = await call_next(request)
+    classifier, _, scaler, names, product_set = active_classifiers()
     
-    process_time = (datetime.now() - start_time).total_seconds()
-    logger.info(f"Response: {response.status_code} - {process_time:.3f}s")
+    raw_features = compute_raw_classification_features(data_source)
+    features = scale_classification_features(raw_features, scaler, names) if raw_features is not None else None
+    if features is None:
+        return None
     
-    return response
+    start = time.perf_counter()
+    probabilities = classifier.predict_proba(features)
+    if product_set is None:
+        model_registry.submit_shadow('classifiers', ('defect', raw_features), probabilities[0],
+                                     (time.perf_counter() - start) * 1000)
+    raw_defect_probability = float(probabilities[0, 1])  # Probability of defect class
+    
+    # Apply confidence boosting for pharmaceutical manufacturing standards
+    # Higher confidence in low-defect predictions (pharmaceutical bias toward quality)
+    if raw_defect_probability < 0.3:  # Low defect risk
+        confidence_boost = 0.1
+    elif raw_defect_probability < 0.7:  # Medium defect risk  
+        confidence_boost = 0.05
+    else:  # High defect risk
+        confidence_boost = 0.02
+        
+    # Apply data quality boost
+    data_quality_boost = 0.08 if data_source is processed_buffer else 0.03
+    
+    # Enhanced defect probability with pharmaceutical manufacturing confidence
+    enhanced_probability = raw_defect_probability
+    
+    return {
+        "defect_probability": enhanced_probability,
+        "confidence": min(0.95, max(0.75, float(probabilities.max()) + confidence_boost + data_quality_boost)),
+        "risk_level": "high" if enhanced_probability > 0.7 else "medium" if enhanced_probability > 0.3 else "low",
+        "preprocessing_applied": data_source is processed_buffer
+    }
 
-@app.get("/")
-async def root():
-    """Enhanced API status endpoint"""
+def run_quality_model() -> Optional[Dict[str, Any]]:
+    """Run the quality classifier on the current buffer, returns None when data is insufficient"""
+    # Use processed buffer for better quality predictions
+    data_source = processed_buffer if len(processed_buffer) >= 5 else sensor_buffer
+    
+    _, classifier, scaler, names, product_set = active_classifiers()
+    
+    raw_features = compute_raw_classification_features(data_source)
+    features = scale_classification_features(raw_features, scaler, names) if raw_features is not None else None
+    if features is None:
+        return None
+    
+    start = time.perf_counter()
+    prediction = classifier.predict(features)[0]
+    probabilities = classifier.predict_proba(features)[0]
+    if product_set is None:
+        model_registry.submit_shadow('classifiers', ('quality', raw_features), probabilities,
+                                     (time.perf_counter() - start) * 1000)
+    
+    quality_classes = ['High', 'Low', 'Medium']
+    predicted_class = quality_classes[prediction]
+    
+    class_probabilities = dict(zip(quality_classes, probabilities.tolist()))
+    
+    # Enhanced confidence calculation for better user experience
+    raw_confidence = float(probabilities[prediction])
+    
+    # Apply confidence boosting for pharmaceutical standards
+    # Boost confidence based on data quality and consistency
+    data_quality_boost = 0.15 if data_source is processed_buffer else 0.05
+    
+    # Boost confidence for High quality predictions (pharmaceutical bias)
+    quality_boost = 0.1 if predicted_class == 'High' else 0.05
+    
+    # Calculate enhanced confidence
+    enhanced_confidence = min(0.95, raw_confidence + data_quality_boost + quality_boost)
+    
+    # Ensure minimum confidence threshold for pharmaceutical applications
+    final_confidence = max(0.75, enhanced_confidence)
+    
     return {
-        "message": "Pharmaceutical Manufacturing Prediction API",
-        "version": "1.0.0",
-        "status": "running",
+        "quality_class": predicted_class,
+        "confidence": final_confidence,
+        "raw_confidence": raw_confidence,  # Keep original for debugging
+        "class_probabilities": class_probabilities,
+        "preprocessing_applied": data_source is processed_buffer
+    }
+
+def run_rl_model(model_type: str) -> Dict[str, Any]:
+    """Get an action recommendation from a loaded RL model for the current buffer"""
+    data_source = processed_buffer if len(processed_buffer) > 0 else sensor_buffer
+    logger.info(f"Using data source with {len(data_source)} points")
+    
+    state = get_rl_state(data_source)
+    logger.info(f"State shape: {state.shape}")
+    state = state.reshape(1, -1)  # Shape for prediction
+    logger.info(f"Reshaped state shape: {state.shape}")
+    
+    cql_model = cql_models[model_type]
+    logger.info(f"Model type: {type(cql_model)}")
+    
+    # Try multiple prediction methods for compatibility
+    start = time.perf_counter()
+    action = None
+    prediction_methods = [
+        # Method 1: Standard predict method
+        lambda: cql_model.predict(state)[0],
+        # Method 2: Predict without indexing
+        lambda: cql_model.predict(state),
+        # Method 3: Predict with numpy array
+        lambda: cql_model.predict(np.array(state)),
+        # Method 4: Predict with torch tensor
+        lambda: cql_model.predict(torch.tensor(state, dtype=torch.float32)),
+        # Method 5: Use policy method if available
+        lambda: cql_model.policy(state)[0] if hasattr(cql_model, 'policy') else cql_model.predict(state)[0],
+        # Method 6: Use sample_action method if available
+        lambda: cql_model.sample_action(state)[0] if hasattr(cql_model, 'sample_action') else cql_model.predict(state)[0]
+    ]
+    
+    for i, method in enumerate(prediction_methods):
+        try:
+            action = method()
+            logger.info(f"Successfully predicted action using method {i+1}")
+            break
+        except Exception as e:
+            logger.warning(f"Prediction method {i+1} failed: {e}")
+            continue
+    
+    if action is None:
+        logger.error("All prediction methods failed, using fallback")
+        # Use fallback random action
+        action = np.random.uniform(-1, 1, 3)
+    
+    # Handle different action formats
+    try:
+        logger.info(f"Action type: {type(action)}; value: {action}")
+        # Convert to numpy array if possible
+        if hasattr(action, 'detach'):
+            action = action.detach().cpu().numpy()
+        elif hasattr(action, 'cpu'):
+            action = action.cpu().numpy()
+        elif hasattr(action, 'numpy'):
+            action = action.numpy()
+        elif isinstance(action, (list, tuple)):
+            action = np.array(action)
+        # If it's a scalar or 0-d array, wrap in array
+        if np.isscalar(action) or (hasattr(action, 'shape') and action.shape == ()): 
+            action = np.array([action])
+        logger.info(f"Processed action shape: {getattr(action, 'shape', 'no shape')}")
+    except Exception as e:
+        logger.error(f"Error processing action format: {e}")
+        action = np.zeros(3)
+    
+    model_registry.submit_shadow(f'rl:{model_type}', state, np.asarray(action, dtype=float).reshape(-1)[:3],
+                                 (time.perf_counter() - start) * 1000)
+
+    # Now safely extract values
+    try:
+        action_size = action.shape[0] if hasattr(action, 'shape') and len(action.shape) > 0 else 1
+        speed_val = float(action[0]) if action_size > 0 else 0.0
+        compression_val = float(action[1]) if action_size > 1 else 0.0
+        fill_val = float(action[2]) if action_size > 2 else 0.0
+        action_dict = {
+            "speed_adjustment": speed_val,
+            "compression_adjustment": compression_val,
+            "fill_adjustment": fill_val
+        }
+    except Exception as e:
+        logger.error(f"Error processing action: {e}")
+        action_dict = {
+            "speed_adjustment": 0.0,
+            "compression_adjustment": 0.0,
+            "fill_adjustment": 0.0
+        }
+    
+    # Determine if this is a mock model
+    is_mock_model = model_type == 'mock'
+    model_description = RL_MODEL_CONFIG.get(model_type, {}).get('description', 'Mock model for testing')
+    
+    return {
+        "model_type": model_type,
+        "model_description": model_description,
+        "is_mock_model": is_mock_model,
+        "recommended_actions": action_dict,
+        "state_summary": dict(zip(selected_sensors, state[0].tolist())),
+        "preprocessing_applied": data_source is processed_buffer
+    }
+
+def run_what_if(adjustments: np.ndarray, rl_models: List[str]) -> Optional[Dict[str, Any]]:
+    """Score relative speed/compression/fill adjustments of the current window (plus the current
+    recommendation of each model in `rl_models`) with both classifiers in one batch each"""
+    data_source = processed_buffer if len(processed_buffer) >= 5 else sensor_buffer
+    defect_classifier, quality_classifier, scaler, names, _ = active_classifiers()
+    
+    raw_features = compute_raw_classification_features(data_source)
+    if raw_features is None:
+        return None
+    
+    recommendations = {}
+    for model_type in rl_models:
+        actions = run_rl_model(model_type)["recommended_actions"]
+        recommendations[model_type] = [actions[name] * WHAT_IF_RL_ACTION_SCALE for name in ADJUSTMENTS]
+    if recommendations:
+        adjustments = np.vstack([adjustments, np.asarray(list(recommendations.values()))])
+    
+    start = time.perf_counter()
+    scores = score_scenarios(raw_features, adjustments, names, scaler, defect_classifier, quality_classifier)
+    return {"adjustments": adjustments, "scores": scores, "rl_models": list(recommendations),
+            "scoring_ms": round((time.perf_counter() - start) * 1000, 2)}
+
+def build_rollout_engine(steps_per_action: int = 10, seed: Optional[int] = None) -> Optional[RolloutEngine]:
+    """Rollout engine over the live forecaster and classifiers, None without a forecaster"""
+    model, feature_scaler_X, target_scaler_y, _ = active_lstm()
+    defect_classifier, quality_classifier, scaler, names, _ = active_classifiers()
+    if model is None or feature_scaler_X is None:
+        return None
+    
+    score_fn = None
+    if scaler is not None and (defect_classifier is not None or quality_classifier is not None):
+        def score_fn(windows: np.ndarray) -> Dict[str, np.ndarray]:
+            matrix = compute_advanced_features_batch(windows).reindex(columns=names, fill_value=0.0).to_numpy(dtype=np.float64)
+            return score_feature_matrix(matrix, names, scaler, defect_classifier, quality_classifier)
+    
+    return RolloutEngine(model, feature_scaler_X, target_scaler_y, selected_sensors, score_fn=score_fn,
+                         steps_per_action=steps_per_action, action_scale=WHAT_IF_RL_ACTION_SCALE,
+                         process_noise=ROLLOUT_PROCESS_NOISE, seed=seed)
+
+def rollout_policy(model_type: str) -> Dict[str, Any]:
+    """Batched greedy policy of a loaded RL model (see policy_rollout.network_policy): the exported ONNX
+    network, or the network rebuilt from the checkpoint's policy weights, built once per loaded model"""
+    model = cql_models[model_type]
+    cached = rollout_policy_cache.get(model_type)
+    if cached is not None and cached[0] is model:
+        return cached[1]
+    loaded = build_rollout_policy(model_type, model)
+    rollout_policy_cache[model_type] = (model, loaded)
+    return loaded
+
+def build_rollout_policy(model_type: str, model) -> Dict[str, Any]:
+    state_dim = len(selected_sensors)
+    if PREDICTION_RUNTIME == 'onnx':
+        return network_policy(model.predict, model.state_dim or state_dim, state_dim)
+    checkpoint = getattr(model, 'checkpoint', None)
+    if not isinstance(checkpoint, dict) or 'policy' not in checkpoint:
+        raise ValueError(f"{model_type} has no policy network to roll out")
+    from onnx_export import build_policy_network
+    network = build_policy_network(checkpoint['policy'])
+    
+    def predict(states: np.ndarray) -> np.ndarray:
+        with torch.no_grad():
+            return network(torch.from_numpy(states)).numpy()
+    
+    return network_policy(predict, network[0].in_features, state_dim)
+
+def get_rollout_policies(model_types: Optional[List[str]] = None) -> Tuple[Dict[str, Any], Dict[str, str], Dict[str, str]]:
+    """(policies, state notes, errors) of the loaded RL models (all but the mock model by default); a model
+    without a usable policy network goes to the errors instead of being rolled out"""
+    model_types = model_types if model_types is not None else [m for m in cql_models if m != 'mock']
+    policies, notes, errors = {}, {}, {}
+    for model_type in model_types:
+        try:
+            loaded = rollout_policy(model_type)
+        except Exception as e:
+            logger.warning(f"Policy {model_type} cannot be rolled out: {e}")
+            errors[model_type] = str(e)
+            continue
+        policies[model_type] = loaded["policy"]
+        if loaded["state_note"]:
+            notes[model_type] = loaded["state_note"]
+    return policies, notes, errors
+
+def run_policy_rollout(model_types: List[str], steps: int, samples: int, steps_per_action: int,
+                       interval: float, seed: Optional[int]) -> Optional[Dict[str, Any]]:
+    """Roll the RL policies (and the hold reference) forward from the current window"""
+    engine = build_rollout_engine(steps_per_action=steps_per_action, seed=seed)
+    if engine is None:
+        return None
+    lstm_sequence, preprocessing_applied = prepare_forecast_window()
+    policies, state_notes, errors = get_rollout_policies(model_types)
+    policies[HOLD_POLICY] = hold_policy
+    
+    # Policies fed zero-padded states are not rankable (the rule policy_evaluation applies)
+    summary = summarize_rollout(engine.rollout(policies, lstm_sequence[np.newaxis], steps=steps, samples=samples),
+                                selected_sensors, interval=interval, unranked=state_notes)
+    summary["errors"].update(errors)
+    summary.update(steps_per_action=steps_per_action, action_scale=WHAT_IF_RL_ACTION_SCALE,
+                   preprocessing_applied=preprocessing_applied)
+    return summary
+
+def build_pipeline_snapshot() -> Dict[str, Any]:
+    """Run every available model once on the current buffer and collect the results"""
+    global pipeline_sequence
+    pipeline_sequence += 1
+    inputs = audit_inputs()
+    timings = {}
+    
+    snapshot = {
+        "sequence": pipeline_sequence,
+        "timestamp": pd.Timestamp.now().isoformat(),
+        "current": dict(zip(selected_sensors, sensor_buffer[-1])) if sensor_buffer else None,
+        "forecast": None,
+        "defect": None,
+        "quality": None,
+        "rl_actions": {},
+        "anomalies": sensor_monitor.status(),
+        "window_quality": sensor_resampler.window_quality(sensor_buffer.maxlen),
+        "batch_lifetime": batch_feature_tracker.state()
+    }
+    
+    if lstm_model is not None and scaler_X is not None and len(sensor_buffer) >= 60:
+        start = time.perf_counter()
+        try:
+            prediction, preprocessing_applied = run_forecast_model()
+            snapshot["forecast"] = {
+                "forecast_horizon": len(prediction),
+                "forecast": format_forecast(prediction),
+                "preprocessing_applied": preprocessing_applied,
+                "sparse_window": snapshot["window_quality"]["sparse"]
+            }
+        except Exception as e:
+            logger.error(f"Error generating pipeline forecast: {e}")
+            snapshot["forecast"] = {"error": str(e)}
+        timings["forecast"] = round((time.perf_counter() - start) * 1000, 2)
+    
+    if xgb_defect is not None and feature_scaler is not None:
+        start = time.perf_counter()
+        try:
+            snapshot["defect"] = run_defect_model()
+        except Exception as e:
+            logger.error(f"Error predicting pipeline defects: {e}")
+            snapshot["defect"] = {"error": str(e)}
+        timings["defect"] = round((time.perf_counter() - start) * 1000, 2)
+    
+    if xgb_quality is not None and feature_scaler is not None:
+        start = time.perf_counter()
+        try:
+            snapshot["quality"] = run_quality_model()
+        except Exception as e:
+            logger.error(f"Error predicting pipeline quality: {e}")
+            snapshot["quality"] = {"error": str(e)}
+        timings["quality"] = round((time.perf_counter() - start) * 1000, 2)
+    
+    if sensor_buffer:
+        for model_type in list(cql_models.keys()):
+            start = time.perf_counter()
+            try:
+                snapshot["rl_actions"][model_type] = run_rl_model(model_type)["recommended_actions"]
+            except Exception as e:
+                logger.error(f"Error generating pipeline RL action for {model_type}: {e}")
+            timings[f"rl:{model_type}"] = round((time.perf_counter() - start) * 1000, 2)
+    
+    audit_prediction('pipeline', inputs, {key: snapshot[key] for key in ("forecast", "defect", "quality", "rl_actions")},
+                     timings, sequence=pipeline_sequence)
+    return snapshot
+
+def publish_pipeline_snapshot():
+    """Compute the pipeline snapshot for the latest tick and hand it to the stream broadcaster"""
+    global latest_pipeline_snapshot
+    try:
+        latest_pipeline_snapshot = inference_executor.call(build_pipeline_snapshot)
+        prediction_broadcaster.publish_threadsafe(latest_pipeline_snapshot)
+    except Exception as e:
+        logger.error(f"Error publishing pipeline snapshot: {e}")
+    publish_shared_state(latest_pipeline_snapshot)
+    persist_buffer_snapshot(latest_pipeline_snapshot)
+
+def restore_buffer_snapshot():
+    """Open the buffer snapshot file and refill the buffers from the previous run if it is fresh enough"""
+    global buffer_snapshot, latest_pipeline_snapshot, pipeline_sequence
+    if not BUFFER_SNAPSHOT_PATH or SENSOR_STATE_MODE == 'worker':
+        return
+    
+    try:
+        buffer_snapshot = PersistentSensorState.open(BUFFER_SNAPSHOT_PATH, capacity=sensor_buffer.maxlen,
+                                                     n_sensors=len(selected_sensors))
+        restored = buffer_snapshot.restore(BUFFER_SNAPSHOT_MAX_AGE)
+    except Exception as e:
+        logger.error(f"Error opening buffer snapshot {BUFFER_SNAPSHOT_PATH}: {e}")
+        buffer_snapshot = None
+        return
+    
+    if restored is None:
+        return
+    
+    sensor_buffer.extend(restored["raw"].tolist())
+    processed_buffer.extend(restored["processed"].tolist())
+    current_batch_context.update(restored["context"])
+    mark_buffer_updated()
+    for values in sensor_buffer:
+        sensor_monitor.update(values, skip=detect_downtime(values))
+        filtered_rows.append(robust_filter.update(values) if robust_filter is not None else values)
+    if restored["snapshot"] is not None:
+        latest_pipeline_snapshot = restored["snapshot"]
+        pipeline_sequence = restored["sequence"]
+        prediction_broadcaster.latest_snapshot = latest_pipeline_snapshot
+    logger.info(f"Restored {len(sensor_buffer)} raw and {len(processed_buffer)} processed points "
+                f"from a {restored['age_seconds']:.0f}s old buffer snapshot")
+
+def audit_inputs() -> Dict[str, Any]:
+    """Identity of the current model inputs: hash over the raw and processed buffers, batch-lifetime features
+    and batch context, with the buffer version and the newest row's time (its window can be read back
+    from the sensor log)"""
+    version = get_buffer_version()
+    if buffer_digest_cache["version"] != version:
+        buffer_digest_cache.update(version=version, digest=hash_inputs(list(sensor_buffer), list(processed_buffer)))
+    context = get_batch_context()
+    return {
+        "input_hash": hash_inputs(extra={"buffers": buffer_digest_cache["digest"],
+                                         "batch_lifetime": get_batch_lifetime_features(), **context}),
+        "buffer_version": version,
+        "input_rows": len(sensor_buffer),
+        "last_row": history_pyramid.last_timestamp,
+        "batch": context["batch"],
+        "code": context["code"]
+    }
+
+def audit_prediction(kind: str, inputs: Dict[str, Any], outputs: Dict[str, Any], timings: Dict[str, float],
+                     source: str = 'pipeline', sequence: Optional[int] = None):
+    """Queue an audit record; never blocks, the writer thread does the I/O"""
+    if prediction_audit is None:
+        return
+    prediction_audit.record({"kind": kind, "source": source, "sequence": sequence, **inputs,
+                             "model_versions": model_versions(), "outputs": outputs, "timings": timings})
+
+def open_prediction_audit():
+    global prediction_audit
+    if not AUDIT_DB_PATH:
+        return
+    try:
+        prediction_audit = PredictionAudit(AUDIT_DB_PATH, max_queue=AUDIT_QUEUE_SIZE, batch_size=AUDIT_BATCH_SIZE,
+                                           flush_seconds=AUDIT_FLUSH_SECONDS)
+    except Exception as e:
+        logger.error(f"Error opening prediction audit {AUDIT_DB_PATH}: {e}")
+        prediction_audit = None
+
+def close_prediction_audit():
+    if prediction_audit is not None:
+        prediction_audit.close()
+
+def open_sensor_log():
+    """Open the on-disk sensor history: the writer in local / ingester mode, a reader in workers"""
+    global sensor_log
+    if not SENSOR_LOG_DIR:
+        return
+    try:
+        sensor_log = SensorLog(SENSOR_LOG_DIR, sensor_log_fields, segment_rows=SENSOR_LOG_SEGMENT_ROWS,
+                               read_only=SENSOR_STATE_MODE == 'worker')
+    except Exception as e:
+        logger.error(f"Error opening sensor log {SENSOR_LOG_DIR}: {e}")
+        sensor_log = None
+
+def log_value(value) -> float:
+    """A reading field as stored in the sensor log, NaN when missing or not a number"""
+    try:
+        return float(value) if value is not None else np.nan
+    except (TypeError, ValueError):
+        return np.nan
+
+def log_sensor_reading(timestamp: float, sensor_data: Dict[str, Any]):
+    """Append a source reading (the sensor_log_fields) to the on-disk sensor history"""
+    if sensor_log is None:
+        return
+    try:
+        sensor_log.append(timestamp, [log_value(sensor_data.get(field)) for field in sensor_log_fields])
+    except Exception as e:
+        logger.error(f"Error appending to sensor log: {e}")
+
+def reset_pipeline_state():
+    """Forget every reading: empty buffers, fresh grid, filters, detectors and batch tracking (used by replays)"""
+    sensor_buffer.clear()
+    processed_buffer.clear()
+    filtered_rows.clear()
+    sensor_resampler.reset()
+    if robust_filter is not None:
+        robust_filter.reset()
+    sensor_monitor.reset(reason="pipeline state reset")
+    history_pyramid.clear()
+    batch_feature_tracker.reset()
+    current_batch_context.update(batch=None, code=None)
+    last_source_reading.update(time=None, values=None)
+    mark_buffer_updated()
+
+def close_sensor_log():
+    if sensor_log is not None:
+        sensor_log.close()
+
+def persist_buffer_snapshot(snapshot: Optional[Dict[str, Any]] = None):
+    """Write the buffers and the latest pipeline results to the snapshot file"""
+    if buffer_snapshot is None:
+        return
+    try:
+        buffer_snapshot.write(sensor_buffer, processed_buffer, snapshot, **current_batch_context)
+    except Exception as e:
+        logger.error(f"Error persisting buffer snapshot: {e}")
+
+def open_shared_state():
+    """Create the shared segment the ingester publishes to"""
+    global shared_state
+    shared_state = SharedSensorState.create(SENSOR_STATE_SHM, capacity=sensor_buffer.maxlen, n_sensors=len(selected_sensors),
+                                            history_bytes=history_pyramid.state_size() * 8)
+    logger.info(f"Publishing sensor state to shared memory segment {SENSOR_STATE_SHM}")
+    return shared_state
+
+def publish_shared_state(snapshot: Optional[Dict[str, Any]] = None):
+    """Copy the buffers (and a new pipeline snapshot) to the shared segment when running as the ingester;
+    the history pyramid is copied along when it has new rows"""
+    global shared_history_rows
+    if shared_state is None:
+        return
+    try:
+        history = history_pyramid.to_array() if history_pyramid.rows != shared_history_rows else None
+        shared_state.write(sensor_buffer, processed_buffer, snapshot, history=history, **current_batch_context)
+        shared_history_rows = history_pyramid.rows
+    except Exception as e:
+        logger.error(f"Error publishing shared sensor state: {e}")
+
+def get_history_pyramid() -> Optional[HistoryPyramid]:
+    """The sensor history; in worker mode the local pyramid is a copy of the ingester's, reloaded when
+    it published a newer one (None before the first)"""
+    global shared_history_version
+    if SENSOR_STATE_MODE != 'worker':
+        return history_pyramid
+    state = shared_state_client.get()
+    if state is None:
+        return None
+    version = state.write_version()
+    if version != shared_history_version:
+        values = state.read_history()
+        if values is None:
+            return None
+        history_pyramid.load_array(values)
+        shared_history_version = version
+    return history_pyramid
+
+async def follow_shared_pipeline(poll_interval: float = 0.5):
+    """Worker mode: pick up pipeline snapshots published by the ingester and push them to stream clients"""
+    global latest_pipeline_snapshot, pipeline_sequence
+    while True:
+        state = shared_state_client.get()
+        if state is not None and state.snapshot_sequence() != pipeline_sequence:
+            try:
+                sequence, snapshot = state.read_snapshot()
+                if snapshot is not None:
+                    pipeline_sequence = sequence
+                    latest_pipeline_snapshot = snapshot
+                    prediction_broadcaster.publish(snapshot)
+            except Exception as e:
+                logger.error(f"Error reading shared pipeline snapshot: {e}")
+        await asyncio.sleep(poll_interval)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Manage application lifespan"""
+    # Startup
+    logger.info("Starting up Prediction API...")
+    load_models()
+    restore_buffer_snapshot()
+    open_sensor_log()
+    open_prediction_audit()
+    register_model_slots()
+    if MODEL_REGISTRY_POLL_SECONDS > 0 and model_registry.slots:
+        model_registry.start()
+    prediction_broadcaster.attach_loop(asyncio.get_running_loop())
+    
+    if SENSOR_STATE_MODE == 'worker':
+        # The ingester polls the sensor API and runs the per-tick pipeline for all workers
+        background = asyncio.create_task(follow_shared_pipeline())
+        logger.info(f"Prediction API worker started, reading sensor state from {SENSOR_STATE_SHM}")
+    else:
+        # Poll the sensor API on the event loop
+        background = asyncio.create_task(sensor_ingestion_loop())
+        logger.info("Prediction API server started and sensor ingestion running")
+    
+    yield
+    
+    # Shutdown
+    logger.info("Shutting down Prediction API...")
+    background.cancel()
+    with suppress(asyncio.CancelledError):
+        await background
+    if buffer_snapshot is not None:
+        buffer_snapshot.close()
+    close_sensor_log()
+    model_registry.stop()
+    inference_executor.shutdown()
+    close_prediction_audit()
+
+# Create FastAPI app with enhanced CORS and lifespan
+app = FastAPI(
+    title="Pharmaceutical Manufacturing Prediction API",
+    description="AI-powered predictions for pharmaceutical manufacturing processes",
+    version="1.0.0",
+    lifespan=lifespan
+)
+
+# Conditional GET middleware (registered before CORS so 304 responses get the CORS headers too)
+@app.middleware("http")
+async def conditional_get(request, call_next):
+    path = request.url.path
+    if (request.method != 'GET' or not (path in CONDITIONAL_GET_ROUTES or path.startswith(CONDITIONAL_GET_PREFIXES))
+            or not sensor_buffer):
+        return await call_next(request)
+    
+    # Computed before the handler runs: if the buffer moves on meanwhile, the next poll just misses
+    etag = get_response_etag(request)
+    if_none_match = request.headers.get('if-none-match')
+    if etag_matches(if_none_match, etag):
+        conditional_get_stats.record(path, not_modified=True, conditional=True)
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+    
+    response = await call_next(request)
+    conditional_get_stats.record(path, not_modified=False, conditional=if_none_match is not None)
+    if response.status_code == 200:
+        response.headers["ETag"] = etag
+        response.headers["Cache-Control"] = "no-cache"
+    return response
+
+# Enhanced CORS configuration
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=[
+        "http://localhost:3000",  # React dev server
+        "http://localhost:3001",  # Express proxy server
+        "http://127.0.0.1:3000",
+        "http://127.0.0.1:3001",
+        "http://0.0.0.0:3000",
+        "http://0.0.0.0:3001"
+    ],
+    allow_credentials=True,
+    allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
+    allow_headers=["*"],
+    expose_headers=["ETag"],
+)
+
+# Request logging middleware
+@app.middleware("http")
+async def log_requests(request, call_next):
+    start_time = datetime.now()
+    logger.info(f"Request: {request.method} {request.url}")
+    
+    response = await call_next(request)
+    
+    process_time = (datetime.now() - start_time).total_seconds()
+    logger.info(f"Response: {response.status_code} - {process_time:.3f}s")
+    
+    return response
+
+async def run_inference(fn, *args):
+    """Run a model call on the inference pool, mapping a full queue to 429 and a stopped pool to 503"""
+    try:
+        return await inference_executor.run(fn, *args)
+    except InferenceOverloaded as e:
+        logger.warning(f"Rejecting {fn.__name__}: {e}")
+        raise HTTPException(status_code=429, detail="Inference queue is full, retry later",
+                            headers={"Retry-After": str(e.retry_after)})
+    except InferenceUnavailable as e:
+        raise HTTPException(status_code=503, detail=f"Inference unavailable: {e}", headers={"Retry-After": "5"})
+
+@app.get("/")
+async def root():
+    """Enhanced API status endpoint"""
+    return {
+        "message": "Pharmaceutical Manufacturing Prediction API",
+        "version": "1.0.0",
+        "status": "running",
+        "runtime": PREDICTION_RUNTIME,
         "timestamp": pd.Timestamp.now().isoformat(),
         "buffer_status": {
             "buffer_size": len(sensor_buffer),
@@ -956,6 +2271,7 @@ async def root():
         },
         "models_loaded": {
             "lstm": lstm_model is not None,
+            "lstm_inference_mode": getattr(lstm_model, 'mode', 'float32') if lstm_model is not None else None,
             "defect_classifier": xgb_defect is not None,
             "quality_classifier": xgb_quality is not None,
             "cql_models": list(cql_models.keys())
@@ -967,7 +2283,11 @@ async def root():
             "quality_prediction": "/api/quality",
             "rl_action": "/api/rl_action/{model_type}",
             "buffer_status": "/api/buffer-status",
-            "health": "/api/health"
+            "health": "/api/health",
+            "prediction_stream_ws": "/ws/predictions",
+            "prediction_stream_sse": "/api/stream/predictions",
+            "model_registry": "/api/models",
+            "inference_status": "/api/inference/status"
         },
         "cors_enabled": True,
         "sensor_api_health": check_api_health()
@@ -1025,69 +2345,35 @@ async def get_current_data():
     }
 
 @app.get("/api/forecast")
-async def get_forecast():
-    """Get sensor forecasting predictions"""
+async def get_forecast(uncertainty: bool = False, passes: int = FORECAST_MC_PASSES, interval: float = 0.9):
+    """Get sensor forecasting predictions, optionally with MC dropout intervals"""
     if lstm_model is None:
         raise HTTPException(status_code=503, detail="LSTM model not available")
+    if uncertainty and not (2 <= passes <= FORECAST_MC_MAX_PASSES and 0 < interval < 1):
+        raise HTTPException(status_code=400, detail=f"passes must be 2-{FORECAST_MC_MAX_PASSES} and interval in (0, 1)")
     
+    options = (passes, interval) if uncertainty else None
+    return await request_coalescer.run(('forecast', get_buffer_version(), options), compute_forecast_response, options)
+
+async def compute_forecast_response(uncertainty_options: Optional[tuple] = None):
     # Check if we have enough data, if not try to supplement with historical data
-    if len(sensor_buffer) < 60:
-        logger.info(f"Insufficient data for forecast. Need 60 points, have {len(sensor_buffer)}. Attempting to supplement...")
-        supplement_buffer_with_historical_data()
-        
-        # Check again after supplementation
-        if len(sensor_buffer) < 60:
-            # Try to get all available data as last resort
-            all_data = fetch_all_sensor_data()
-            if all_data and len(all_data) >= 60:
-                # Use the most recent 60 points
-                recent_data = all_data[-60:]
-                for data_point in recent_data:
-                    sensor_buffer.append(data_point)
-                logger.info(f"Used all available data to supplement buffer. Buffer size: {len(sensor_buffer)}")
-            else:
-                raise HTTPException(
-                    status_code=400, 
-                    detail=f"Insufficient data for forecast. Need 60 points, have {len(sensor_buffer)}. Historical data supplementation failed."
-                )
+    if not await ensure_sensor_data(60, "forecast"):
+        raise HTTPException(
+            status_code=400, 
+            detail=f"Insufficient data for forecast. Need 60 points, have {len(sensor_buffer)}. Historical data supplementation failed."
+        )
     
     try:
-        # Use processed buffer for better quality predictions
-        data_source = processed_buffer if len(processed_buffer) >= 60 else sensor_buffer
-        
-        # Prepare sequence data with enhanced preprocessing
-        raw_sequence = np.array(list(data_source))
-        
-        # Apply additional preprocessing if using raw sensor_buffer
-        if data_source == sensor_buffer:
-            processed_sequence = preprocess_sensor_data(list(data_source))
-            if len(processed_sequence) > 0:
-                raw_sequence = processed_sequence
+        inputs = audit_inputs()
+        start = time.perf_counter()
+        prediction, preprocessing_applied = await run_inference(run_forecast_model)
+        timings = {"forecast": round((time.perf_counter() - start) * 1000, 2)}
         
-        # Create LSTM sequence
-        lstm_sequence = create_lstm_sequences(raw_sequence, sequence_length=60)
-        
-        # Scale the sequence
-        sequence_scaled = scaler_X.transform(lstm_sequence)
-        sequence_scaled = sequence_scaled[np.newaxis, :, :]
-        
-        # Make prediction
-        prediction_scaled = lstm_model.predict(sequence_scaled, verbose=0)[0]
-        prediction = scaler_y.inverse_transform(prediction_scaled)
-        
-        # Format forecast data
-        forecast_data = []
-        for i, timestep_pred in enumerate(prediction):
-            forecast_point = {
-                "timestep": i + 1,
-                "sensors": dict(zip(selected_sensors, timestep_pred.tolist()))
-            }
-            forecast_data.append(forecast_point)
-        
-        return {
+        response = {
             "forecast_horizon": len(prediction),
-            "forecast": forecast_data,
-            "preprocessing_applied": data_source == processed_buffer,
+            "forecast": format_forecast(prediction),
+            "preprocessing_applied": preprocessing_applied,
+            "window_quality": get_window_quality(),
             "data_sources": {
                 "buffer_size": len(sensor_buffer),
                 "processed_buffer_size": len(processed_buffer),
@@ -1095,7 +2381,16 @@ async def get_forecast():
                 "api_health": check_api_health()
             }
         }
-        
+        if uncertainty_options is not None:
+            start = time.perf_counter()
+            response["uncertainty"] = await run_inference(run_forecast_uncertainty, *uncertainty_options)
+            timings["uncertainty"] = round((time.perf_counter() - start) * 1000, 2)
+        audit_prediction('forecast', inputs, {key: response[key] for key in ("forecast", "uncertainty") if key in response},
+                         timings, source='api')
+        return response
+        
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error generating forecast: {e}")
         raise HTTPException(status_code=500, detail="Error generating forecast")
@@ -1106,66 +2401,35 @@ async def get_defect_prediction():
     if xgb_defect is None:
         raise HTTPException(status_code=503, detail="Defect classifier not available")
     
+    return await request_coalescer.run(('defect', get_buffer_version()), compute_defect_response)
+
+async def compute_defect_response():
     # Check if we have enough data, if not try to supplement with historical data
-    if len(sensor_buffer) < 5:
-        logger.info(f"Insufficient data for defect prediction. Need at least 5 points, have {len(sensor_buffer)}. Attempting to supplement...")
-        supplement_buffer_with_historical_data()
-        
-        # Check again after supplementation
-        if len(sensor_buffer) < 5:
-            # Try to get all available data as last resort
-            all_data = fetch_all_sensor_data()
-            if all_data and len(all_data) >= 5:
-                # Use the most recent data points
-                recent_data = all_data[-min(60, len(all_data)):]
-                for data_point in recent_data:
-                    sensor_buffer.append(data_point)
-                logger.info(f"Used all available data to supplement buffer for defect prediction. Buffer size: {len(sensor_buffer)}")
-            else:
-                raise HTTPException(status_code=400, detail="Insufficient data for prediction. Historical data supplementation failed.")
-    
-    # Use processed buffer for better quality predictions
-    data_source = processed_buffer if len(processed_buffer) >= 5 else sensor_buffer
-    
-    features = compute_classification_features(data_source)
-    if features is None:
-        raise HTTPException(status_code=400, detail="Insufficient data for prediction")
+    if not await ensure_sensor_data(5, "defect prediction"):
+        raise HTTPException(status_code=400, detail="Insufficient data for prediction. Historical data supplementation failed.")
     
     try:
-        probabilities = xgb_defect.predict_proba(features)
-        raw_defect_probability = float(probabilities[0, 1])  # Probability of defect class
-        
-        # Apply confidence boosting for pharmaceutical manufacturing standards
-        # Higher confidence in low-defect predictions (pharmaceutical bias toward quality)
-        if raw_defect_probability < 0.3:  # Low defect risk
-            confidence_boost = 0.1
-        elif raw_defect_probability < 0.7:  # Medium defect risk  
-            confidence_boost = 0.05
-        else:  # High defect risk
-            confidence_boost = 0.02
-            
-        # Apply data quality boost
-        data_quality_boost = 0.08 if data_source == processed_buffer else 0.03
-        
-        # Enhanced defect probability with pharmaceutical manufacturing confidence
-        enhanced_probability = raw_defect_probability
-        
-        return {
-            "defect_probability": enhanced_probability,
-            "confidence": min(0.95, max(0.75, float(probabilities.max()) + confidence_boost + data_quality_boost)),
-            "risk_level": "high" if enhanced_probability > 0.7 else "medium" if enhanced_probability > 0.3 else "low",
-            "preprocessing_applied": data_source == processed_buffer,
-            "data_sources": {
-                "buffer_size": len(sensor_buffer),
-                "processed_buffer_size": len(processed_buffer),
-                "supplemented": len(sensor_buffer) > 5,
-                "api_health": check_api_health()
-            }
-        }
-        
+        inputs = audit_inputs()
+        start = time.perf_counter()
+        result = await run_inference(run_defect_model)
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error predicting defects: {e}")
         raise HTTPException(status_code=500, detail="Error predicting defects")
+    
+    if result is None:
+        raise HTTPException(status_code=400, detail="Insufficient data for prediction")
+    audit_prediction('defect', inputs, dict(result), {"defect": round((time.perf_counter() - start) * 1000, 2)},
+                     source='api')
+    
+    result["data_sources"] = {
+        "buffer_size": len(sensor_buffer),
+        "processed_buffer_size": len(processed_buffer),
+        "supplemented": len(sensor_buffer) > 5,
+        "api_health": check_api_health()
+    }
+    return result
 
 @app.get("/api/quality")
 async def get_quality_prediction():
@@ -1173,85 +2437,42 @@ async def get_quality_prediction():
     if xgb_quality is None:
         raise HTTPException(status_code=503, detail="Quality classifier not available")
     
+    return await request_coalescer.run(('quality', get_buffer_version()), compute_quality_response)
+
+async def compute_quality_response():
     # Check if we have enough data, if not try to supplement with historical data
-    if len(sensor_buffer) < 5:
-        logger.info(f"Insufficient data for quality prediction. Need at least 5 points, have {len(sensor_buffer)}. Attempting to supplement...")
-        supplement_buffer_with_historical_data()
-        
-        # Check again after supplementation
-        if len(sensor_buffer) < 5:
-            # Try to get all available data as last resort
-            all_data = fetch_all_sensor_data()
-            if all_data and len(all_data) >= 5:
-                # Use the most recent data points
-                recent_data = all_data[-min(60, len(all_data)):]
-                for data_point in recent_data:
-                    sensor_buffer.append(data_point)
-                logger.info(f"Used all available data to supplement buffer for quality prediction. Buffer size: {len(sensor_buffer)}")
-            else:
-                raise HTTPException(status_code=400, detail="Insufficient data for prediction. Historical data supplementation failed.")
-    
-    # Use processed buffer for better quality predictions
-    data_source = processed_buffer if len(processed_buffer) >= 5 else sensor_buffer
-    
-    features = compute_classification_features(data_source)
-    if features is None:
-        raise HTTPException(status_code=400, detail="Insufficient data for prediction")
+    if not await ensure_sensor_data(5, "quality prediction"):
+        raise HTTPException(status_code=400, detail="Insufficient data for prediction. Historical data supplementation failed.")
     
     try:
-        prediction = xgb_quality.predict(features)[0]
-        probabilities = xgb_quality.predict_proba(features)[0]
-        
-        quality_classes = ['High', 'Low', 'Medium']
-        predicted_class = quality_classes[prediction]
-        
-        class_probabilities = dict(zip(quality_classes, probabilities.tolist()))
-        
-        # Enhanced confidence calculation for better user experience
-        raw_confidence = float(probabilities[prediction])
-        
-        # Apply confidence boosting for pharmaceutical standards
-        # Boost confidence based on data quality and consistency
-        data_quality_boost = 0.15 if data_source == processed_buffer else 0.05
-        
-        # Boost confidence for High quality predictions (pharmaceutical bias)
-        quality_boost = 0.1 if predicted_class == 'High' else 0.05
-        
-        # Calculate enhanced confidence
-        enhanced_confidence = min(0.95, raw_confidence + data_quality_boost + quality_boost)
-        
-        # Ensure minimum confidence threshold for pharmaceutical applications
-        final_confidence = max(0.75, enhanced_confidence)
-        
-        return {
-            "quality_class": predicted_class,
-            "confidence": final_confidence,
-            "raw_confidence": raw_confidence,  # Keep original for debugging
-            "class_probabilities": class_probabilities,
-            "preprocessing_applied": data_source == processed_buffer,
-            "data_sources": {
-                "buffer_size": len(sensor_buffer),
-                "processed_buffer_size": len(processed_buffer),
-                "supplemented": len(sensor_buffer) > 5,
-                "api_health": check_api_health()
-            }
-        }
-        
+        inputs = audit_inputs()
+        start = time.perf_counter()
+        result = await run_inference(run_quality_model)
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error predicting quality: {e}")
         raise HTTPException(status_code=500, detail="Error predicting quality")
+    
+    if result is None:
+        raise HTTPException(status_code=400, detail="Insufficient data for prediction")
+    audit_prediction('quality', inputs, dict(result), {"quality": round((time.perf_counter() - start) * 1000, 2)},
+                     source='api')
+    
+    result["data_sources"] = {
+        "buffer_size": len(sensor_buffer),
+        "processed_buffer_size": len(processed_buffer),
+        "supplemented": len(sensor_buffer) > 5,
+        "api_health": check_api_health()
+    }
+    return result
 
 @app.get("/api/rl_action/{model_type}")
 async def get_rl_action(model_type: str):
     """Get RL action recommendation"""
     if not cql_models:
         # Provide detailed information about RL model status
-        import d3rlpy
-        import pkg_resources
-        try:
-            d3rlpy_version = pkg_resources.get_distribution('d3rlpy').version
-        except:
-            d3rlpy_version = getattr(d3rlpy, '__version__', 'unknown')
+        d3rlpy_version = get_d3rlpy_version()
         
         raise HTTPException(
             status_code=503, 
@@ -1275,128 +2496,32 @@ async def get_rl_action(model_type: str):
             }
         )
     
+    return await request_coalescer.run(('rl_action', model_type, get_buffer_version()), compute_rl_action_response, model_type)
+
+async def compute_rl_action_response(model_type: str):
     # Check if we have any data, if not try to supplement with historical data
-    if not sensor_buffer:
-        logger.info("No sensor data available for RL action. Attempting to supplement...")
-        supplement_buffer_with_historical_data()
-        
-        # Check again after supplementation
-        if not sensor_buffer:
-            # Try to get all available data as last resort
-            all_data = fetch_all_sensor_data()
-            if all_data and len(all_data) > 0:
-                # Use the most recent data points
-                recent_data = all_data[-min(60, len(all_data)):]
-                for data_point in recent_data:
-                    sensor_buffer.append(data_point)
-                logger.info(f"Used all available data to supplement buffer for RL action. Buffer size: {len(sensor_buffer)}")
-            else:
-                raise HTTPException(status_code=400, detail="No sensor data available. Historical data supplementation failed.")
+    if not await ensure_sensor_data(1, "RL action"):
+        raise HTTPException(status_code=400, detail="No sensor data available. Historical data supplementation failed.")
     
     try:
         # Use processed buffer for better quality predictions
         logger.info(f"Buffer sizes - sensor: {len(sensor_buffer)}, processed: {len(processed_buffer)}")
         
-        data_source = processed_buffer if len(processed_buffer) > 0 else sensor_buffer
-        logger.info(f"Using data source with {len(data_source)} points")
-        
-        state = get_rl_state(data_source)
-        logger.info(f"State shape: {state.shape}")
-        state = state.reshape(1, -1)  # Shape for prediction
-        logger.info(f"Reshaped state shape: {state.shape}")
-        
-        cql_model = cql_models[model_type]
-        logger.info(f"Model type: {type(cql_model)}")
-        
-        # Try multiple prediction methods for compatibility
-        action = None
-        prediction_methods = [
-            # Method 1: Standard predict method
-            lambda: cql_model.predict(state)[0],
-            # Method 2: Predict without indexing
-            lambda: cql_model.predict(state),
-            # Method 3: Predict with numpy array
-            lambda: cql_model.predict(np.array(state)),
-            # Method 4: Predict with torch tensor
-            lambda: cql_model.predict(torch.tensor(state, dtype=torch.float32)),
-            # Method 5: Use policy method if available
-            lambda: cql_model.policy(state)[0] if hasattr(cql_model, 'policy') else cql_model.predict(state)[0],
-            # Method 6: Use sample_action method if available
-            lambda: cql_model.sample_action(state)[0] if hasattr(cql_model, 'sample_action') else cql_model.predict(state)[0]
-        ]
-        
-        for i, method in enumerate(prediction_methods):
-            try:
-                action = method()
-                logger.info(f"Successfully predicted action using method {i+1}")
-                break
-            except Exception as e:
-                logger.warning(f"Prediction method {i+1} failed: {e}")
-                continue
-        
-        if action is None:
-            logger.error("All prediction methods failed, using fallback")
-            # Use fallback random action
-            action = np.random.uniform(-1, 1, 3)
-        
-        # Handle different action formats
-        try:
-            logger.info(f"Action type: {type(action)}; value: {action}")
-            # Convert to numpy array if possible
-            if hasattr(action, 'detach'):
-                action = action.detach().cpu().numpy()
-            elif hasattr(action, 'cpu'):
-                action = action.cpu().numpy()
-            elif hasattr(action, 'numpy'):
-                action = action.numpy()
-            elif isinstance(action, (list, tuple)):
-                action = np.array(action)
-            # If it's a scalar or 0-d array, wrap in array
-            if np.isscalar(action) or (hasattr(action, 'shape') and action.shape == ()): 
-                action = np.array([action])
-            logger.info(f"Processed action shape: {getattr(action, 'shape', 'no shape')}")
-        except Exception as e:
-            logger.error(f"Error processing action format: {e}")
-            action = np.zeros(3)
-
-        # Now safely extract values
-        try:
-            action_size = action.shape[0] if hasattr(action, 'shape') and len(action.shape) > 0 else 1
-            speed_val = float(action[0]) if action_size > 0 else 0.0
-            compression_val = float(action[1]) if action_size > 1 else 0.0
-            fill_val = float(action[2]) if action_size > 2 else 0.0
-            action_dict = {
-                "speed_adjustment": speed_val,
-                "compression_adjustment": compression_val,
-                "fill_adjustment": fill_val
-            }
-        except Exception as e:
-            logger.error(f"Error processing action: {e}")
-            action_dict = {
-                "speed_adjustment": 0.0,
-                "compression_adjustment": 0.0,
-                "fill_adjustment": 0.0
-            }
-        
-        # Determine if this is a mock model
-        is_mock_model = model_type == 'mock'
-        model_description = RL_MODEL_CONFIG.get(model_type, {}).get('description', 'Mock model for testing')
-        
-        return {
-            "model_type": model_type,
-            "model_description": model_description,
-            "is_mock_model": is_mock_model,
-            "recommended_actions": action_dict,
-            "state_summary": dict(zip(selected_sensors, state[0].tolist())),
-            "preprocessing_applied": data_source == processed_buffer,
-            "data_sources": {
-                "buffer_size": len(sensor_buffer),
-                "processed_buffer_size": len(processed_buffer),
-                "supplemented": len(sensor_buffer) > 0,
-                "api_health": check_api_health()
-            }
+        inputs = audit_inputs()
+        start = time.perf_counter()
+        result = await run_inference(run_rl_model, model_type)
+        audit_prediction(f'rl:{model_type}', inputs, {"recommended_actions": result["recommended_actions"]},
+                         {f"rl:{model_type}": round((time.perf_counter() - start) * 1000, 2)}, source='api')
+        result["data_sources"] = {
+            "buffer_size": len(sensor_buffer),
+            "processed_buffer_size": len(processed_buffer),
+            "supplemented": len(sensor_buffer) > 0,
+            "api_health": check_api_health()
         }
+        return result
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error generating RL action: {e}")
         raise HTTPException(status_code=500, detail=f"Error generating RL action: {str(e)}")
@@ -1410,6 +2535,174 @@ async def health_check():
         "last_update": pd.Timestamp.now().isoformat() if sensor_buffer else None
     }
 
+@app.websocket("/ws/predictions")
+async def predictions_websocket(websocket: WebSocket, topics: Optional[str] = None, mode: str = 'full'):
+    """Push pipeline results to the client once per sensor tick.
+    
+    Clients can change their subscription at any time by sending
+    {"action": "subscribe", "topics": ["forecast", "defect"], "mode": "delta"}.
+    """
+    await websocket.accept()
+    subscriber = prediction_broadcaster.subscribe(topics, mode)
+    
+    async def sender():
+        while True:
+            message = await subscriber.next_message()
+            await websocket.send_json(message)
+    
+    sender_task = asyncio.create_task(sender())
+    try:
+        while True:
+            data = await websocket.receive_text()
+            try:
+                command = json.loads(data)
+            except json.JSONDecodeError:
+                command = {"action": data}
+            
+            if isinstance(command, dict) and command.get("action") == "subscribe":
+                subscriber.configure(command.get("topics"), command.get("mode"))
+                if prediction_broadcaster.latest_snapshot is not None:
+                    subscriber.offer(prediction_broadcaster.latest_snapshot)
+                await websocket.send_json({
+                    "type": "subscription_updated",
+                    "topics": list(subscriber.topics),
+                    "mode": subscriber.mode,
+                    "timestamp": pd.Timestamp.now().isoformat()
+                })
+            else:
+                # Send keep-alive response
+                await websocket.send_json({
+                    "type": "keepalive",
+                    "message": "Connection active",
+                    "timestamp": pd.Timestamp.now().isoformat()
+                })
+    except WebSocketDisconnect:
+        logger.info("Prediction stream WebSocket disconnected")
+    except Exception as e:
+        logger.error(f"Prediction stream WebSocket error: {e}")
+    finally:
+        sender_task.cancel()
+        prediction_broadcaster.unsubscribe(subscriber)
+
+@app.get("/api/stream/predictions")
+async def stream_predictions(request: Request, topics: Optional[str] = None, mode: str = 'full'):
+    """Server-Sent Events alternative to /ws/predictions"""
+    subscriber = prediction_broadcaster.subscribe(topics, mode)
+    
+    async def event_stream():
+        try:
+            while not await request.is_disconnected():
+                message = await subscriber.next_message(timeout=15.0)
+                if message is None:
+                    # Comment frame keeps proxies from closing an idle stream
+                    yield ": keepalive\n\n"
+                    continue
+                yield format_sse(message)
+        finally:
+            prediction_broadcaster.unsubscribe(subscriber)
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/api/stream/status")
+async def get_stream_status():
+    """Get prediction stream subscriber statistics"""
+    return {
+        "available_topics": list(STREAM_TOPICS),
+        "stream_stats": prediction_broadcaster.get_stats(),
+        "latest_sequence": pipeline_sequence,
+        "timestamp": pd.Timestamp.now().isoformat()
+    }
+
+@app.get("/api/inference/status")
+async def get_inference_status():
+    """Inference pool load, rejections and thread budget"""
+    return {
+        "executor": inference_executor.get_stats(),
+        "coalescing": request_coalescer.get_stats(),
+        "conditional_get": conditional_get_stats.get_stats(),
+        "threads_per_worker": INFERENCE_THREADS,
+        "cpu_count": os.cpu_count(),
+        "timestamp": pd.Timestamp.now().isoformat()
+    }
+
+@app.get("/api/models")
+async def get_model_registry_status():
+    """Live and shadow model versions, shadow agreement/latency statistics and recent swaps"""
+    return {
+        "runtime": PREDICTION_RUNTIME,
+        **model_registry.status(),
+        "product_models": {"directory": PRODUCT_MODEL_DIR, "active_product": get_batch_context()["code"],
+                           **product_model_pool.get_stats()},
+        "timestamp": pd.Timestamp.now().isoformat()
+    }
+
+def get_registry_slot(slot: str):
+    if slot not in model_registry.slots:
+        raise HTTPException(status_code=404, detail=f"Unknown model slot: {slot}. Available: {list(model_registry.slots.keys())}")
+    return model_registry.slots[slot]
+
+@app.post("/api/models/reload")
+async def reload_models_endpoint():
+    """Load any new model versions now instead of waiting for the watcher"""
+    if not model_registry.slots:
+        raise HTTPException(status_code=400, detail="Hot reload is only available with the native runtime")
+    
+    # Loading can take seconds, keep it off the event loop; requests keep using the live versions
+    outcomes = await asyncio.to_thread(model_registry.refresh, False)
+    return {
+        "outcomes": outcomes,
+        "timestamp": pd.Timestamp.now().isoformat()
+    }
+
+@app.post("/api/models/{slot}/shadow")
+async def load_shadow_model(slot: str, files: List[str] = Body(..., embed=True)):
+    """Load a candidate version for a slot and score it against the live model on the same inputs"""
+    get_registry_slot(slot)
+    paths = model_registry.slot_paths(slot, files)
+    missing = [p for p in paths if not os.path.exists(p)]
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Files not found: {missing}")
+    
+    try:
+        version = await asyncio.to_thread(model_registry.load_shadow, slot, paths)
+    except Exception as e:
+        logger.error(f"Error loading shadow candidate for {slot}: {e}")
+        raise HTTPException(status_code=500, detail=f"Error loading shadow candidate: {str(e)}")
+    
+    return {
+        "slot": slot,
+        "shadow": version.describe(),
+        "timestamp": pd.Timestamp.now().isoformat()
+    }
+
+@app.delete("/api/models/{slot}/shadow")
+async def clear_shadow_model(slot: str):
+    """Stop shadow scoring for a slot"""
+    get_registry_slot(slot)
+    model_registry.clear_shadow(slot)
+    return {"slot": slot, "shadow": None, "timestamp": pd.Timestamp.now().isoformat()}
+
+@app.post("/api/models/{slot}/promote")
+async def promote_shadow_model(slot: str):
+    """Swap the shadow candidate in as the live version"""
+    get_registry_slot(slot)
+    stats = model_registry.shadow_stats.get(slot)
+    try:
+        version = model_registry.promote(slot)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    
+    return {
+        "slot": slot,
+        "live": version.describe(),
+        "shadow_stats": stats.to_dict() if stats else None,
+        "timestamp": pd.Timestamp.now().isoformat()
+    }
+
 @app.get("/api/sensor-api/health")
 async def sensor_api_health_check():
     """Check health of the external sensor API"""
@@ -1482,7 +2775,9 @@ async def supplement_buffer_endpoint():
     """Manually trigger buffer supplementation with historical data"""
     try:
         original_size = len(sensor_buffer)
-        supplement_buffer_with_historical_data()
+        needed_points = missing_buffer_points()
+        if needed_points:
+            apply_historical_data(await asyncio.to_thread(fetch_historical_sensor_data, needed_points))
         new_size = len(sensor_buffer)
         
         return {
@@ -1492,13 +2787,25 @@ async def supplement_buffer_endpoint():
             "points_added": new_size - original_size,
             "timestamp": pd.Timestamp.now().isoformat()
         }
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error supplementing buffer: {e}")
         raise HTTPException(status_code=500, detail="Error supplementing buffer")
 
+def get_sensor_state_status() -> Dict[str, Any]:
+    """Where the buffers live and, when shared, the segment statistics"""
+    state = shared_state if SENSOR_STATE_MODE == 'ingester' else shared_state_client.get() if shared_state_client else None
+    return {
+        "mode": SENSOR_STATE_MODE,
+        "shared_memory": state.stats() if state is not None else None,
+        "persisted_snapshot": {"path": BUFFER_SNAPSHOT_PATH, **buffer_snapshot.stats()} if buffer_snapshot is not None else None
+    }
+
 @app.get("/api/buffer-status")
 async def get_buffer_status():
     """Get detailed buffer status and data availability"""
+    history = get_history_pyramid()
     return {
         "buffer_size": len(sensor_buffer),
         "processed_buffer_size": len(processed_buffer),
@@ -1512,23 +2819,280 @@ async def get_buffer_status():
             "enabled": True,
             "downtime_detection": True,
             "smoothing_applied": len(processed_buffer) > 0,
+            "robust_filter": (robust_filter.get_stats() if robust_filter is not None else None)
+                             if SENSOR_STATE_MODE != 'worker' else None,
             "advanced_features": True
         },
         "sensor_api_health": check_api_health(),
         "last_update": pd.Timestamp.now().isoformat() if sensor_buffer else None,
+        "sensor_state": get_sensor_state_status(),
+        "batch_context": get_batch_context(),
+        "window_quality": get_window_quality(),
+        "resampling": sensor_resampler.get_stats() if SENSOR_STATE_MODE != 'worker' else None,
+        "ingestion": sensor_poller.get_stats() if SENSOR_STATE_MODE != 'worker' else None,
+        "history": history.get_stats() if history is not None else None,
+        "sensor_log": sensor_log.get_stats() if sensor_log is not None else None,
         "available_sensors": selected_sensors,
         "default_sensor_values": default_sensor_values
     }
 
+@app.get("/api/history")
+async def get_history(resolution: str = 'raw', limit: Optional[int] = None, sensors: Optional[str] = None):
+    """Sensor history at one resolution: 'raw' (the last 60 rows) or the 1min / 10min / 1h
+    mean, min and max buckets, oldest first; the open bucket comes last, flagged as partial"""
+    if resolution not in history_pyramid.resolutions:
+        raise HTTPException(status_code=400, detail=f"resolution must be one of {history_pyramid.resolutions}")
+    if limit is not None and limit < 1:
+        raise HTTPException(status_code=400, detail="limit must be positive")
+    names = parse_sensor_param(sensors)
+    # Workers serve the copy the ingester publishes to the shared segment
+    pyramid = get_history_pyramid()
+    if pyramid is None:
+        raise HTTPException(status_code=503, detail="No sensor history published by the ingester yet",
+                            headers={"Retry-After": "10"})
+    return pyramid.query(resolution, limit=limit, sensors=names)
+
+def parse_time_param(value: Optional[str], name: str) -> Optional[float]:
+    """Epoch seconds of an ISO timestamp or epoch query parameter"""
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parsed = parse_source_timestamp(value)
+    if parsed is None:
+        raise HTTPException(status_code=400, detail=f"{name} must be an ISO timestamp or epoch seconds")
+    return parsed
+
+def parse_sensor_param(sensors: Optional[str], known: Optional[List[str]] = None) -> Optional[List[str]]:
+    names = [name.strip() for name in sensors.split(',') if name.strip()] if sensors else None
+    unknown = sorted(set(names or []) - set(known or selected_sensors))
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown sensors: {unknown}")
+    return names
+
+@app.get("/api/sensor-log")
+async def get_sensor_log(start: Optional[str] = None, end: Optional[str] = None, sensors: Optional[str] = None,
+                         limit: Optional[int] = None):
+    """Logged readings with start <= timestamp <= end (ISO or epoch), oldest first; the newest `limit`
+    (at most SENSOR_LOG_MAX_ROWS) if the range holds more. Missing fields are null"""
+    if sensor_log is None:
+        raise HTTPException(status_code=503, detail="Sensor log is disabled")
+    limit = SENSOR_LOG_MAX_ROWS if limit is None else limit
+    if limit < 1 or limit > SENSOR_LOG_MAX_ROWS:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {SENSOR_LOG_MAX_ROWS}")
+    start_time, end_time = parse_time_param(start, 'start'), parse_time_param(end, 'end')
+    names = parse_sensor_param(sensors, sensor_log_fields)
+    
+    rows = await asyncio.to_thread(sensor_log.read, start_time, end_time, names, limit)
+    timestamps = rows.pop("timestamp")
+    return {
+        "start": start,
+        "end": end,
+        "rows": len(timestamps),
+        "timestamps": [datetime.fromtimestamp(t).isoformat() for t in timestamps.tolist()],
+        "sensors": {name: to_list(values) for name, values in rows.items()}
+    }
+
+@app.get("/api/sensor-log/aggregate")
+async def get_sensor_log_aggregate(start: Optional[str] = None, end: Optional[str] = None,
+                                   bucket_seconds: Optional[float] = None, sensors: Optional[str] = None):
+    """count / mean / min / max of the logged readings in the range, overall or per `bucket_seconds` bucket"""
+    if sensor_log is None:
+        raise HTTPException(status_code=503, detail="Sensor log is disabled")
+    if bucket_seconds is not None and bucket_seconds < SENSOR_CADENCE_SECONDS:
+        raise HTTPException(status_code=400, detail=f"bucket_seconds must be at least {SENSOR_CADENCE_SECONDS}")
+    start_time, end_time = parse_time_param(start, 'start'), parse_time_param(end, 'end')
+    names = parse_sensor_param(sensors, sensor_log_fields)
+    
+    result = await asyncio.to_thread(sensor_log.aggregate, start_time, end_time, bucket_seconds, names)
+    return {"start": start, "end": end, "bucket_seconds": bucket_seconds, **result}
+
+def require_prediction_audit() -> PredictionAudit:
+    if prediction_audit is None:
+        raise HTTPException(status_code=503, detail="Prediction audit is disabled")
+    return prediction_audit
+
+@app.get("/api/audit")
+async def get_audit_records(kind: Optional[str] = None, since: Optional[str] = None, until: Optional[str] = None,
+                            input_hash: Optional[str] = None, batch: Optional[int] = None,
+                            sequence: Optional[int] = None, limit: int = 100, outputs: bool = True):
+    """Audit records, newest first (kind: pipeline, forecast, defect, quality, rl:<model>); records
+    show up once the writer has flushed them, within AUDIT_FLUSH_SECONDS"""
+    audit = require_prediction_audit()
+    if limit < 1 or limit > AUDIT_MAX_RECORDS:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {AUDIT_MAX_RECORDS}")
+    since_time, until_time = parse_time_param(since, 'since'), parse_time_param(until, 'until')
+    
+    records = await asyncio.to_thread(audit.query, kind, since_time, until_time, input_hash, batch, sequence,
+                                      limit, outputs)
+    return {"count": len(records), "records": records}
+
+@app.get("/api/audit/status")
+async def get_audit_status():
+    """Queue depth, written / dropped records and flush latency of the audit writer"""
+    return require_prediction_audit().get_stats()
+
+@app.get("/api/audit/verify")
+async def verify_audit_chain():
+    """Recompute the hash chain over every audit record"""
+    audit = require_prediction_audit()
+    return await asyncio.to_thread(audit.verify)
+
+@app.get("/api/audit/{record_id}")
+async def get_audit_record(record_id: int):
+    record = await asyncio.to_thread(require_prediction_audit().get, record_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail=f"Audit record {record_id} not found")
+    return record
+
+@app.post("/api/what-if")
+async def what_if_analysis(scenarios: Optional[List[Dict[str, float]]] = Body(None),
+                           grid: Optional[Dict[str, List[float]]] = Body(None),
+                           include_rl_recommendations: bool = Body(False),
+                           limit: Optional[int] = Body(100),
+                           sort_by: str = Body('defect_probability')):
+    """Defect and quality predictions for hypothetical relative adjustments of the current window.
+    
+    `scenarios` lists adjustments ({"speed_adjustment": 0.05, ...}, fractions of the current level);
+    `grid` gives values per adjustment and is expanded to their cartesian product.
+    """
+    if xgb_defect is None and xgb_quality is None:
+        raise HTTPException(status_code=503, detail="Classifiers not available")
+    
+    requested = len(scenarios or []) + grid_product_size(grid or {})
+    if requested > WHAT_IF_MAX_SCENARIOS:
+        raise HTTPException(status_code=400, detail=f"{requested} scenarios requested, at most {WHAT_IF_MAX_SCENARIOS} allowed")
+    try:
+        adjustments = build_scenarios(scenarios, grid)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    if not await ensure_sensor_data(5, "what-if analysis"):
+        raise HTTPException(status_code=400, detail="Insufficient data for prediction. Historical data supplementation failed.")
+    
+    rl_models = [m for m in cql_models if m != 'mock'] if include_rl_recommendations else []
+    try:
+        result = await run_inference(run_what_if, adjustments, rl_models)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error scoring what-if scenarios: {e}")
+        raise HTTPException(status_code=500, detail="Error scoring what-if scenarios")
+    if result is None:
+        raise HTTPException(status_code=400, detail="Insufficient data for prediction")
+    
+    n = len(adjustments)
+    scores = result["scores"]
+    response = format_scenarios(adjustments, {k: v[:n + 1] for k, v in scores.items()}, limit=limit, sort_by=sort_by)
+    if result["rl_models"]:
+        rl_scores = {k: np.concatenate([v[:1], v[n + 1:]]) for k, v in scores.items()}
+        rl_view = format_scenarios(result["adjustments"][n:], rl_scores)
+        response["rl_recommendations"] = dict(zip(result["rl_models"], rl_view["scenarios"]))
+    response["scoring_ms"] = result["scoring_ms"]
+    response["rl_action_scale"] = WHAT_IF_RL_ACTION_SCALE
+    response["timestamp"] = pd.Timestamp.now().isoformat()
+    return response
+
+@app.post("/api/policy-rollout")
+async def policy_rollout(policies: Optional[List[str]] = Body(None),
+                         steps: int = Body(6),
+                         samples: int = Body(16),
+                         steps_per_action: int = Body(10),
+                         interval: float = Body(0.8),
+                         seed: Optional[int] = Body(None)):
+    """Simulate the RL policies in closed loop from the current window, with the LSTM as process model.
+    
+    Each policy acts every `steps_per_action` forecast rows for `steps` control steps; `samples`
+    Monte Carlo rollouts per policy give the spread of the final defect probability.
+    """
+    if lstm_model is None:
+        raise HTTPException(status_code=503, detail="LSTM model not available")
+    
+    unknown = sorted(set(policies or []) - set(cql_models))
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown RL models: {unknown}. Available: {list(cql_models.keys())}")
+    if not 1 <= steps <= 30 or not 1 <= steps_per_action <= 30 or samples < 1 or not 0 < interval < 1:
+        raise HTTPException(status_code=400, detail="steps and steps_per_action must be in [1, 30], samples >= 1, interval in (0, 1)")
+    model_types = policies if policies is not None else [m for m in cql_models if m != 'mock']
+    trajectories = (len(model_types) + 1) * samples
+    if trajectories > ROLLOUT_MAX_TRAJECTORIES:
+        raise HTTPException(status_code=400, detail=f"{trajectories} trajectories requested, at most {ROLLOUT_MAX_TRAJECTORIES} allowed")
+    
+    if not await ensure_sensor_data(60, "policy rollout"):
+        raise HTTPException(status_code=400, detail="Insufficient data for rollout. Historical data supplementation failed.")
+    
+    try:
+        summary = await run_inference(run_policy_rollout, model_types, steps, samples, steps_per_action, interval, seed)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error in policy rollout: {e}")
+        raise HTTPException(status_code=500, detail="Error simulating policy rollouts")
+    if summary is None:
+        raise HTTPException(status_code=503, detail="LSTM model not available")
+    
+    summary["window_quality"] = get_window_quality()
+    summary["timestamp"] = pd.Timestamp.now().isoformat()
+    return summary
+
+@app.get("/api/anomalies")
+async def get_anomalies(events: int = 20):
+    """Per-sensor EWMA / CUSUM / Page-Hinkley state, active alarms and recent alarm events"""
+    if SENSOR_STATE_MODE == 'worker':
+        # The detectors run in the ingester, workers serve the copy in its latest pipeline snapshot
+        status = (latest_pipeline_snapshot or {}).get("anomalies")
+        if status is None:
+            raise HTTPException(status_code=503, detail="No anomaly status published by the ingester yet",
+                                headers={"Retry-After": "10"})
+        status = {**status, "recent_events": status["recent_events"][-events:] if events > 0 else []}
+    else:
+        status = sensor_monitor.status(max_events=events)
+    return {**status, "timestamp": pd.Timestamp.now().isoformat()}
+
+@app.post("/api/anomalies/acknowledge")
+async def acknowledge_anomalies(sensor: Optional[str] = None):
+    """Clear latched CUSUM / Page-Hinkley alarms for one sensor or all of them"""
+    if SENSOR_STATE_MODE == 'worker':
+        raise HTTPException(status_code=409, detail="Anomaly detectors run in the sensor ingester")
+    if sensor is not None and sensor not in selected_sensors:
+        raise HTTPException(status_code=404, detail=f"Unknown sensor '{sensor}'")
+    sensor_monitor.acknowledge(sensor)
+    # Invalidates the ETag of /api/anomalies
+    mark_buffer_updated()
+    return {"acknowledged": sensor or "all", "active": sensor_monitor.status(max_events=0)["active"]}
+
+@app.get("/api/batch-features")
+async def get_batch_features(batch: Optional[int] = None, code: Optional[int] = None,
+                             recent: int = 5):
+    """Static classifier features of a batch (defaults to the batch currently streaming) and its
+    accumulated process features if it is running or recently closed"""
+    if recent < 0 or recent > 100:
+        raise HTTPException(status_code=400, detail="recent must be between 0 and 100")
+    if batch is None and code is None:
+        context = get_batch_context()
+        batch, code = context["batch"], context["code"]
+    _, resolution = batch_feature_store.lookup(batch, code)
+    
+    lifetime = get_batch_lifetime_state()
+    if lifetime is None or lifetime["batch"] != batch:
+        lifetime = next((closed for closed in batch_feature_tracker.recent_batches() if closed["batch"] == batch), None)
+    return {
+        "batch": batch,
+        "code": code,
+        "resolution": resolution,
+        "features": batch_feature_store.features(batch, code),
+        "lifetime": lifetime,
+        "recent_batches": batch_feature_tracker.recent_batches(recent),
+        "store": batch_feature_store.describe(),
+        "tracker": batch_feature_tracker.get_stats()
+    }
+
 @app.get("/api/rl-status")
 async def get_rl_status():
     """Get detailed RL model status and compatibility information"""
-    import d3rlpy
-    import pkg_resources
-    try:
-        d3rlpy_version = pkg_resources.get_distribution('d3rlpy').version
-    except:
-        d3rlpy_version = getattr(d3rlpy, '__version__', 'unknown')
+    d3rlpy_version = get_d3rlpy_version()
     
     # Check if we have real models vs mock models
     real_models = [name for name in cql_models.keys() if name != 'mock']
@@ -1543,7 +3107,7 @@ async def get_rl_status():
         "d3rlpy_version": d3rlpy_version,
         "rl_model_files": os.listdir(RL_DIR) if os.path.exists(RL_DIR) else [],
         "compatibility_status": {
-            "version_supported": d3rlpy_version.startswith('2.') or d3rlpy_version.startswith('0.23'),
+            "version_supported": PREDICTION_RUNTIME == 'onnx' or d3rlpy_version.startswith('2.') or d3rlpy_version.startswith('0.23'),
             "loading_successful": len(real_models) > 0,
             "prediction_ready": len(cql_models) > 0,
             "using_mock_models": len(mock_models) > 0
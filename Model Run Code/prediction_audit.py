@@ -0,0 +1,323 @@
+"""
+Prediction Audit Trail for PharmaCopilot
+Records every pipeline run and served prediction (input hash, model versions, outputs, timings) for
+validation: callers only enqueue a record, a writer thread flushes the queue in batches into an
+append-only SQLite table (WAL) whose rows are hash-chained, and queries read it on their own connection
+"""
+
+import hashlib
+import json
+import logging
+import numbers
+import os
+import queue
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS audit (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        created REAL NOT NULL,
+        kind TEXT NOT NULL,
+        source TEXT NOT NULL,
+        pid INTEGER NOT NULL,
+        sequence INTEGER,
+        input_hash TEXT,
+        buffer_version INTEGER,
+        input_rows INTEGER,
+        last_row REAL,
+        batch INTEGER,
+        code INTEGER,
+        model_versions TEXT NOT NULL,
+        outputs TEXT NOT NULL,
+        timings TEXT NOT NULL,
+        duration_ms REAL,
+        prev_hash TEXT NOT NULL,
+        record_hash TEXT NOT NULL
+    )""",
+    "CREATE INDEX IF NOT EXISTS audit_created ON audit (created)",
+    "CREATE INDEX IF NOT EXISTS audit_kind_created ON audit (kind, created)",
+    "CREATE INDEX IF NOT EXISTS audit_input_hash ON audit (input_hash)",
+    "CREATE INDEX IF NOT EXISTS audit_batch ON audit (batch)",
+    "CREATE INDEX IF NOT EXISTS audit_last_row ON audit (last_row)",
+    # Append-only: records can be added, never changed or removed through SQL
+    """CREATE TRIGGER IF NOT EXISTS audit_no_update BEFORE UPDATE ON audit
+        BEGIN SELECT RAISE(ABORT, 'audit records are append-only'); END""",
+    """CREATE TRIGGER IF NOT EXISTS audit_no_delete BEFORE DELETE ON audit
+        BEGIN SELECT RAISE(ABORT, 'audit records are append-only'); END"""
+]
+
+# Columns taken from a record as they are; the rest are JSON
+SCALAR_COLUMNS = ['created', 'kind', 'source', 'pid', 'sequence', 'input_hash', 'buffer_version', 'input_rows',
+                  'last_row', 'batch', 'code']
+JSON_COLUMNS = ['model_versions', 'outputs', 'timings']
+INSERT_COLUMNS = SCALAR_COLUMNS + JSON_COLUMNS + ['duration_ms', 'prev_hash', 'record_hash']
+# Declared column types: a record's values are hashed as SQLite stores and returns them
+REAL_COLUMNS = {'created', 'last_row', 'duration_ms'}
+INTEGER_COLUMNS = {'pid', 'sequence', 'buffer_version', 'input_rows', 'batch', 'code'}
+
+GENESIS_HASH = '0' * 64
+
+def hash_inputs(*arrays, extra: Optional[Dict[str, Any]] = None) -> str:
+    """SHA-256 over the model inputs: float64 bytes of each array (with its shape) plus sorted JSON of `extra`"""
+    digest = hashlib.sha256()
+    for array in arrays:
+        array = np.ascontiguousarray(array, dtype=np.float64)
+        digest.update(repr(array.shape).encode())
+        digest.update(array.tobytes())
+    if extra:
+        digest.update(json.dumps(extra, sort_keys=True, default=str).encode())
+    return digest.hexdigest()
+
+def to_json(value: Any) -> str:
+    return json.dumps(value, sort_keys=True, separators=(',', ':'), default=lambda o: o.tolist() if hasattr(o, 'tolist') else str(o))
+
+def stored_row(row: List[Any]) -> List[Any]:
+    """Hashed columns (INSERT_COLUMNS without the hashes) converted to their declared types, so an int in a
+    REAL column hashes as the float verify() reads back"""
+    converted = []
+    for column, value in zip(INSERT_COLUMNS, row):
+        if isinstance(value, numbers.Real) and column in REAL_COLUMNS:
+            value = float(value)
+        elif isinstance(value, numbers.Real) and column in INTEGER_COLUMNS and float(value).is_integer():
+            # INTEGER affinity stores a whole float as an integer
+            value = int(value)
+        converted.append(value)
+    return converted
+
+def chain_hash(prev_hash: str, row: List[Any]) -> str:
+    """Hash of a record's columns linked to the previous record, so edits to the file break the chain"""
+    return hashlib.sha256((prev_hash + to_json(row)).encode()).hexdigest()
+
+class PredictionAudit:
+    """Write-behind audit store.
+
+    record() never blocks and does no I/O: it puts the record on a bounded queue (a full queue
+    drops the record and counts it). The writer thread takes up to `batch_size` records, or what
+    arrived within `flush_seconds`, serializes them and inserts them in one transaction. Several
+    processes may share the file; BEGIN IMMEDIATE serializes their batches so the chain stays linear.
+    With read_only=True only the queries are available (no writer thread).
+    """
+
+    def __init__(self, path: str, max_queue: int = 10000, batch_size: int = 200, flush_seconds: float = 1.0,
+                 read_only: bool = False):
+        self.path = path
+        self.read_only = read_only
+        self.batch_size = max(1, batch_size)
+        self.flush_seconds = flush_seconds
+        self._queue: "queue.Queue[Optional[Dict[str, Any]]]" = queue.Queue(maxsize=max_queue)
+        self._stop = threading.Event()
+        self.counts = {"queued": 0, "written": 0, "dropped": 0, "batches": 0, "write_failures": 0}
+        self.last_flush_ms: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self._conn = self._writer = None
+        if read_only:
+            if not os.path.exists(path):
+                raise FileNotFoundError(f"No audit database at {path}")
+            return
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._conn = self._connect()
+        with self._conn:
+            for statement in SCHEMA:
+                self._conn.execute(statement)
+        self._writer = threading.Thread(target=self._run, name='prediction-audit', daemon=True)
+        self._writer.start()
+
+    def _connect(self, read_only: bool = False) -> sqlite3.Connection:
+        if read_only:
+            conn = sqlite3.connect(f'file:{os.path.abspath(self.path)}?mode=ro', uri=True, timeout=5.0)
+        else:
+            # Autocommit, transactions are opened explicitly per batch
+            conn = sqlite3.connect(self.path, timeout=10.0, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    # --- request path ---
+    def record(self, record: Dict[str, Any]) -> bool:
+        """Enqueue a record (see SCALAR_COLUMNS / JSON_COLUMNS), False if it was dropped"""
+        if self.read_only:
+            raise RuntimeError("Prediction audit opened read-only")
+        record.setdefault('created', time.time())
+        record.setdefault('pid', os.getpid())
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.counts["dropped"] += 1
+            if self.counts["dropped"] == 1 or self.counts["dropped"] % 1000 == 0:
+                logger.warning(f"Audit queue full, {self.counts['dropped']} records dropped so far")
+            return False
+        self.counts["queued"] += 1
+        return True
+
+    # --- writer thread ---
+    def _run(self):
+        while True:
+            batch = []
+            try:
+                first = self._queue.get(timeout=self.flush_seconds)
+            except queue.Empty:
+                if self._stop.is_set():
+                    return
+                continue
+            stop = first is None
+            if not stop:
+                batch.append(first)
+            deadline = time.monotonic() + self.flush_seconds
+            while not stop and len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                else:
+                    batch.append(item)
+            if batch:
+                self._write(batch)
+            if stop:
+                # Drain what was enqueued before close()
+                rest = []
+                while True:
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is not None:
+                        rest.append(item)
+                for start in range(0, len(rest), self.batch_size):
+                    self._write(rest[start:start + self.batch_size])
+                return
+
+    def _row(self, record: Dict[str, Any]) -> List[Any]:
+        row = [record.get(column) for column in SCALAR_COLUMNS]
+        row += [to_json(record.get(column) or {}) for column in JSON_COLUMNS]
+        row.append(sum((record.get('timings') or {}).values()) or None)
+        return stored_row(row)
+
+    def _write(self, batch: List[Dict[str, Any]]):
+        start = time.perf_counter()
+        try:
+            rows = [self._row(record) for record in batch]
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                last = self._conn.execute('SELECT record_hash FROM audit ORDER BY id DESC LIMIT 1').fetchone()
+                prev_hash = last[0] if last is not None else GENESIS_HASH
+                for row in rows:
+                    record_hash = chain_hash(prev_hash, row)
+                    row += [prev_hash, record_hash]
+                    prev_hash = record_hash
+                self._conn.executemany(
+                    f"INSERT INTO audit ({', '.join(INSERT_COLUMNS)}) VALUES ({', '.join('?' * len(INSERT_COLUMNS))})", rows)
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+        except Exception as e:
+            self.counts["write_failures"] += 1
+            self.last_error = str(e)
+            logger.error(f"Could not write {len(batch)} audit records: {e}")
+            return
+        self.counts["written"] += len(batch)
+        self.counts["batches"] += 1
+        self.last_flush_ms = round((time.perf_counter() - start) * 1000, 2)
+
+    def close(self, timeout: float = 10.0):
+        """Flush the queue and stop the writer"""
+        if self.read_only or self._stop.is_set():
+            return
+        self._stop.set()
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            logger.error("Audit queue still full at shutdown, pending records are lost")
+        self._writer.join(timeout)
+        if self._writer.is_alive():
+            logger.error("Audit writer did not finish flushing before shutdown")
+            return
+        self._conn.close()
+
+    # --- queries ---
+    @staticmethod
+    def _decode(row: sqlite3.Row) -> Dict[str, Any]:
+        record = dict(row)
+        for column in JSON_COLUMNS:
+            record[column] = json.loads(record[column])
+        record["created"] = datetime.fromtimestamp(record["created"]).isoformat()
+        if record["last_row"] is not None:
+            record["last_row"] = datetime.fromtimestamp(record["last_row"]).isoformat()
+        return record
+
+    def query(self, kind: Optional[str] = None, since: Optional[float] = None, until: Optional[float] = None,
+              input_hash: Optional[str] = None, batch: Optional[int] = None, sequence: Optional[int] = None,
+              limit: int = 100, include_outputs: bool = True, rows_since: Optional[float] = None,
+              rows_until: Optional[float] = None) -> List[Dict[str, Any]]:
+        """Records matching every given filter, newest first; since / until filter on the record time,
+        rows_since / rows_until on the time of the newest input row (the source clock)"""
+        clauses, params = [], []
+        for clause, value in (('kind = ?', kind), ('created >= ?', since), ('created <= ?', until),
+                              ('input_hash = ?', input_hash), ('batch = ?', batch), ('sequence = ?', sequence),
+                              ('last_row >= ?', rows_since), ('last_row <= ?', rows_until)):
+            if value is not None:
+                clauses.append(clause)
+                params.append(value)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+        conn = self._connect(read_only=True)
+        try:
+            rows = conn.execute(f'SELECT * FROM audit {where} ORDER BY id DESC LIMIT ?', params + [limit]).fetchall()
+        finally:
+            conn.close()
+        records = [self._decode(row) for row in rows]
+        if not include_outputs:
+            for record in records:
+                record.pop("outputs")
+        return records
+
+    def get(self, record_id: int) -> Optional[Dict[str, Any]]:
+        conn = self._connect(read_only=True)
+        try:
+            row = conn.execute('SELECT * FROM audit WHERE id = ?', (record_id,)).fetchone()
+        finally:
+            conn.close()
+        return self._decode(row) if row is not None else None
+
+    def verify(self) -> Dict[str, Any]:
+        """Recompute the hash chain over every record, reporting the first record that does not match"""
+        conn = self._connect(read_only=True)
+        checked = 0
+        prev_hash = GENESIS_HASH
+        try:
+            cursor = conn.execute(f"SELECT id, {', '.join(INSERT_COLUMNS)} FROM audit ORDER BY id")
+            for row in cursor:
+                values = list(row)
+                record_id, data, stored_prev, stored_hash = values[0], values[1:-2], values[-2], values[-1]
+                if stored_prev != prev_hash or chain_hash(prev_hash, stored_row(data)) != stored_hash:
+                    return {"valid": False, "checked": checked, "first_invalid_id": record_id}
+                prev_hash = stored_hash
+                checked += 1
+        finally:
+            conn.close()
+        return {"valid": True, "checked": checked, "first_invalid_id": None}
+
+    def get_stats(self) -> Dict[str, Any]:
+        size = sum(os.path.getsize(p) for p in (self.path, self.path + '-wal') if os.path.exists(p))
+        return {
+            "path": os.path.abspath(self.path),
+            "queue_depth": self._queue.qsize(),
+            "queue_capacity": self._queue.maxsize,
+            **self.counts,
+            "last_flush_ms": self.last_flush_ms,
+            "last_error": self.last_error,
+            "disk_mb": round(size / 2 ** 20, 2),
+            "writer_alive": self._writer is not None and self._writer.is_alive()
+        }
@@ -0,0 +1,325 @@
+"""
+Prediction Replay for PharmaCopilot
+Regenerates the pipeline predictions of a past time range from the sensor log, for revalidation after a
+model change or to answer an auditor: the range is split at batch starts into chunks that worker processes
+replay through the live ingestion, preprocessing and model code, on the source clock, each from a warm-up
+point where the live state can be rebuilt exactly. Records come out in the audit trail's format and are
+compared with it field for field
+"""
+
+import argparse
+import json
+import logging
+import math
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from prediction_audit import PredictionAudit, to_json
+from sensor_resampler import TimestampResampler, parse_source_timestamp
+
+logger = logging.getLogger(__name__)
+
+# Record fields that identify a run and must match the audit trail bit for bit; created, pid, sequence,
+# buffer_version and timings depend on the process and the wall clock
+COMPARED_FIELDS = ['kind', 'last_row', 'input_rows', 'batch', 'code', 'input_hash', 'outputs']
+
+# The API module of a worker process, imported by init_worker
+api = None
+
+class ReplayCollector:
+    """Takes the place of the audit store in a worker: keeps the records, stamped with the source clock"""
+
+    def __init__(self):
+        self.now: Optional[float] = None
+        self.records: List[Dict[str, Any]] = []
+
+    def record(self, record: Dict[str, Any]) -> bool:
+        record['created'] = self.now
+        record['pid'] = os.getpid()
+        self.records.append(record)
+        return True
+
+def init_worker(threads: Optional[int] = None):
+    """Import the API with every live side effect off (log, audit, snapshots, batch history) and load the models"""
+    global api
+    os.environ.update(SENSOR_LOG_DIR='', AUDIT_DB_PATH='', BUFFER_SNAPSHOT_PATH='', BATCH_HISTORY_PATH='',
+                      SENSOR_STATE_MODE='local', MODEL_REGISTRY_POLL_SECONDS='0')
+    if threads:
+        os.environ['INFERENCE_THREADS'] = str(threads)
+    import prediction_api
+    api = prediction_api
+    # Per-reading INFO lines would dominate a replay
+    logging.getLogger('prediction_api').setLevel(logging.WARNING)
+    api.load_models()
+    api.register_model_slots()
+
+def replay_chunk(chunk: Dict[str, Any]) -> Dict[str, Any]:
+    """Feed a chunk's readings through the pipeline from its warm-up start; returns the records of the
+    pipeline runs from `emit_from` on"""
+    start = time.perf_counter()
+    api.reset_pipeline_state()
+    collector = ReplayCollector()
+    api.prediction_audit = collector
+
+    fields, timestamps, values = chunk["fields"], chunk["timestamps"], chunk["values"]
+    for i, timestamp in enumerate(timestamps):
+        # Missing fields were NaN in the log and are left out, as they were missing from the reading
+        data = {field: column[i] for field, column in zip(fields, values) if not math.isnan(column[i])}
+        data["timestamp"] = timestamp
+        collector.now = timestamp
+        _, changed = api.ingest_sensor_payload({"status": "success", "data": data})
+        if changed and i >= chunk["emit_from"]:
+            api.build_pipeline_snapshot()
+
+    return {
+        "index": chunk["index"],
+        "records": collector.records,
+        "readings": len(timestamps),
+        "warmup_readings": chunk["emit_from"],
+        "seconds": round(time.perf_counter() - start, 3)
+    }
+
+def scan_sync_points(timestamps: np.ndarray, cadence: float, max_gap: float,
+                     genuine_start: bool) -> Tuple[np.ndarray, np.ndarray]:
+    """Replay the resampler on the timestamps alone: (readings where a fresh resampler reproduces the live
+    grid, cumulative rows emitted before each reading).
+
+    Which readings the resampler takes depends only on the clock, not on the grid, so restarts (first
+    reading of the log, gaps, jumps back) are found exactly; on-grid readings only count once the scan
+    has passed a restart, before that its grid may not be the live one.
+    """
+    scan = TimestampResampler(0, cadence_seconds=cadence, max_gap_seconds=max_gap)
+    sync = np.zeros(len(timestamps), dtype=bool)
+    rows = np.zeros(len(timestamps) + 1, dtype=np.int64)
+    trusted = False
+    restarts = 0
+    empty = np.empty(0)
+    for i, timestamp in enumerate(timestamps.tolist()):
+        rows[i + 1] = rows[i] + len(scan.add(timestamp, empty))
+        restarted = scan.counts["restarts"] + scan.counts["gap_breaks"] > restarts or (i == 0 and genuine_start)
+        restarts = scan.counts["restarts"] + scan.counts["gap_breaks"]
+        trusted = trusted or restarted
+        sync[i] = scan.aligned and trusted
+    return sync, rows
+
+def batch_starts(batch_keys: Sequence[Optional[Tuple]], genuine_start: bool) -> List[int]:
+    """Indices where a new batch starts (readings without a batch id belong to the previous one)"""
+    starts = [0] if genuine_start else []
+    current = None
+    for i, key in enumerate(batch_keys):
+        if key is None:
+            continue
+        if current is not None and key != current:
+            starts.append(i)
+        current = key
+    return starts
+
+def plan_chunks(timestamps: np.ndarray, batch_keys: Sequence[Optional[Tuple]], emit_start: int, cadence: float,
+                max_gap: float, warmup_rows: int, chunk_readings: int, genuine_start: bool) -> List[Dict[str, Any]]:
+    """Split readings [emit_start, n) into chunks at batch starts, each with its warm-up start.
+
+    A chunk's warm-up begins at or before the start of its first batch (batch features cover the
+    whole batch), at least `warmup_rows` resampled rows before the chunk (full buffers and filter
+    windows) and at a reading where a fresh resampler continues the live grid. A chunk is `exact`
+    when such a point exists inside the read window.
+    """
+    n = len(timestamps)
+    sync, rows = scan_sync_points(timestamps, cadence, max_gap, genuine_start)
+    starts = batch_starts(batch_keys, genuine_start)
+
+    boundaries = [emit_start]
+    for start in starts:
+        if start > boundaries[-1] and start - boundaries[-1] >= chunk_readings:
+            boundaries.append(start)
+    boundaries.append(n)
+
+    chunks = []
+    for index, (begin, end) in enumerate(zip(boundaries[:-1], boundaries[1:])):
+        if begin >= end:
+            continue
+        batch_start = max((s for s in starts if s <= begin), default=None)
+        warmup = None
+        if batch_start is not None:
+            for i in range(batch_start, -1, -1):
+                if sync[i] and rows[begin] - rows[i] >= warmup_rows:
+                    warmup = i
+                    break
+                if i == 0 and genuine_start:
+                    # Nothing before the log: the live pipeline started from scratch here too
+                    warmup = 0
+        chunks.append({
+            "index": index,
+            "warmup": warmup if warmup is not None else 0,
+            "begin": begin,
+            "end": end,
+            "exact": warmup is not None
+        })
+    return chunks
+
+def batch_key(campaign: float, batch: float) -> Optional[Tuple]:
+    if math.isnan(batch):
+        return None
+    return (None if math.isnan(campaign) else int(campaign), int(batch))
+
+def iso(timestamp: Optional[float]) -> Optional[str]:
+    return datetime.fromtimestamp(timestamp).isoformat() if timestamp is not None else None
+
+def canonical(record: Dict[str, Any]) -> Dict[str, Any]:
+    """A record with the fields as the audit trail returns them (JSON round trip, ISO times)"""
+    record = json.loads(to_json(record))
+    record["created"] = iso(record.get("created"))
+    record["last_row"] = iso(record.get("last_row"))
+    return record
+
+def compare_with_audit(records: List[Dict[str, Any]], live: List[Dict[str, Any]],
+                       max_examples: int = 20) -> Dict[str, Any]:
+    """Match replayed runs with live pipeline records by the time of their newest input row"""
+    by_row: Dict[str, List[Dict[str, Any]]] = {}
+    for record in live:
+        by_row.setdefault(record["last_row"], []).append(record)
+
+    counts = {"identical": 0, "input_mismatch": 0, "output_mismatch": 0, "no_live_record": 0}
+    examples = []
+    versions = set()
+    matched_rows = set()
+    for record in records:
+        candidates = by_row.get(record["last_row"], [])
+        if not candidates:
+            counts["no_live_record"] += 1
+            continue
+        matched_rows.add(record["last_row"])
+        same = [c for c in candidates if all(to_json(c.get(f)) == to_json(record.get(f)) for f in COMPARED_FIELDS)]
+        if same:
+            counts["identical"] += 1
+            continue
+        versions.update(to_json(c["model_versions"]) for c in candidates if c["model_versions"] != record["model_versions"])
+        live_record = candidates[0]
+        status = "input_mismatch" if live_record["input_hash"] != record["input_hash"] else "output_mismatch"
+        counts[status] += 1
+        if len(examples) < max_examples:
+            examples.append({
+                "status": status,
+                "last_row": record["last_row"],
+                "live_id": live_record["id"],
+                "differing_fields": [f for f in COMPARED_FIELDS if to_json(live_record.get(f)) != to_json(record.get(f))],
+                "differing_outputs": sorted(k for k in set(live_record["outputs"]) | set(record["outputs"])
+                                            if to_json(live_record["outputs"].get(k)) != to_json(record["outputs"].get(k)))
+            })
+    return {
+        "replayed_runs": len(records),
+        "live_runs": len(live),
+        **counts,
+        "live_without_replay": len(set(by_row) - matched_rows),
+        "model_versions_differ": sorted(versions),
+        "examples": examples
+    }
+
+def replay(start: float, end: float, workers: int = 2, chunk_readings: int = 2000, lookback_seconds: float = 86400,
+           threads: Optional[int] = None) -> Dict[str, Any]:
+    """Replay every pipeline run triggered by a reading in [start, end]; returns the records in order and a report"""
+    import prediction_api as live_api
+    from sensor_log import SensorLog
+
+    if not live_api.SENSOR_LOG_DIR:
+        raise ValueError("SENSOR_LOG_DIR is not set, there is no sensor history to replay")
+    log = SensorLog(live_api.SENSOR_LOG_DIR, live_api.sensor_log_fields, read_only=True)
+    fields = live_api.sensor_log_fields
+    cadence, max_gap = live_api.SENSOR_CADENCE_SECONDS, live_api.SENSOR_MAX_GAP_SECONDS
+    warmup_rows = live_api.sensor_buffer.maxlen + max(live_api.filtered_rows.maxlen, live_api.ROBUST_FILTER_WINDOW)
+
+    # Arrival order, so late readings reach the resampler where they did live
+    data = log.read(start - lookback_seconds, end, sort=False)
+    timestamps = data["timestamp"]
+    emit_start = int(np.argmax(timestamps >= start)) if len(timestamps) and timestamps.max() >= start else len(timestamps)
+    if emit_start == len(timestamps):
+        raise ValueError(f"No logged readings between {iso(start)} and {iso(end)}")
+    previous = log.read(end=float(timestamps[0]), columns=['batch'], limit=2)["timestamp"]
+    genuine_start = len(previous) < 2 or timestamps[0] - previous[-2] > max_gap
+
+    keys = [batch_key(c, b) for c, b in zip(data["campaign"].tolist(), data["batch"].tolist())]
+    chunks = plan_chunks(timestamps, keys, emit_start, cadence, max_gap, warmup_rows, chunk_readings, genuine_start)
+    logger.info(f"Replaying {len(timestamps) - emit_start} readings in {len(chunks)} chunks on {workers} workers")
+
+    columns = [data[field] for field in fields]
+    tasks = [{
+        "index": chunk["index"],
+        "fields": fields,
+        "timestamps": timestamps[chunk["warmup"]:chunk["end"]].tolist(),
+        "values": [column[chunk["warmup"]:chunk["end"]].tolist() for column in columns],
+        "emit_from": chunk["begin"] - chunk["warmup"]
+    } for chunk in chunks]
+
+    started = time.perf_counter()
+    # Spawned workers: the API module must be imported after init_worker has switched off its side effects
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=max(1, min(workers, len(tasks))), mp_context=context,
+                             initializer=init_worker, initargs=(threads,)) as pool:
+        results = sorted(pool.map(replay_chunk, tasks), key=lambda result: result["index"])
+
+    row_times = [record["last_row"] for result in results for record in result["records"]]
+    records = [canonical(record) for result in results for record in result["records"]]
+    for chunk, result in zip(chunks, results):
+        chunk.update(readings=result["readings"], warmup_readings=result["warmup_readings"],
+                     runs=len(result["records"]), seconds=result["seconds"], first_reading=iso(timestamps[chunk["begin"]]))
+    return {
+        "start": iso(start),
+        "end": iso(end),
+        "readings": len(timestamps) - emit_start,
+        "runs": len(records),
+        "exact": all(chunk["exact"] for chunk in chunks),
+        # Source time span of the replayed runs' newest input rows
+        "row_range": [min(row_times), max(row_times)] if row_times else None,
+        "seconds": round(time.perf_counter() - started, 2),
+        "chunks": chunks,
+        "records": records
+    }
+
+def parse_time(value: str) -> float:
+    try:
+        return float(value)
+    except ValueError:
+        parsed = parse_source_timestamp(value)
+        if parsed is None:
+            raise argparse.ArgumentTypeError(f"{value} is not an ISO timestamp or epoch seconds")
+        return parsed
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay the prediction pipeline over a logged time range')
+    parser.add_argument('--start', type=parse_time, required=True, help='Range start (ISO or epoch seconds, source clock)')
+    parser.add_argument('--end', type=parse_time, required=True, help='Range end (ISO or epoch seconds, source clock)')
+    parser.add_argument('--workers', type=int, default=max(1, (os.cpu_count() or 2) // 2), help='Worker processes')
+    parser.add_argument('--chunk-readings', type=int, default=2000, help='Smallest chunk, chunks are cut at batch starts')
+    parser.add_argument('--lookback-hours', type=float, default=24.0, help='History read before the range for warm-up')
+    parser.add_argument('--threads', type=int, default=None,
+                        help='Intra-op threads per worker (default: the live INFERENCE_THREADS, for identical numerics)')
+    parser.add_argument('--output', default=None, help='Write the replayed records here, one JSON record per line')
+    parser.add_argument('--no-compare', action='store_true', help='Do not compare with the audit trail')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    result = replay(args.start, args.end, workers=args.workers, chunk_readings=args.chunk_readings,
+                    lookback_seconds=args.lookback_hours * 3600, threads=args.threads)
+    records = result.pop("records")
+    if args.output:
+        with open(args.output, 'w') as f:
+            for record in records:
+                f.write(to_json(record) + '\n')
+
+    import prediction_api as live_api
+    if not args.no_compare and live_api.AUDIT_DB_PATH and os.path.exists(live_api.AUDIT_DB_PATH):
+        audit = PredictionAudit(live_api.AUDIT_DB_PATH, read_only=True)
+        rows_since, rows_until = result["row_range"] or (args.start, args.end)
+        live = audit.query(kind='pipeline', limit=2 * len(records) + 1000, rows_since=rows_since, rows_until=rows_until)
+        result["comparison"] = compare_with_audit(records, live)
+
+    print(json.dumps(result, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,178 @@
+"""
+Prediction Stream Broadcaster for PharmaCopilot
+Pushes each pipeline snapshot to WebSocket and Server-Sent Events subscribers once per sensor tick
+"""
+
+import asyncio
+import json
+import logging
+from typing import Any, Dict, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+# Topics a client can subscribe to (keys of a pipeline snapshot)
+STREAM_TOPICS = ('current', 'forecast', 'defect', 'quality', 'rl_actions', 'anomalies')
+
+# Payload modes: full topic payloads every tick, or only the fields that changed
+STREAM_MODES = ('full', 'delta')
+
+def parse_topics(topics: Optional[Any]) -> tuple:
+    """Normalise a comma separated string or list of topics, defaulting to all topics"""
+    if not topics:
+        return STREAM_TOPICS
+    if isinstance(topics, str):
+        topics = topics.split(',')
+    selected = tuple(t.strip() for t in topics if t and t.strip() in STREAM_TOPICS)
+    return selected or STREAM_TOPICS
+
+def compute_delta(previous: Any, current: Any) -> Any:
+    """Return the part of `current` that differs from `previous`, or None when unchanged"""
+    if previous == current:
+        return None
+    if not isinstance(previous, dict) or not isinstance(current, dict):
+        return current
+
+    delta = {}
+    for key, value in current.items():
+        if key not in previous:
+            delta[key] = value
+            continue
+        changed = compute_delta(previous[key], value)
+        if changed is not None:
+            delta[key] = changed
+
+    # Keys that disappeared are sent as explicit nulls
+    for key in previous:
+        if key not in current:
+            delta[key] = None
+
+    return delta or None
+
+class StreamSubscriber:
+    """A single push client with its topic selection, payload mode and pending snapshots"""
+
+    def __init__(self, topics: Iterable[str], mode: str = 'full', max_pending: int = 4):
+        self.topics = parse_topics(topics)
+        self.mode = mode if mode in STREAM_MODES else 'full'
+        # Snapshots are queued raw and rendered on send, so dropping a stale tick
+        # never leaves a delta client out of sync with what it last received
+        self.pending = asyncio.Queue(maxsize=max_pending)
+        self.last_sent = {}
+        self.messages_sent = 0
+        self.ticks_dropped = 0
+
+    def configure(self, topics: Optional[Any] = None, mode: Optional[str] = None):
+        """Change subscription, the next message is a full payload for the new topics"""
+        if topics is not None:
+            self.topics = parse_topics(topics)
+        if mode in STREAM_MODES:
+            self.mode = mode
+        self.last_sent = {}
+
+    def offer(self, snapshot: Dict[str, Any]):
+        """Queue a snapshot, discarding the oldest pending one if the client is slow"""
+        if self.pending.full():
+            try:
+                self.pending.get_nowait()
+                self.ticks_dropped += 1
+            except asyncio.QueueEmpty:
+                pass
+        self.pending.put_nowait(snapshot)
+
+    def render(self, snapshot: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Build the message for this client, returns None if a delta client has nothing new"""
+        data = {}
+        for topic in self.topics:
+            value = snapshot.get(topic)
+            if self.mode == 'delta' and topic in self.last_sent:
+                changed = compute_delta(self.last_sent[topic], value)
+                if changed is None:
+                    continue
+                data[topic] = changed
+            else:
+                data[topic] = value
+            self.last_sent[topic] = value
+
+        if self.mode == 'delta' and not data:
+            return None
+
+        self.messages_sent += 1
+        return {
+            "type": "pipeline_update",
+            "mode": self.mode,
+            "sequence": snapshot.get("sequence"),
+            "timestamp": snapshot.get("timestamp"),
+            "data": data
+        }
+
+    async def next_message(self, timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """Wait for the next renderable message, returns None on timeout"""
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        while True:
+            remaining = None if deadline is None else max(0.0, deadline - loop.time())
+            try:
+                snapshot = await asyncio.wait_for(self.pending.get(), timeout=remaining)
+            except asyncio.TimeoutError:
+                return None
+            message = self.render(snapshot)
+            if message is not None:
+                return message
+
+class PredictionBroadcaster:
+    """Fan-out of pipeline snapshots from the ingestion thread to async push clients"""
+
+    def __init__(self):
+        self.subscribers = set()
+        self.loop = None
+        self.latest_snapshot = None
+        self.snapshots_published = 0
+        self.total_connections = 0
+
+    def attach_loop(self, loop: asyncio.AbstractEventLoop):
+        """Bind to the server event loop so background threads can publish safely"""
+        self.loop = loop
+
+    def subscribe(self, topics: Optional[Any] = None, mode: str = 'full') -> StreamSubscriber:
+        """Register a client and prime it with the latest snapshot"""
+        subscriber = StreamSubscriber(topics, mode)
+        self.subscribers.add(subscriber)
+        self.total_connections += 1
+        if self.latest_snapshot is not None:
+            subscriber.offer(self.latest_snapshot)
+        logger.info(f"Prediction stream subscriber added. Active subscribers: {len(self.subscribers)}")
+        return subscriber
+
+    def unsubscribe(self, subscriber: StreamSubscriber):
+        """Remove a client"""
+        self.subscribers.discard(subscriber)
+        logger.info(f"Prediction stream subscriber removed. Active subscribers: {len(self.subscribers)}")
+
+    def publish(self, snapshot: Dict[str, Any]):
+        """Deliver a snapshot to every subscriber, must run on the event loop"""
+        self.latest_snapshot = snapshot
+        self.snapshots_published += 1
+        for subscriber in list(self.subscribers):
+            subscriber.offer(snapshot)
+
+    def publish_threadsafe(self, snapshot: Dict[str, Any]):
+        """Publish from a non-async thread such as the ingestion pipeline"""
+        if self.loop is None or self.loop.is_closed():
+            self.latest_snapshot = snapshot
+            return
+        self.loop.call_soon_threadsafe(self.publish, snapshot)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Subscriber and delivery statistics"""
+        return {
+            "active_subscribers": len(self.subscribers),
+            "total_connections": self.total_connections,
+            "snapshots_published": self.snapshots_published,
+            "latest_sequence": self.latest_snapshot.get("sequence") if self.latest_snapshot else None,
+            "messages_sent": sum(s.messages_sent for s in self.subscribers),
+            "ticks_dropped": sum(s.ticks_dropped for s in self.subscribers)
+        }
+
+def format_sse(message: Dict[str, Any]) -> str:
+    """Encode a stream message as a Server-Sent Events frame"""
+    return f"id: {message.get('sequence')}\nevent: {message.get('type')}\ndata: {json.dumps(message)}\n\n"
@@ -0,0 +1,60 @@
+"""
+Request Coalescing for PharmaCopilot
+Single-flight execution for the expensive prediction endpoints: concurrent identical requests
+(same endpoint, same buffer version) share one in-flight computation and its result
+"""
+
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+logger = logging.getLogger(__name__)
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key onto one task.
+
+    Keys are tuples whose first element names the endpoint (used for the statistics).
+    The first caller starts the computation; callers arriving while it runs await the
+    same task and get the same result, or the same exception. Only used from the event loop.
+    """
+
+    def __init__(self):
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        self._waiters: Dict[Hashable, int] = {}
+        self._stats: Dict[str, Dict[str, int]] = {}
+
+    async def run(self, key: tuple, fn: Callable[..., Awaitable[Any]], *args) -> Any:
+        stats = self._stats.setdefault(str(key[0]), {"requests": 0, "executions": 0, "coalesced": 0, "peak_waiters": 0})
+        stats["requests"] += 1
+
+        task = self._inflight.get(key)
+        if task is None:
+            stats["executions"] += 1
+            task = asyncio.ensure_future(fn(*args))
+            self._inflight[key] = task
+            self._waiters[key] = 1
+            task.add_done_callback(lambda done, key=key: self._finished(key, done))
+        else:
+            stats["coalesced"] += 1
+            self._waiters[key] += 1
+            stats["peak_waiters"] = max(stats["peak_waiters"], self._waiters[key])
+
+        # Shielded: a disconnecting caller must not cancel the computation the others are waiting for
+        return await asyncio.shield(task)
+
+    def _finished(self, key: Hashable, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+            del self._waiters[key]
+        if not task.cancelled() and task.exception() is not None:
+            # Retrieved here so an abandoned failure isn't reported as "never retrieved"
+            logger.debug(f"Coalesced call {key} failed: {task.exception()}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        endpoints = {}
+        for name, stats in self._stats.items():
+            endpoints[name] = {
+                **stats,
+                "coalescing_ratio": round(stats["coalesced"] / stats["requests"], 4) if stats["requests"] else 0.0
+            }
+        return {"in_flight": len(self._inflight), "endpoints": endpoints}
@@ -0,0 +1,226 @@
+"""
+Robust Sensor Filter for PharmaCopilot
+Streaming Hampel filter ahead of the moving-average smoothing: a sample further than `n_sigmas`
+robust standard deviations (1.4826 * MAD) from the rolling median of its sensor is replaced by the
+median, so single-sample spikes in main_comp or ejection don't leak into the LSTM input
+"""
+
+import argparse
+import json
+import logging
+import time
+from bisect import bisect_left, insort
+from collections import deque
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# MAD -> standard deviation for normally distributed data
+MAD_SCALE = 1.4826
+
+class RollingMedianMAD:
+    """Median and median absolute deviation of the last `window` values.
+
+    The window is kept sorted: insertion and removal are binary searches (O(log w) comparisons)
+    plus a pointer move, which for filter-sized windows is cheaper in Python than keeping two
+    heaps with lazy deletion. The MAD is the k-th smallest of two sorted runs (distances of
+    the values below and above the median), found by binary search in O(log w).
+    """
+
+    def __init__(self, window: int):
+        if window < 1:
+            raise ValueError("window must be at least 1")
+        self.window = window
+        self._values = deque()
+        self._sorted: List[float] = []
+
+    def __len__(self) -> int:
+        return len(self._sorted)
+
+    def add(self, x: float):
+        self._values.append(x)
+        insort(self._sorted, x)
+        if len(self._values) > self.window:
+            del self._sorted[bisect_left(self._sorted, self._values.popleft())]
+
+    def clear(self):
+        self._values.clear()
+        self._sorted.clear()
+
+    def median(self) -> float:
+        s, n = self._sorted, len(self._sorted)
+        return s[n // 2] if n % 2 else (s[n // 2 - 1] + s[n // 2]) / 2.0
+
+    def _kth_deviation(self, median: float, split: int, k: int) -> float:
+        """k-th smallest (0-based) of |x - median| over the window; values [0, split) are below the median"""
+        s, n = self._sorted, len(self._sorted)
+        n_low, n_high = split, n - split
+
+        def low(i):   # i-th closest value below the median
+            return median - s[split - 1 - i]
+
+        def high(j):  # j-th closest value at or above the median
+            return s[split + j] - median
+
+        # Take i deviations from the low run and k + 1 - i from the high run
+        lo, hi = max(0, k + 1 - n_high), min(k + 1, n_low)
+        while lo < hi:
+            i = (lo + hi) // 2
+            if high(k - i) > low(i):
+                lo = i + 1
+            else:
+                hi = i
+        i = lo
+        candidates = []
+        if i > 0:
+            candidates.append(low(i - 1))
+        if k + 1 - i > 0:
+            candidates.append(high(k - i))
+        return max(candidates)
+
+    def mad(self, median: Optional[float] = None) -> float:
+        n = len(self._sorted)
+        if n == 0:
+            return 0.0
+        median = self.median() if median is None else median
+        split = bisect_left(self._sorted, median)
+        if n % 2:
+            return self._kth_deviation(median, split, n // 2)
+        return (self._kth_deviation(median, split, n // 2 - 1) + self._kth_deviation(median, split, n // 2)) / 2.0
+
+class HampelFilter:
+    """Causal Hampel filter over rows of several sensors.
+
+    Each filtered column keeps the last `window` raw values; a value is replaced by the rolling
+    median when its distance exceeds both n_sigmas * 1.4826 * MAD and `min_deviation` * |median|.
+    The relative floor keeps quantized, mostly flat signals (MAD 0) from having every small step
+    flagged. Steps in the process still pass once they fill half the window.
+    """
+
+    def __init__(self, sensors: Sequence[str], filtered: Optional[Sequence[str]] = None, window: int = 7,
+                 n_sigmas: float = 3.0, min_deviation: float = 0.1, min_periods: int = 3):
+        self.sensors = list(sensors)
+        filtered = self.sensors if filtered is None else list(filtered)
+        unknown = set(filtered) - set(self.sensors)
+        if unknown:
+            raise ValueError(f"Unknown sensors for the robust filter: {sorted(unknown)}")
+        self.columns = [self.sensors.index(name) for name in filtered]
+        self.window = window
+        self.n_sigmas = n_sigmas
+        self.min_deviation = min_deviation
+        self.min_periods = min(min_periods, window)
+        self._windows = {column: RollingMedianMAD(window) for column in self.columns}
+        self.samples = 0
+        self.replaced = {self.sensors[column]: 0 for column in self.columns}
+
+    def update(self, row: Sequence[float]) -> List[float]:
+        """Add a raw row, returns it with the outliers replaced"""
+        filtered = list(row)
+        self.samples += 1
+        for column, rolling in self._windows.items():
+            x = row[column]
+            rolling.add(x)
+            if len(rolling) < self.min_periods:
+                continue
+            median = rolling.median()
+            threshold = max(self.n_sigmas * MAD_SCALE * rolling.mad(median), self.min_deviation * abs(median))
+            if abs(x - median) > threshold:
+                filtered[column] = median
+                self.replaced[self.sensors[column]] += 1
+        return filtered
+
+    def reset(self):
+        for rolling in self._windows.values():
+            rolling.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "window": self.window,
+            "n_sigmas": self.n_sigmas,
+            "min_deviation": self.min_deviation,
+            "sensors": list(self.replaced),
+            "samples": self.samples,
+            "replaced": dict(self.replaced),
+            "replaced_fraction": {name: round(count / self.samples, 5) if self.samples else 0.0
+                                  for name, count in self.replaced.items()}
+        }
+
+def hampel_pandas(series: pd.Series, window: int, n_sigmas: float = 3.0, min_deviation: float = 0.1,
+                  min_periods: int = 3) -> pd.Series:
+    """Reference implementation with pandas rolling windows (same trailing window and thresholds)"""
+    rolling = series.rolling(window, min_periods=min(min_periods, window))
+    median = rolling.median()
+    mad = rolling.apply(lambda w: np.median(np.abs(w - np.median(w))), raw=True)
+    threshold = np.maximum(n_sigmas * MAD_SCALE * mad, min_deviation * median.abs())
+    outliers = (series - median).abs() > threshold
+    return series.where(~outliers, median)
+
+def benchmark(values: np.ndarray, window: int = 7, tick_rows: int = 2000) -> Dict[str, Any]:
+    """Streaming filter against pandas: the same series in one call, and per tick (recomputing the
+    trailing window for every new row, as a stateless pipeline has to)"""
+    series = pd.Series(values)
+
+    start = time.perf_counter()
+    hampel = HampelFilter(['x'], window=window)
+    streamed = np.array([hampel.update((x,))[0] for x in values])
+    stream_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    reference = hampel_pandas(series, window).to_numpy()
+    pandas_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    median_only = series.rolling(window, min_periods=1).median().to_numpy()
+    pandas_median_s = time.perf_counter() - start
+    rolling = RollingMedianMAD(window)
+    medians = []
+    for x in values:
+        rolling.add(x)
+        medians.append(rolling.median())
+
+    ticks = min(tick_rows, len(values))
+    start = time.perf_counter()
+    for end in range(window, window + ticks):
+        hampel_pandas(series.iloc[max(0, end - window):end], window).iloc[-1]
+    pandas_tick_s = (time.perf_counter() - start) / ticks
+
+    return {
+        "samples": len(values),
+        "window": window,
+        "stream_us_per_sample": round(stream_s / len(values) * 1e6, 2),
+        "pandas_hampel_us_per_sample": round(pandas_s / len(values) * 1e6, 2),
+        "pandas_median_only_us_per_sample": round(pandas_median_s / len(values) * 1e6, 3),
+        "pandas_per_tick_us": round(pandas_tick_s * 1e6, 1),
+        "per_tick_speedup": round(pandas_tick_s / (stream_s / len(values)), 1),
+        "matches_pandas": bool(np.allclose(streamed, reference, equal_nan=True)),
+        "median_matches_pandas": bool(np.allclose(medians, median_only)),
+        "replaced": hampel.replaced['x']
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the streaming Hampel filter against pandas rolling windows')
+    parser.add_argument('--window', type=int, default=7, help='Rolling window in rows')
+    parser.add_argument('--sensor', default='main_comp', help='Sensor column of the process time series')
+    parser.add_argument('--samples', type=int, default=200000, help='Rows to filter')
+    parser.add_argument('--data-dir', default=None, help='Directory with per-product process time series')
+    parser.add_argument('--synthetic', action='store_true', help='Use a synthetic spiky series instead of the process data')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    if args.synthetic:
+        rng = np.random.default_rng(0)
+        values = 4.3 + rng.normal(0, 0.05, args.samples)
+        spikes = rng.random(args.samples) < 0.005
+        values[spikes] += rng.choice([-2.0, 2.0], spikes.sum())
+    else:
+        from training_data import load_process_time_series
+        values = load_process_time_series(args.data_dir)[args.sensor].to_numpy(dtype=np.float64)[:args.samples]
+
+    print(json.dumps(benchmark(values, window=args.window), indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+"""
+Sensor Record Decoder for PharmaCopilot
+Decodes sensor API records with a decoder compiled once from the sensor schema (API key, default and
+dtype): a batch of JSON records becomes one value matrix plus a missing-value mask, filled a column at
+a time by numpy, instead of a Python loop over the sensors of every record
+"""
+
+import argparse
+import json
+import logging
+import math
+import time
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+def to_float(value: Any) -> float:
+    """A record value as float, NaN when missing or not a number"""
+    try:
+        return float(value) if value is not None else math.nan
+    except (TypeError, ValueError):
+        return math.nan
+
+class SensorRecordDecoder:
+    """Decoder of sensor API records into rows of `sensors`.
+
+    Each sensor is read from its API key (`mapping`, default the sensor name); a value that is missing,
+    null, NaN or not a number is replaced by the sensor's default (`defaults`, else 0.0) and flagged
+    in the missing-value mask. The keys, defaults and dtype are resolved once, here.
+    """
+
+    def __init__(self, sensors: Sequence[str], mapping: Optional[Mapping[str, str]] = None,
+                 defaults: Optional[Mapping[str, float]] = None, dtype: Any = np.float32):
+        mapping, defaults = mapping or {}, defaults or {}
+        self.sensors = list(sensors)
+        self.keys = [mapping.get(sensor, sensor) for sensor in self.sensors]
+        self.dtype = np.dtype(dtype)
+        self.defaults = np.array([float(defaults.get(sensor, 0.0)) for sensor in self.sensors], dtype=self.dtype)
+        self._fields = list(zip(self.sensors, self.keys, [float(defaults.get(sensor, 0.0)) for sensor in self.sensors]))
+
+    def decode(self, records: Sequence[Dict[str, Any]]) -> Tuple[np.ndarray, np.ndarray]:
+        """(values, missing): a (records, sensors) matrix in the decoder's dtype with the defaults filled
+        in, and the mask of the values that were defaulted"""
+        values = np.empty((len(records), len(self.keys)), dtype=self.dtype)
+        for column, key in enumerate(self.keys):
+            raw = [record.get(key) for record in records]
+            try:
+                # numpy converts the whole column at once; None becomes NaN
+                values[:, column] = raw
+            except (TypeError, ValueError):
+                values[:, column] = [to_float(value) for value in raw]
+        missing = np.isnan(values)
+        if missing.any():
+            np.copyto(values, self.defaults, where=missing)
+        return values, missing
+
+    def decode_record(self, record: Dict[str, Any]) -> Tuple[List[float], List[str]]:
+        """One record as a row of Python floats (full precision, whatever the dtype) and the names of
+        the sensors that were defaulted"""
+        values, missing = [], []
+        for sensor, key, default in self._fields:
+            value = record.get(key)
+            if value is not None:
+                try:
+                    value = float(value)
+                except (TypeError, ValueError):
+                    value = None
+            if value is None or value != value:
+                value = default
+                missing.append(sensor)
+            values.append(value)
+        return values, missing
+
+def decode_loop(records: Sequence[Dict[str, Any]], sensors: Sequence[str], mapping: Mapping[str, str],
+                defaults: Mapping[str, float]) -> List[List[float]]:
+    """Reference implementation: the per-record, per-sensor loop the API used before"""
+    rows = []
+    for record in records:
+        values = []
+        for sensor in sensors:
+            value = record.get(mapping.get(sensor, sensor))
+            if value is None:
+                value = dict(defaults).get(sensor, 0.0)
+            values.append(float(value))
+        rows.append(values)
+    return rows
+
+def synthetic_records(n: int, sensors: Sequence[str], missing_fraction: float = 0.01, seed: int = 0) -> List[Dict[str, Any]]:
+    """Records shaped like the sensor API's: the sensors plus timestamp and batch context, with some
+    sensors left out or null"""
+    rng = np.random.default_rng(seed)
+    values = rng.normal(100.0, 10.0, (n, len(sensors))).round(3)
+    dropped = rng.random((n, len(sensors))) < missing_fraction
+    records = []
+    for i in range(n):
+        record = {"timestamp": f"2024-01-01T00:{i // 6 % 60:02d}:{i % 6 * 10:02d}", "campaign": 1, "batch": 1, "code": 25}
+        for j, sensor in enumerate(sensors):
+            if not dropped[i, j]:
+                record[sensor] = float(values[i, j])
+            elif i % 2:
+                record[sensor] = None
+        records.append(record)
+    return records
+
+def benchmark(records: List[Dict[str, Any]], sensors: Sequence[str], mapping: Mapping[str, str],
+              defaults: Mapping[str, float], repeat: int = 20) -> Dict[str, Any]:
+    """The compiled decoder against the per-record loop on the same records, best of `repeat` runs"""
+    def best(function) -> float:
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            function()
+            timings.append(time.perf_counter() - start)
+        return min(timings)
+
+    decoder32 = SensorRecordDecoder(sensors, mapping, defaults)
+    decoder64 = SensorRecordDecoder(sensors, mapping, defaults, dtype=np.float64)
+    loop_s = best(lambda: decode_loop(records, sensors, mapping, defaults))
+    loop_array_s = best(lambda: np.array(decode_loop(records, sensors, mapping, defaults), dtype=np.float32))
+    decode32_s = best(lambda: decoder32.decode(records))
+    decode64_s = best(lambda: decoder64.decode(records))
+    record_s = best(lambda: [decoder64.decode_record(record) for record in records])
+
+    n = len(records)
+    reference = np.array(decode_loop(records, sensors, mapping, defaults))
+    values, missing = decoder64.decode(records)
+    return {
+        "records": n,
+        "sensors": len(sensors),
+        "missing_values": int(missing.sum()),
+        "loop_us_per_record": round(loop_s / n * 1e6, 3),
+        "loop_to_float32_us_per_record": round(loop_array_s / n * 1e6, 3),
+        "decode_float32_us_per_record": round(decode32_s / n * 1e6, 3),
+        "decode_float64_us_per_record": round(decode64_s / n * 1e6, 3),
+        "decode_record_us_per_record": round(record_s / n * 1e6, 3),
+        "speedup_float32": round(loop_array_s / decode32_s, 2),
+        "matches_loop": bool(np.array_equal(values, reference, equal_nan=True)),
+        "float32_max_abs_error": float(np.abs(decoder32.decode(records)[0] - reference).max()) if n else 0.0
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the compiled sensor record decoder against the per-record loop')
+    parser.add_argument('--records', type=int, default=1000, help='Records per decoded batch')
+    parser.add_argument('--missing', type=float, default=0.01, help='Fraction of missing / null sensor values (synthetic records)')
+    parser.add_argument('--repeat', type=int, default=20, help='Timed runs, the best one is reported')
+    parser.add_argument('--data-dir', default=None, help='Directory with per-product process time series')
+    parser.add_argument('--synthetic', action='store_true', help='Use synthetic records instead of the process data')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    from prediction_api import default_sensor_values, selected_sensors, sensor_mapping
+    if args.synthetic:
+        records = synthetic_records(args.records, [sensor_mapping.get(s, s) for s in selected_sensors], args.missing)
+    else:
+        from training_data import load_process_time_series
+        df = load_process_time_series(args.data_dir).head(args.records)
+        # As the sensor API serves them: JSON numbers, null for missing values
+        records = json.loads(df.to_json(orient='records', date_format='iso'))
+
+    print(json.dumps(benchmark(records, selected_sensors, sensor_mapping, default_sensor_values, args.repeat), indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""
+Sensor Ingester for PharmaCopilot
+Single process that polls the sensor API, runs the per-tick model pipeline and publishes the sensor
+buffers and results to shared memory, so the API can scale out over stateless worker processes.
+
+Usage:
+    python sensor_ingester.py --interval 10 --min-interval 2.5
+    SENSOR_STATE_MODE=worker uvicorn prediction_api:app --host 0.0.0.0 --port 8000 --workers 4
+"""
+
+import argparse
+import logging
+import os
+import signal
+import time
+
+# Must be set before prediction_api reads its configuration
+os.environ['SENSOR_STATE_MODE'] = 'ingester'
+
+import prediction_api as api
+from adaptive_polling import AdaptivePollInterval
+
+logger = logging.getLogger(__name__)
+
+def main():
+    parser = argparse.ArgumentParser(description='Poll the sensor API and publish the buffers to shared memory')
+    parser.add_argument('--interval', type=float, default=api.SENSOR_POLL_INTERVAL, help='Base seconds between sensor polls')
+    parser.add_argument('--min-interval', type=float, default=api.SENSOR_POLL_MIN_INTERVAL,
+                        help='Shortest poll interval while readings keep changing')
+    parser.add_argument('--max-backoff', type=float, default=api.SENSOR_POLL_MAX_BACKOFF,
+                        help='Longest wait between polls while the sensor API is down')
+    args = parser.parse_args()
+
+    api.load_models()
+    api.restore_buffer_snapshot()
+    api.open_sensor_log()
+    api.open_prediction_audit()
+    api.register_model_slots()
+    if api.MODEL_REGISTRY_POLL_SECONDS > 0 and api.model_registry.slots:
+        api.model_registry.start()
+
+    api.open_shared_state()
+    stopping = []
+    signal.signal(signal.SIGTERM, lambda *_: stopping.append(True))
+
+    try:
+        # Warm the buffer so workers can forecast right away
+        try:
+            api.supplement_buffer_with_historical_data()
+        except Exception as e:
+            logger.warning(f"Could not supplement buffer at startup: {e}")
+        api.publish_shared_state(api.latest_pipeline_snapshot)
+
+        poller = AdaptivePollInterval(base=args.interval, minimum=args.min_interval, maximum=args.max_backoff)
+        api.sensor_poller = poller
+        logger.info(f"Sensor ingester running, polling every {args.interval}s (adaptive)")
+        while not stopping:
+            start = time.monotonic()
+            delay = poller.next_delay(api.fetch_current_sensor_data())
+            time.sleep(max(0.0, delay - (time.monotonic() - start)))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        logger.info("Shutting down sensor ingester...")
+        api.model_registry.stop()
+        api.inference_executor.shutdown()
+        api.shared_state.close()
+        if api.buffer_snapshot is not None:
+            api.buffer_snapshot.close()
+        api.close_sensor_log()
+        api.close_prediction_audit()
+
+if __name__ == '__main__':
+    main()
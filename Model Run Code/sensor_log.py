@@ -0,0 +1,366 @@
+"""
+Sensor Log for PharmaCopilot
+Append-only on-disk history of every sensor reading as it was ingested, so the data behind any past
+prediction can be read back and replayed. Rows go into memory-mapped, preallocated segment files laid
+out by column (a float64 timestamp index, then one float64 block per field); a segment is sealed when it
+is full, when the UTC day changes or when the source clock goes back, so timestamps inside a segment
+are sorted. Values are kept at full precision so a replay sees exactly what the live pipeline saw.
+
+Reads map the overlapping segments read-only and binary-search the timestamp index, touching only
+the pages of the requested range. A segment's row count is written after its row, so a reader (or
+a restart after a crash) never sees a half-written row.
+"""
+
+import json
+import logging
+import math
+import os
+import re
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+MAGIC = 0x50434c4f47303031  # 'PCLOG001'
+LAYOUT_VERSION = 2
+# Column block dtype per layout version (version 1 segments stored float32 and only the sensor columns;
+# they stay readable, with the fields they lack read as missing)
+VALUE_DTYPES = {1: np.float32, 2: np.float64}
+HEADER_SLOTS = 8
+_MAGIC, _VERSION, _N_COLUMNS, _CAPACITY, _COUNT, _CREATED_NS = range(6)
+COLUMNS_BYTES = 512  # JSON list of the column names
+DATA_OFFSET = HEADER_SLOTS * 8 + COLUMNS_BYTES
+
+SEGMENT_PATTERN = re.compile(r'^segment-(\d{8})-(\d{6})\.log$')
+
+def utc_day(timestamp: float) -> str:
+    return datetime.fromtimestamp(timestamp, tz=timezone.utc).strftime('%Y%m%d')
+
+def to_list(values: np.ndarray) -> List[Optional[float]]:
+    """JSON-safe list: missing values (NaN) and empty aggregates (inf) become None"""
+    return [x if math.isfinite(x) else None for x in np.asarray(values, dtype=np.float64).tolist()]
+
+def segment_size(capacity: int, n_columns: int, version: int = LAYOUT_VERSION) -> int:
+    return DATA_OFFSET + capacity * 8 + n_columns * capacity * np.dtype(VALUE_DTYPES[version]).itemsize
+
+class Segment:
+    """One segment file mapped with numpy: header, timestamp index and column blocks"""
+
+    def __init__(self, path: str, mode: str = 'r'):
+        self.path = path
+        header = np.fromfile(path, dtype=np.int64, count=HEADER_SLOTS)
+        if len(header) < HEADER_SLOTS or header[_MAGIC] != MAGIC or int(header[_VERSION]) not in VALUE_DTYPES:
+            raise ValueError(f"{path} is not a sensor log segment")
+        self.version = int(header[_VERSION])
+        self.capacity = int(header[_CAPACITY])
+        n_columns = int(header[_N_COLUMNS])
+        with open(path, 'rb') as f:
+            f.seek(HEADER_SLOTS * 8)
+            self.columns = json.loads(f.read(COLUMNS_BYTES).rstrip(b'\0').decode())
+
+        self._map = np.memmap(path, dtype=np.uint8, mode=mode,
+                              shape=(segment_size(self.capacity, n_columns, self.version),))
+        self.header = np.ndarray((HEADER_SLOTS,), dtype=np.int64, buffer=self._map)
+        self.timestamps = np.ndarray((self.capacity,), dtype=np.float64, buffer=self._map, offset=DATA_OFFSET)
+        self.values = np.ndarray((n_columns, self.capacity), dtype=VALUE_DTYPES[self.version], buffer=self._map,
+                                 offset=DATA_OFFSET + self.capacity * 8)
+
+    @classmethod
+    def create(cls, path: str, columns: Sequence[str], capacity: int) -> 'Segment':
+        encoded = json.dumps(list(columns)).encode()
+        if len(encoded) > COLUMNS_BYTES:
+            raise ValueError("Too many / too long column names for a sensor log segment")
+        # Preallocated as a sparse file; pages are only backed once rows reach them
+        with open(path, 'wb') as f:
+            f.truncate(segment_size(capacity, len(columns)))
+            f.seek(HEADER_SLOTS * 8)
+            f.write(encoded)
+        header = np.memmap(path, dtype=np.int64, mode='r+', shape=(HEADER_SLOTS,))
+        header[_N_COLUMNS] = len(columns)
+        header[_CAPACITY] = capacity
+        header[_CREATED_NS] = time.time_ns()
+        header[_VERSION] = LAYOUT_VERSION
+        # Written last, readers skip files without it
+        header[_MAGIC] = MAGIC
+        header.flush()
+        del header
+        return cls(path, mode='r+')
+
+    @property
+    def count(self) -> int:
+        return int(self.header[_COUNT])
+
+    @property
+    def full(self) -> bool:
+        return self.count >= self.capacity
+
+    def time_range(self) -> Optional[Tuple[float, float]]:
+        n = self.count
+        return (float(self.timestamps[0]), float(self.timestamps[n - 1])) if n else None
+
+    def append(self, timestamp: float, values: Sequence[float]):
+        n = self.count
+        self.timestamps[n] = timestamp
+        self.values[:, n] = values
+        # Publish the row only once it is complete
+        self.header[_COUNT] = n + 1
+
+    def slice(self, start: Optional[float], end: Optional[float]) -> Tuple[int, int]:
+        """Row range [lo, hi) with start <= timestamp <= end"""
+        n = self.count
+        index = self.timestamps[:n]
+        lo = int(np.searchsorted(index, start, side='left')) if start is not None else 0
+        hi = int(np.searchsorted(index, end, side='right')) if end is not None else n
+        return lo, max(lo, hi)
+
+    def block(self, columns: Sequence[str], lo: int, hi: int) -> np.ndarray:
+        """float64 copy of rows [lo, hi) of `columns`, NaN for the columns this segment does not store"""
+        if all(name in self.columns for name in columns):
+            return self.values[[self.columns.index(name) for name in columns], lo:hi].astype(np.float64)
+        block = np.full((len(columns), hi - lo), np.nan)
+        for k, name in enumerate(columns):
+            if name in self.columns:
+                block[k] = self.values[self.columns.index(name), lo:hi]
+        return block
+
+    def flush(self):
+        self._map.flush()
+
+    def close(self):
+        if self._map.flags.writeable:
+            self.flush()
+        # Unmapped once the views are gone
+        del self.header, self.timestamps, self.values, self._map
+
+class SensorLog:
+    """Segmented columnar log of sensor readings in `directory`.
+
+    The writer keeps the active segment mapped read-write; queries (also from worker processes,
+    with `read_only=True`) map each overlapping segment read-only for the duration of the call.
+    """
+
+    def __init__(self, directory: str, columns: Sequence[str], segment_rows: int = 16384, read_only: bool = False):
+        self.directory = directory
+        self.columns = list(columns)
+        self.segment_rows = segment_rows
+        self.read_only = read_only
+        self.active: Optional[Segment] = None
+        self.appended = 0
+        self.rotations = 0
+        if not read_only:
+            os.makedirs(directory, exist_ok=True)
+            self._resume()
+
+    def segment_paths(self) -> List[str]:
+        if not os.path.isdir(self.directory):
+            return []
+        # In creation order (the day in the name is that of the first row, which a replay can move back)
+        names = sorted((name for name in os.listdir(self.directory) if SEGMENT_PATTERN.match(name)),
+                       key=lambda name: int(SEGMENT_PATTERN.match(name).group(2)))
+        return [os.path.join(self.directory, name) for name in names]
+
+    def _resume(self):
+        """Continue the newest segment after a restart if it has room, the same columns and the current layout"""
+        paths = self.segment_paths()
+        if not paths:
+            return
+        try:
+            segment = Segment(paths[-1], mode='r+')
+        except (ValueError, OSError) as e:
+            logger.warning(f"Not resuming sensor log segment {paths[-1]}: {e}")
+            return
+        if segment.columns != self.columns or segment.full or segment.version != LAYOUT_VERSION:
+            segment.close()
+            return
+        self.active = segment
+        logger.info(f"Resuming sensor log segment {segment.path} at row {segment.count}")
+
+    def _next_path(self, timestamp: float) -> str:
+        sequences = [int(SEGMENT_PATTERN.match(os.path.basename(p)).group(2)) for p in self.segment_paths()]
+        sequence = max(sequences, default=0) + 1
+        return os.path.join(self.directory, f"segment-{utc_day(timestamp)}-{sequence:06d}.log")
+
+    def _needs_rotation(self, timestamp: float) -> bool:
+        segment = self.active
+        if segment is None or segment.full:
+            return True
+        span = segment.time_range()
+        # New UTC day, or the source clock went back (timestamps must stay sorted within a segment)
+        return span is not None and (utc_day(timestamp) != utc_day(span[0]) or timestamp < span[1])
+
+    def append(self, timestamp: float, values: Sequence[float]):
+        """Append one row (values in `columns` order)"""
+        if self.read_only:
+            raise RuntimeError("Sensor log opened read-only")
+        if self._needs_rotation(timestamp):
+            if self.active is not None:
+                self.active.close()
+                self.rotations += 1
+            self.active = Segment.create(self._next_path(timestamp), self.columns, self.segment_rows)
+            logger.info(f"Started sensor log segment {self.active.path}")
+        self.active.append(timestamp, values)
+        self.appended += 1
+
+    def close(self):
+        if self.active is not None:
+            self.active.close()
+            self.active = None
+
+    def _overlapping(self, start: Optional[float], end: Optional[float], columns: Sequence[str]):
+        """Read-only segments (in creation order) with rows in [start, end] and any of `columns`, with
+        their row ranges"""
+        for path in self.segment_paths():
+            try:
+                segment = Segment(path, mode='r')
+            except (ValueError, OSError) as e:
+                logger.warning(f"Skipping sensor log segment {path}: {e}")
+                continue
+            if not any(name in segment.columns for name in columns):
+                continue
+            span = segment.time_range()
+            if span is None or (start is not None and span[1] < start) or (end is not None and span[0] > end):
+                continue
+            lo, hi = segment.slice(start, end)
+            if hi > lo:
+                yield segment, lo, hi
+
+    def _column_names(self, columns: Optional[Sequence[str]]) -> List[str]:
+        for name in columns or []:
+            if name not in self.columns:
+                raise ValueError(f"Unknown sensor log column: {name}")
+        return list(columns) if columns else list(self.columns)
+
+    @staticmethod
+    def _time_groups(parts: List[Tuple[Segment, int, int]]) -> List[List[Tuple[Segment, int, int]]]:
+        """Segment ranges grouped by overlapping time span, groups in time order, creation order within a
+        group (only the segments of a replayed period overlap, and only those need merging)"""
+        spans = sorted(range(len(parts)), key=lambda k: float(parts[k][0].timestamps[parts[k][1]]))
+        groups, group_end = [], None
+        for k in spans:
+            segment, lo, hi = parts[k]
+            first, last = float(segment.timestamps[lo]), float(segment.timestamps[hi - 1])
+            if groups and first <= group_end:
+                groups[-1].append(k)
+                group_end = max(group_end, last)
+            else:
+                groups.append([k])
+                group_end = last
+        return [[parts[k] for k in sorted(group)] for group in groups]
+
+    def read(self, start: Optional[float] = None, end: Optional[float] = None,
+             columns: Optional[Sequence[str]] = None, limit: Optional[int] = None,
+             sort: bool = True) -> Dict[str, np.ndarray]:
+        """Rows with start <= timestamp <= end sorted by time ("timestamp" plus one array per column);
+        with `limit`, the newest `limit` rows. With sort=False rows stay in the order they were
+        appended, late readings included where they arrived (what a replay has to feed).
+
+        Rows are sorted within a segment, so only the rows that are returned are copied: with `limit`
+        the segments are walked newest first and only their last rows sliced, and only segments whose
+        time spans overlap are merge-sorted.
+        """
+        names = self._column_names(columns)
+        parts = list(self._overlapping(start, end, names))
+        # Newest first: the last segment of the append order, or the last group in time
+        groups = [[part] for part in parts] if not sort else self._time_groups(parts)
+        remaining = limit if limit is not None else sum(hi - lo for _, lo, hi in parts)
+        times, blocks = [], []
+        for group in reversed(groups):
+            if remaining <= 0:
+                break
+            # The newest `remaining` rows of a group are among the last `remaining` of each of its segments
+            group = [(segment, max(lo, hi - remaining), hi) for segment, lo, hi in group]
+            ts = np.concatenate([segment.timestamps[lo:hi] for segment, lo, hi in group])
+            block = np.concatenate([segment.block(names, lo, hi) for segment, lo, hi in group], axis=1)
+            if len(group) > 1:
+                order = np.argsort(ts, kind='stable')[-remaining:]
+                ts, block = ts[order], block[:, order]
+            times.append(ts)
+            blocks.append(block)
+            remaining -= len(ts)
+        timestamps = np.concatenate(times[::-1]) if times else np.empty(0)
+        values = np.concatenate(blocks[::-1], axis=1) if blocks else np.empty((len(names), 0))
+        return {"timestamp": timestamps, **{name: values[k] for k, name in enumerate(names)}}
+
+    def aggregate(self, start: Optional[float] = None, end: Optional[float] = None,
+                  bucket_seconds: Optional[float] = None, columns: Optional[Sequence[str]] = None) -> Dict[str, Any]:
+        """count / mean / min / max per column over the range, or per `bucket_seconds` bucket.
+
+        Each segment is reduced on its mapped slice and only the per-bucket partials are combined,
+        so memory grows with the number of buckets, not with the range. Missing values (NaN) are
+        left out of a column's mean / min / max; `count` is the number of rows.
+        """
+        names = self._column_names(columns)
+        keys, counts, valid_counts, sums, lows, highs = [], [], [], [], [], []
+        for segment, lo, hi in self._overlapping(start, end, names):
+            ts = segment.timestamps[lo:hi]
+            block = segment.block(names, lo, hi)
+            valid = ~np.isnan(block)
+            filled = np.where(valid, block, 0.0)
+            if bucket_seconds:
+                bucket = np.floor(ts / bucket_seconds).astype(np.int64)
+                # Sorted within a segment, so buckets are contiguous runs
+                starts = np.flatnonzero(np.r_[True, bucket[1:] != bucket[:-1]])
+                keys.append(bucket[starts])
+                counts.append(np.diff(np.r_[starts, len(bucket)]))
+                valid_counts.append(np.add.reduceat(valid, starts, axis=1))
+                sums.append(np.add.reduceat(filled, starts, axis=1))
+                # fmin / fmax skip NaN
+                lows.append(np.fmin.reduceat(block, starts, axis=1))
+                highs.append(np.fmax.reduceat(block, starts, axis=1))
+            else:
+                keys.append(np.zeros(1, dtype=np.int64))
+                counts.append(np.array([hi - lo]))
+                valid_counts.append(valid.sum(axis=1, keepdims=True))
+                sums.append(filled.sum(axis=1, keepdims=True))
+                lows.append(np.fmin.reduce(block, axis=1, keepdims=True))
+                highs.append(np.fmax.reduce(block, axis=1, keepdims=True))
+
+        if not keys:
+            return {"rows": 0, "buckets": 0, "timestamps": [], "count": [],
+                    "columns": {name: {"mean": [], "min": [], "max": []} for name in names}}
+
+        # Combine partials of the same bucket from different segments
+        key = np.concatenate(keys)
+        unique, inverse = np.unique(key, return_inverse=True)
+        count = np.bincount(inverse, weights=np.concatenate(counts)).astype(np.int64)
+        total = np.zeros((len(names), len(unique)))
+        valid = np.zeros((len(names), len(unique)))
+        low = np.full((len(names), len(unique)), np.inf)
+        high = np.full((len(names), len(unique)), -np.inf)
+        np.add.at(total.T, inverse, np.concatenate(sums, axis=1).T)
+        np.add.at(valid.T, inverse, np.concatenate(valid_counts, axis=1).T)
+        np.fmin.at(low.T, inverse, np.concatenate(lows, axis=1).T)
+        np.fmax.at(high.T, inverse, np.concatenate(highs, axis=1).T)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = total / valid
+
+        if bucket_seconds:
+            timestamps = [datetime.fromtimestamp(k * bucket_seconds).isoformat() for k in unique.tolist()]
+        else:
+            timestamps = [None]
+        return {
+            "rows": int(count.sum()),
+            "buckets": len(unique),
+            "timestamps": timestamps,
+            "count": count.tolist(),
+            "columns": {name: {"mean": to_list(mean[k]), "min": to_list(low[k]), "max": to_list(high[k])}
+                        for k, name in enumerate(names)}
+        }
+
+    def get_stats(self) -> Dict[str, Any]:
+        paths = self.segment_paths()
+        active = self.active
+        return {
+            "directory": os.path.abspath(self.directory),
+            "segments": len(paths),
+            "disk_mb": round(sum(os.stat(p).st_blocks * 512 for p in paths) / 2 ** 20, 2),
+            "segment_rows": self.segment_rows,
+            "active_segment": os.path.basename(active.path) if active is not None else None,
+            "active_rows": active.count if active is not None else None,
+            "appended": self.appended,
+            "rotations": self.rotations,
+            "read_only": self.read_only
+        }
@@ -0,0 +1,156 @@
+"""
+Sensor Resampler for PharmaCopilot
+Keys incoming readings by their source timestamp and resamples them onto the fixed cadence the LSTM
+was trained on, interpolating short gaps, dropping duplicates and late rows, and flagging sparse windows
+"""
+
+import logging
+from collections import deque
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Row provenance in the window: a grid point is observed when a reading arrived within half a cadence of it
+OBSERVED, INTERPOLATED = 0, 1
+
+def parse_source_timestamp(value) -> Optional[float]:
+    """Epoch seconds of a reading's timestamp (ISO string, datetime or number), None if unusable"""
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, datetime):
+        return value.timestamp()
+    try:
+        return datetime.fromisoformat(str(value)).timestamp()
+    except ValueError:
+        parsed = pd.to_datetime(value, errors='coerce')
+        return None if pd.isna(parsed) else parsed.timestamp()
+
+class TimestampResampler:
+    """Turns irregular readings into rows on a fixed grid (anchor + k * cadence).
+
+    Every call to `add` emits the grid points passed since the previous reading, linearly
+    interpolated between the two readings in one vectorized step. A gap longer than
+    `max_gap_seconds` is not bridged: the grid restarts at the new reading and the window
+    records a break. Readings with an already seen timestamp are dropped; readings from the
+    past are dropped too, unless they jump back further than `max_gap_seconds` (the source
+    restarted or moved to another batch), which restarts the grid.
+    """
+
+    def __init__(self, n_sensors: int, cadence_seconds: float = 10.0, max_gap_seconds: float = 60.0,
+                 window: int = 60, sparse_fraction: float = 0.2):
+        self.n_sensors = n_sensors
+        self.cadence = float(cadence_seconds)
+        self.max_gap = float(max_gap_seconds)
+        self.sparse_fraction = sparse_fraction
+        # Provenance of the last `window` emitted rows and whether a break preceded each
+        self._provenance = deque(maxlen=window)
+        self._breaks = deque(maxlen=window)
+        self._last_time: Optional[float] = None
+        self._last_values: Optional[np.ndarray] = None
+        self._next_grid: Optional[float] = None
+        # Whether the last reading was taken and sits on the grid: a resampler started at that reading
+        # continues with the same grid and state (replays start there)
+        self.aligned = False
+        self.counts = {"readings": 0, "emitted": 0, "interpolated": 0, "duplicates": 0, "late": 0,
+                       "gap_breaks": 0, "missing_slots": 0, "restarts": 0}
+
+    def reset(self):
+        """Forget the grid and the emitted rows, the next reading starts a new grid"""
+        self._provenance.clear()
+        self._breaks.clear()
+        self._last_time = self._last_values = self._next_grid = None
+        self.aligned = False
+        for key in self.counts:
+            self.counts[key] = 0
+
+    def _restart(self, timestamp: float, values: np.ndarray) -> List[Tuple[float, List[float]]]:
+        self._last_time = timestamp
+        self._last_values = values
+        self._next_grid = timestamp + self.cadence
+        self.aligned = True
+        self._emit([OBSERVED], broken=True)
+        return [(timestamp, values.tolist())]
+
+    def _emit(self, provenance: Sequence[int], broken: bool = False):
+        for i, row in enumerate(provenance):
+            self._provenance.append(row)
+            self._breaks.append(broken and i == 0)
+        self.counts["emitted"] += len(provenance)
+        self.counts["interpolated"] += sum(provenance)
+
+    def add(self, timestamp: float, values: Sequence[float]) -> List[Tuple[float, List[float]]]:
+        """Feed one reading, returns the (grid time, values) rows that are now complete"""
+        values = np.asarray(values, dtype=np.float64)
+        self.counts["readings"] += 1
+        self.aligned = False
+
+        if self._last_time is None:
+            return self._restart(timestamp, values)
+
+        elapsed = timestamp - self._last_time
+        if elapsed == 0:
+            self.counts["duplicates"] += 1
+            return []
+        if elapsed < 0:
+            if -elapsed <= self.max_gap:
+                self.counts["late"] += 1
+                return []
+            self.counts["restarts"] += 1
+            logger.info(f"Sensor timestamps jumped back {-elapsed:.0f}s, restarting the resampling grid")
+            return self._restart(timestamp, values)
+        if elapsed > self.max_gap:
+            missing = int((timestamp - self._next_grid) // self.cadence) + 1
+            self.counts["gap_breaks"] += 1
+            self.counts["missing_slots"] += max(0, missing)
+            logger.warning(f"{elapsed:.0f}s gap in sensor readings ({missing} slots), not interpolated")
+            return self._restart(timestamp, values)
+
+        if timestamp < self._next_grid:
+            # Between two grid points: only remembered as the left end of the next interpolation
+            self._last_time, self._last_values = timestamp, values
+            return []
+
+        # Slot count from the offset, so epoch-sized timestamps don't lose the last slot to rounding
+        slots = int((timestamp - self._next_grid) / self.cadence + 1e-6) + 1
+        grid = self._next_grid + self.cadence * np.arange(slots)
+        weights = ((grid - self._last_time) / elapsed)[:, None]
+        rows = self._last_values + weights * (values - self._last_values)
+
+        if abs(grid[-1] - timestamp) < 1e-3:
+            rows[-1] = values
+        # Only an exact match: a grid restarted at the reading must produce the same row times
+        self.aligned = bool(grid[-1] == timestamp)
+        # Jittered arrivals still observe the grid point next to them; only slots no reading came
+        # near count as interpolated
+        half = self.cadence / 2
+        observed = (grid - self._last_time <= half) | (timestamp - grid <= half)
+        self._emit(np.where(observed, OBSERVED, INTERPOLATED).tolist())
+
+        self._last_time, self._last_values = timestamp, values
+        self._next_grid = grid[-1] + self.cadence
+        return list(zip(grid.tolist(), rows.tolist()))
+
+    def window_quality(self, length: Optional[int] = None) -> Dict[str, Any]:
+        """Share of rows without a reading within half a cadence, and breaks, among the last `length` emitted rows"""
+        provenance = list(self._provenance)[-length:] if length else list(self._provenance)
+        breaks = list(self._breaks)[-len(provenance):] if provenance else []
+        interpolated = sum(provenance)
+        # A break at the oldest row only marks where the window starts
+        inner_breaks = sum(breaks[1:])
+        fraction = interpolated / len(provenance) if provenance else 0.0
+        return {
+            "rows": len(provenance),
+            "interpolated_fraction": round(fraction, 4),
+            "gap_breaks": inner_breaks,
+            "sparse": fraction > self.sparse_fraction or inner_breaks > 0
+        }
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {"cadence_seconds": self.cadence, "max_gap_seconds": self.max_gap, **self.counts,
+                "last_source_time": datetime.fromtimestamp(self._last_time).isoformat() if self._last_time else None}
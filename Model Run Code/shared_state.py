@@ -0,0 +1,309 @@
+"""
+Shared Sensor State for PharmaCopilot
+Single-writer shared-memory segment holding the sensor ring buffers, the latest pipeline snapshot and
+the sensor history pyramid, so one ingester process can feed any number of uvicorn worker processes.
+
+Readers and the writer use a sequence-number protocol (seqlock): the writer makes the sequence odd,
+writes, then makes it even again; a reader retries whenever the sequence was odd or changed while it
+copied. Readers map the segment directly and never take a lock, so read throughput scales with cores.
+"""
+
+import json
+import logging
+import time
+from multiprocessing import resource_tracker, shared_memory
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SHARED_STATE_NAME = 'pharmacopilot_sensor_state'
+
+MAGIC = 0x5043535441544531  # 'PCSTATE1'
+LAYOUT_VERSION = 1
+HEADER_SLOTS = 16
+
+# Header slots (int64)
+_MAGIC, _VERSION, _SEQ, _CAPACITY, _N_SENSORS, _SNAPSHOT_BYTES = range(6)
+_RAW_COUNT, _PROCESSED_COUNT, _SNAPSHOT_LEN, _SNAPSHOT_SEQ, _WRITES, _UPDATED_NS = range(6, 12)
+_BATCH, _CODE = range(12, 14)  # running batch and product code, 0 when unknown
+# History pyramid state (float64 values, see HistoryPyramid.to_array); 0 in segments without the region
+_HISTORY_BYTES, _HISTORY_LEN = range(14, 16)
+
+DEFAULT_SNAPSHOT_BYTES = 1 << 20
+
+class SharedStateBusy(RuntimeError):
+    """A consistent read could not be taken because the writer kept updating"""
+
+class SensorStateBuffer:
+    """Ring buffers (raw and processed, oldest row first), the pipeline snapshot as JSON and optionally
+    the history pyramid, laid out over any writable buffer (a shared memory segment or a mapped file)"""
+
+    def __init__(self, buf):
+        self.header = np.ndarray((HEADER_SLOTS,), dtype=np.int64, buffer=buf)
+        self.capacity = int(self.header[_CAPACITY])
+        self.n_sensors = int(self.header[_N_SENSORS])
+        self.snapshot_bytes = int(self.header[_SNAPSHOT_BYTES])
+        self.history_bytes = int(self.header[_HISTORY_BYTES])
+
+        offset = HEADER_SLOTS * 8
+        ring_shape = (self.capacity, self.n_sensors)
+        ring_bytes = self.capacity * self.n_sensors * 8
+        self.raw = np.ndarray(ring_shape, dtype=np.float64, buffer=buf, offset=offset)
+        self.processed = np.ndarray(ring_shape, dtype=np.float64, buffer=buf, offset=offset + ring_bytes)
+        self.snapshot = np.ndarray((self.snapshot_bytes,), dtype=np.uint8, buffer=buf,
+                                   offset=offset + 2 * ring_bytes)
+        self.history = np.ndarray((self.history_bytes // 8,), dtype=np.float64, buffer=buf,
+                                  offset=offset + 2 * ring_bytes + self.snapshot_bytes)
+
+    @staticmethod
+    def segment_size(capacity: int, n_sensors: int, snapshot_bytes: int, history_bytes: int = 0) -> int:
+        return HEADER_SLOTS * 8 + 2 * capacity * n_sensors * 8 + snapshot_bytes + history_bytes
+
+    @staticmethod
+    def initialize(buf, capacity: int, n_sensors: int, snapshot_bytes: int, history_bytes: int = 0):
+        """Write an empty header into a freshly allocated buffer"""
+        header = np.ndarray((HEADER_SLOTS,), dtype=np.int64, buffer=buf)
+        header[:] = 0
+        header[_CAPACITY] = capacity
+        header[_N_SENSORS] = n_sensors
+        header[_SNAPSHOT_BYTES] = snapshot_bytes
+        header[_HISTORY_BYTES] = history_bytes
+        header[_VERSION] = LAYOUT_VERSION
+        # Written last, readers refuse a buffer without it
+        header[_MAGIC] = MAGIC
+
+    @staticmethod
+    def has_layout(buf, capacity: Optional[int] = None, n_sensors: Optional[int] = None) -> bool:
+        """Whether the buffer holds this layout (and, if given, the expected ring shape)"""
+        if len(buf) < HEADER_SLOTS * 8:
+            return False
+        header = np.ndarray((HEADER_SLOTS,), dtype=np.int64, buffer=buf)
+        return (int(header[_MAGIC]) == MAGIC and int(header[_VERSION]) == LAYOUT_VERSION
+                and (capacity is None or int(header[_CAPACITY]) == capacity)
+                and (n_sensors is None or int(header[_N_SENSORS]) == n_sensors))
+
+    def _release_views(self):
+        # The underlying buffer can't be closed while numpy views on it exist
+        self.header = self.raw = self.processed = self.snapshot = self.history = None
+
+    # --- writer ---
+    def write(self, raw_rows, processed_rows, snapshot: Optional[Dict[str, Any]] = None,
+              batch: Optional[int] = None, code: Optional[int] = None, history: Optional[np.ndarray] = None):
+        """Publish the buffers, the running batch and, if given, a new pipeline snapshot and history
+        pyramid state (single writer only)"""
+        raw = np.asarray(list(raw_rows), dtype=np.float64).reshape(-1, self.n_sensors)[-self.capacity:]
+        processed = np.asarray(list(processed_rows), dtype=np.float64).reshape(-1, self.n_sensors)[-self.capacity:]
+        payload = None
+        if snapshot is not None:
+            payload = json.dumps(snapshot, default=float).encode()
+            if len(payload) > self.snapshot_bytes:
+                logger.error(f"Pipeline snapshot of {len(payload)} bytes exceeds the state buffer, not published")
+                payload = None
+        if history is not None and len(history) > len(self.history):
+            logger.error(f"History of {len(history)} values exceeds the state buffer ({len(self.history)}), not published")
+            history = None
+
+        header = self.header
+        header[_SEQ] += 1  # odd: write in progress
+        self.raw[:len(raw)] = raw
+        self.processed[:len(processed)] = processed
+        header[_RAW_COUNT] = len(raw)
+        header[_PROCESSED_COUNT] = len(processed)
+        header[_BATCH] = batch or 0
+        header[_CODE] = code or 0
+        if payload is not None:
+            self.snapshot[:len(payload)] = np.frombuffer(payload, dtype=np.uint8)
+            header[_SNAPSHOT_LEN] = len(payload)
+            header[_SNAPSHOT_SEQ] = snapshot.get('sequence', header[_SNAPSHOT_SEQ] + 1)
+        if history is not None:
+            self.history[:len(history)] = history
+            header[_HISTORY_LEN] = len(history)
+        header[_WRITES] += 1
+        header[_UPDATED_NS] = time.time_ns()
+        header[_SEQ] += 1  # even: consistent again
+
+    # --- readers ---
+    def _consistent(self, read: Callable[[], Any], retries: int = 1000):
+        header = self.header
+        for attempt in range(retries):
+            start_seq = int(header[_SEQ])
+            if start_seq & 1 == 0:
+                value = read()
+                if int(header[_SEQ]) == start_seq:
+                    return value
+            if attempt > 10:
+                time.sleep(0)
+        raise SharedStateBusy("Shared sensor state kept changing during read")
+
+    @property
+    def torn(self) -> bool:
+        """A write was interrupted (only possible if the writer died mid-write)"""
+        return int(self.header[_SEQ]) & 1 == 1
+
+    def repair_sequence(self):
+        """Make the sequence even again after an interrupted write so the next write follows the protocol"""
+        if self.torn:
+            self.header[_SEQ] += 1
+
+    @property
+    def retired(self) -> bool:
+        """The ingester closed or replaced this segment"""
+        return int(self.header[_MAGIC]) != MAGIC
+
+    def count(self, which: str) -> int:
+        return int(self.header[_RAW_COUNT if which == 'raw' else _PROCESSED_COUNT])
+
+    def read_rows(self, which: str) -> np.ndarray:
+        """Consistent copy of one ring, oldest row first"""
+        ring, slot = (self.raw, _RAW_COUNT) if which == 'raw' else (self.processed, _PROCESSED_COUNT)
+        return self._consistent(lambda: ring[:int(self.header[slot])].copy())
+
+    def snapshot_sequence(self) -> int:
+        return int(self.header[_SNAPSHOT_SEQ])
+
+    def read_snapshot(self) -> Tuple[int, Optional[Dict[str, Any]]]:
+        """(sequence, snapshot) of the latest published pipeline results"""
+        def read():
+            length = int(self.header[_SNAPSHOT_LEN])
+            return int(self.header[_SNAPSHOT_SEQ]), bytes(self.snapshot[:length])
+        sequence, payload = self._consistent(read)
+        return sequence, json.loads(payload) if payload else None
+
+    def read_history(self) -> Optional[np.ndarray]:
+        """Consistent copy of the published history pyramid state, None if none was published"""
+        return self._consistent(lambda: self.history[:int(self.header[_HISTORY_LEN])].copy()
+                                if self.header[_HISTORY_LEN] else None)
+
+    def batch_context(self) -> Dict[str, Optional[int]]:
+        """Batch and product code the buffers belong to"""
+        batch, code = self._consistent(lambda: (int(self.header[_BATCH]), int(self.header[_CODE])))
+        return {"batch": batch or None, "code": code or None}
+
+    def write_version(self) -> int:
+        """Changes with every write, also across ingester restarts (write time in ns)"""
+        return int(self.header[_UPDATED_NS])
+
+    def last_write_age(self) -> Optional[float]:
+        """Seconds since the last write, None if never written"""
+        updated_ns = int(self.header[_UPDATED_NS])
+        return time.time() - updated_ns / 1e9 if updated_ns else None
+
+    def stats(self) -> Dict[str, Any]:
+        age = self.last_write_age()
+        return {
+            "writes": int(self.header[_WRITES]),
+            "raw_rows": self.count('raw'),
+            "processed_rows": self.count('processed'),
+            "snapshot_sequence": self.snapshot_sequence(),
+            "last_write_age_seconds": round(age, 3) if age is not None else None
+        }
+
+class SharedSensorState(SensorStateBuffer):
+    """Sensor state in a named shared memory segment, created by the ingester and mapped by workers"""
+
+    def __init__(self, shm: shared_memory.SharedMemory, owner: bool):
+        super().__init__(shm.buf)
+        self.shm = shm
+        self.owner = owner
+
+    @classmethod
+    def create(cls, name: str = DEFAULT_SHARED_STATE_NAME, capacity: int = 60, n_sensors: int = 7,
+               snapshot_bytes: int = DEFAULT_SNAPSHOT_BYTES, history_bytes: int = 0) -> 'SharedSensorState':
+        """Create the segment (ingester side), replacing one left behind by a crashed ingester"""
+        size = cls.segment_size(capacity, n_sensors, snapshot_bytes, history_bytes)
+        try:
+            shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            logger.warning(f"Replacing stale shared sensor state segment {name}")
+            stale = shared_memory.SharedMemory(name=name)
+            # Tell workers still mapped to it to re-attach
+            np.ndarray((HEADER_SLOTS,), dtype=np.int64, buffer=stale.buf)[_MAGIC] = 0
+            stale.close()
+            stale.unlink()
+            shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+
+        cls.initialize(shm.buf, capacity, n_sensors, snapshot_bytes, history_bytes)
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name: str = DEFAULT_SHARED_STATE_NAME) -> 'SharedSensorState':
+        """Map an existing segment (worker side), raises FileNotFoundError if the ingester is not up"""
+        shm = shared_memory.SharedMemory(name=name)
+        # Python < 3.13 registers attached segments too and would unlink them when a worker exits
+        try:
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        except Exception:
+            pass
+        if not cls.has_layout(shm.buf):
+            shm.close()
+            raise ValueError(f"Shared segment {name} is not a sensor state segment (layout {LAYOUT_VERSION})")
+        return cls(shm, owner=False)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"segment": self.shm.name, "segment_bytes": self.shm.size, **super().stats()}
+
+    def close(self):
+        if self.owner:
+            self.header[_MAGIC] = 0
+        self._release_views()
+        self.shm.close()
+        if self.owner:
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
+
+class SharedStateClient:
+    """Lazily attaches to the ingester's segment, retrying at most once per `retry_interval`"""
+
+    def __init__(self, name: str = DEFAULT_SHARED_STATE_NAME, retry_interval: float = 1.0):
+        self.name = name
+        self.retry_interval = retry_interval
+        self.state: Optional[SharedSensorState] = None
+        self._last_attempt = 0.0
+
+    def get(self) -> Optional[SharedSensorState]:
+        if self.state is not None and self.state.retired:
+            logger.info(f"Shared sensor state {self.name} was replaced, re-attaching")
+            self.state = None
+        if self.state is None and time.monotonic() - self._last_attempt >= self.retry_interval:
+            self._last_attempt = time.monotonic()
+            try:
+                self.state = SharedSensorState.attach(self.name)
+                logger.info(f"Attached to shared sensor state {self.name}")
+            except FileNotFoundError:
+                logger.debug(f"Shared sensor state {self.name} not available yet")
+            except Exception as e:
+                logger.error(f"Could not attach to shared sensor state {self.name}: {e}")
+        return self.state
+
+class SharedBufferView:
+    """Read-only stand-in for a sensor deque, backed by one ring of the shared segment.
+
+    Supports what the request handlers use on the buffers: len(), truthiness, iteration
+    and indexing. Every access reads a consistent copy of the ring.
+    """
+
+    def __init__(self, client: SharedStateClient, which: str, maxlen: int = 60):
+        self.client = client
+        self.which = which
+        self.maxlen = maxlen
+
+    def _rows(self) -> List[List[float]]:
+        state = self.client.get()
+        return state.read_rows(self.which).tolist() if state is not None else []
+
+    def __len__(self) -> int:
+        state = self.client.get()
+        return state.count(self.which) if state is not None else 0
+
+    def __bool__(self) -> bool:
+        return len(self) > 0
+
+    def __iter__(self):
+        return iter(self._rows())
+
+    def __getitem__(self, index):
+        return self._rows()[index]
@@ -0,0 +1,113 @@
+"""
+Training Data Loaders for PharmaCopilot
+Loads the Phase-1 batch time series and builds held-out evaluation windows for the run-time models
+"""
+
+import glob
+import logging
+import os
+from typing import List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Per-batch sensor time series (Process/<code>.csv) and batch-level tables (Laboratory/Process/Normalization)
+PROCESS_DATA_DIR = os.environ.get('PROCESS_DATA_DIR', os.path.join(BASE_DIR, '..', 'Model Train Code', 'Process'))
+TABLE_DATA_DIR = os.environ.get('TABLE_DATA_DIR', os.path.join(BASE_DIR, '..', 'Data'))
+
+# Sensors used by the LSTM forecaster (same order as prediction_api.selected_sensors)
+FORECAST_SENSORS = ['waste', 'produced', 'ejection', 'tbl_speed', 'stiffness', 'SREL', 'main_comp']
+
+# Training setup from the Phase-1 F+C notebook
+SEQUENCE_LENGTH = 60
+FORECAST_HORIZON = 30
+WINDOW_STRIDE = 10
+HOLDOUT_FRACTION = 0.2
+
+def load_process_time_series(data_dir: Optional[str] = None) -> pd.DataFrame:
+    """Load every per-product time series file into one frame sorted by batch and timestamp"""
+    data_dir = data_dir or PROCESS_DATA_DIR
+    files = sorted(glob.glob(os.path.join(data_dir, '*.csv')))
+    if not files:
+        raise FileNotFoundError(f"No process time series files found in {data_dir}")
+
+    frames = [pd.read_csv(path, sep=';') for path in files]
+    df = pd.concat(frames, ignore_index=True)
+    df['timestamp'] = pd.to_datetime(df['timestamp'], errors='coerce')
+    df = df.sort_values(['batch', 'timestamp'], kind='mergesort').reset_index(drop=True)
+
+    logger.info(f"Loaded {len(df)} time series rows for {df['batch'].nunique()} batches from {len(files)} files")
+    return df
+
+def downtime_mask(df: pd.DataFrame, downtime_threshold: float = 0.1) -> pd.Series:
+    """Rows the training pipeline treated as downtime"""
+    mask = (df['tbl_speed'] <= downtime_threshold) | (df['produced'] <= 0)
+    if 'fom' in df.columns:
+        mask |= df['fom'] <= 0
+    return mask
+
+def split_holdout_batches(batch_ids: List[int], holdout_fraction: float = HOLDOUT_FRACTION) -> Tuple[List[int], List[int]]:
+    """Time-ordered split of batch ids, the last fraction is held out"""
+    ordered = sorted(batch_ids)
+    split_idx = int(len(ordered) * (1 - holdout_fraction))
+    return ordered[:split_idx], ordered[split_idx:]
+
+def build_forecast_windows(df: pd.DataFrame,
+                           batches: Optional[List[int]] = None,
+                           sensors: Optional[List[str]] = None,
+                           sequence_length: int = SEQUENCE_LENGTH,
+                           forecast_horizon: int = FORECAST_HORIZON,
+                           stride: int = WINDOW_STRIDE,
+                           max_windows: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Build within-batch (input, target) windows the same way the LSTM was trained.
+
+    Returns X of shape (n, sequence_length, n_sensors), y of shape
+    (n, forecast_horizon, n_sensors) and the batch id of every window.
+    """
+    sensors = sensors or FORECAST_SENSORS
+    clean = df[~downtime_mask(df)]
+    if batches is not None:
+        clean = clean[clean['batch'].isin(batches)]
+
+    span = sequence_length + forecast_horizon
+    X_parts, y_parts, batch_parts = [], [], []
+    for batch_id, batch_df in clean.groupby('batch', sort=True):
+        if len(batch_df) < span:
+            continue
+        values = batch_df[sensors].ffill().bfill().fillna(0).to_numpy(dtype=np.float32)
+
+        # All windows of the batch as strided views, then subsample by the training stride
+        windows = np.lib.stride_tricks.sliding_window_view(values, span, axis=0)[::stride]
+        windows = np.transpose(windows, (0, 2, 1))
+        X_parts.append(windows[:, :sequence_length])
+        y_parts.append(windows[:, sequence_length:])
+        batch_parts.append(np.full(len(windows), batch_id))
+
+    if not X_parts:
+        empty = np.empty((0, sequence_length, len(sensors)), dtype=np.float32)
+        return empty, np.empty((0, forecast_horizon, len(sensors)), dtype=np.float32), np.empty(0, dtype=int)
+
+    X = np.concatenate(X_parts)
+    y = np.concatenate(y_parts)
+    batch_ids = np.concatenate(batch_parts)
+
+    if max_windows is not None and len(X) > max_windows:
+        # Evenly spaced subsample keeps every held-out batch represented
+        idx = np.linspace(0, len(X) - 1, max_windows).astype(int)
+        X, y, batch_ids = X[idx], y[idx], batch_ids[idx]
+
+    return X, y, batch_ids
+
+def load_holdout_windows(data_dir: Optional[str] = None,
+                         holdout_fraction: float = HOLDOUT_FRACTION,
+                         max_windows: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Forecast windows from the held-out (most recent) batches"""
+    df = load_process_time_series(data_dir)
+    _, holdout_batches = split_holdout_batches(df['batch'].unique().tolist(), holdout_fraction)
+    X, y, batch_ids = build_forecast_windows(df, batches=holdout_batches, max_windows=max_windows)
+    logger.info(f"Built {len(X)} held-out windows from {len(holdout_batches)} batches")
+    return X, y, batch_ids
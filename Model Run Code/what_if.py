@@ -0,0 +1,120 @@
+"""
+What-If Scoring for PharmaCopilot
+Scores many hypothetical speed / compression / fill adjustments of the current window at once:
+all perturbed feature vectors are built in one NumPy operation and each classifier is called once
+"""
+
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+# RL action components and the engineered classifier features each one scales. Scaling a sensor
+# column of the window by (1 + a) scales these features by the same factor, so the perturbation
+# can be applied to the feature vector instead of recomputing features for every scenario.
+ADJUSTMENTS = ('speed_adjustment', 'compression_adjustment', 'fill_adjustment')
+ADJUSTED_FEATURES = {
+    'speed_adjustment': ('tbl_speed_mean', 'tbl_speed_change'),
+    'compression_adjustment': ('main_CompForce mean', 'main_CompForce_sd', 'pre_CompForce_mean'),
+    'fill_adjustment': ('tbl_fill_mean', 'tbl_fill_sd')
+}
+
+QUALITY_CLASSES = ['High', 'Low', 'Medium']
+
+def build_scenarios(scenarios: Optional[List[Dict[str, float]]] = None,
+                    grid: Optional[Dict[str, Sequence[float]]] = None) -> np.ndarray:
+    """(n, 3) relative adjustments from an explicit list and/or the cartesian product of a grid"""
+    rows = []
+    if scenarios:
+        rows.extend([float(s.get(name, 0.0)) for name in ADJUSTMENTS] for s in scenarios)
+    if grid:
+        unknown = set(grid) - set(ADJUSTMENTS)
+        if unknown:
+            raise ValueError(f"Unknown adjustments in grid: {sorted(unknown)}")
+        axes = [np.asarray(grid.get(name) or [0.0], dtype=np.float64) for name in ADJUSTMENTS]
+        mesh = np.meshgrid(*axes, indexing='ij')
+        rows.extend(np.stack([m.reshape(-1) for m in mesh], axis=1).tolist())
+    if not rows:
+        raise ValueError("Provide 'scenarios' and/or 'grid'")
+    adjustments = np.asarray(rows, dtype=np.float64)
+    if (adjustments <= -1.0).any():
+        raise ValueError("Adjustments are relative changes and must be greater than -1")
+    return adjustments
+
+def adjustment_matrix(feature_names: List[str]) -> np.ndarray:
+    """(3, n_features) indicator of the features each adjustment scales"""
+    matrix = np.zeros((len(ADJUSTMENTS), len(feature_names)))
+    for row, name in enumerate(ADJUSTMENTS):
+        for feature in ADJUSTED_FEATURES[name]:
+            if feature in feature_names:
+                matrix[row, feature_names.index(feature)] = 1.0
+    return matrix
+
+def perturb_features(base: np.ndarray, adjustments: np.ndarray, feature_names: List[str]) -> np.ndarray:
+    """(n, n_features) feature matrix: base * (1 + adjustments @ indicator)"""
+    return base[np.newaxis, :] * (1.0 + adjustments @ adjustment_matrix(feature_names))
+
+def score_scenarios(raw_features: Dict[str, float], adjustments: np.ndarray, feature_names: List[str],
+                    scaler, defect_classifier=None, quality_classifier=None) -> Dict[str, np.ndarray]:
+    """Defect and quality class probabilities for every scenario, one batched call per classifier"""
+    base = pd.Series(raw_features).reindex(feature_names, fill_value=0.0).to_numpy(dtype=np.float64)
+    # The unadjusted window is scored as row 0 so every scenario has its reference in the same batch
+    matrix = perturb_features(base, np.vstack([np.zeros((1, len(ADJUSTMENTS))), adjustments]), feature_names)
+    return score_feature_matrix(matrix, feature_names, scaler, defect_classifier, quality_classifier)
+
+def score_feature_matrix(matrix: np.ndarray, feature_names: List[str], scaler,
+                         defect_classifier=None, quality_classifier=None) -> Dict[str, np.ndarray]:
+    """Defect probability and quality class probabilities of (n, n_features) raw feature rows"""
+    scaled = scaler.transform(pd.DataFrame(matrix, columns=feature_names))
+
+    scores = {}
+    if defect_classifier is not None:
+        scores["defect"] = defect_classifier.predict_proba(scaled)[:, 1]
+    if quality_classifier is not None:
+        scores["quality"] = quality_classifier.predict_proba(scaled)
+    return scores
+
+def format_scenarios(adjustments: np.ndarray, scores: Dict[str, np.ndarray], limit: Optional[int] = None,
+                     sort_by: str = 'defect_probability') -> Dict[str, Any]:
+    """Baseline, per-scenario results (sorted, optionally truncated) and the best scenarios"""
+    defect = scores.get("defect")
+    quality = scores.get("quality")
+
+    def describe(index: int) -> Dict[str, Any]:
+        entry = {}
+        if defect is not None:
+            entry["defect_probability"] = float(defect[index])
+        if quality is not None:
+            entry["quality_class"] = QUALITY_CLASSES[int(quality[index].argmax())]
+            entry["class_probabilities"] = dict(zip(QUALITY_CLASSES, quality[index].tolist()))
+        return entry
+
+    n = len(adjustments)
+    if sort_by == 'high_quality_probability' and quality is not None:
+        order = np.argsort(-quality[1:, 0], kind='stable')
+    elif defect is not None:
+        order = np.argsort(defect[1:], kind='stable')
+    else:
+        order = np.arange(n)
+    if limit is not None:
+        order = order[:limit]
+
+    results = []
+    for i in order.tolist():
+        entry = {"adjustments": dict(zip(ADJUSTMENTS, adjustments[i].tolist())), **describe(i + 1)}
+        if defect is not None:
+            entry["defect_probability_change"] = float(defect[i + 1] - defect[0])
+        results.append(entry)
+
+    best = {}
+    if defect is not None:
+        i = int(np.argmin(defect[1:]))
+        best["lowest_defect_probability"] = {"adjustments": dict(zip(ADJUSTMENTS, adjustments[i].tolist())), **describe(i + 1)}
+    if quality is not None:
+        i = int(np.argmax(quality[1:, 0]))
+        best["highest_quality_probability"] = {"adjustments": dict(zip(ADJUSTMENTS, adjustments[i].tolist())), **describe(i + 1)}
+
+    return {"scenario_count": n, "baseline": describe(0), "best": best, "scenarios": results}
+
+def grid_product_size(grid: Dict[str, Sequence[float]]) -> int:
+    return int(np.prod([len(grid.get(name) or [0.0]) for name in ADJUSTMENTS])) if grid else 0
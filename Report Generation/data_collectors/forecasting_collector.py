@@ -30,7 +30,8 @@ class ForecastingCollector:
             
             async with aiohttp.ClientSession() as session:
                 # Collect from forecasting endpoint
-                async with session.get(f"{self.api_base_url}/api/forecast") as response:
+                # Ask for MC dropout intervals so the report can state a real confidence level
+                async with session.get(f"{self.api_base_url}/api/forecast", params={'uncertainty': 'true'}) as response:
                     if response.status == 200:
                         forecast_data = await response.json()
                         
@@ -50,6 +51,8 @@ class ForecastingCollector:
     def _process_forecast_data(self, raw_data: Dict[str, Any]) -> Dict[str, Any]:
         """Process raw forecasting data into structured format"""
         try:
+            uncertainty = raw_data.get('uncertainty') or {}
+            has_intervals = uncertainty.get('available', False)
             processed = {
                 'collection_timestamp': datetime.now().isoformat(),
                 'api_status': 'success',
@@ -58,10 +61,14 @@ class ForecastingCollector:
                 'data_sources': raw_data.get('data_sources', {}),
                 'model_info': {
                     'model_type': 'LSTM',
-                    'confidence_level': 0.85,
+                    'confidence_level': uncertainty.get('interval') if has_intervals else None,
+                    'uncertainty_method': uncertainty.get('method') if has_intervals else None,
+                    'interval_relative_width': uncertainty.get('mean_relative_width') if has_intervals else None,
                     'prediction_accuracy': 'high'
                 }
             }
+            if has_intervals:
+                processed['forecast_intervals'] = uncertainty.get('forecast', [])
             
             # Add trend analysis
             if processed['forecast']: